@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session, selectinload
 from typing import List
-from . import models, schemas, database, auth
+from . import models, schemas, database, auth, rbac, metrics, audit, audit_archive, pagination, replica
 
 router = APIRouter(
     prefix="/admin",
@@ -18,18 +18,28 @@ def check_read_access(current_user: models.User = Depends(auth.get_current_user)
     if current_user.role.name == "Admin":
         return current_user
     
-    # Check for 'user.read' or 'admin.access' permission
-    perms = [p.name for p in current_user.role.permissions]
-    if "user.read" in perms or "admin.access" in perms:
+    # Check for 'user.read' or 'admin.access' permission (own or inherited)
+    if rbac.has_permission(current_user, "user.read") or rbac.has_permission(current_user, "admin.access"):
         return current_user
         
     raise HTTPException(status_code=403, detail="Not authorized")
 
 # --- User Management ---
+# Read endpoints are async and run their queries through database.run(), so with
+# DATABASE_ASYNC=1 they wait on the database without holding a threadpool thread.
+# Results are serialized inside run(): on the async engine relationships can only
+# load there. They read from the replica, if any (see replica.py).
 @router.get("/users", response_model=List[schemas.User])
-def read_users(current_user: models.User = Depends(check_read_access), db: Session = Depends(database.get_db)):
-    users = db.query(models.User).all()
-    return users
+async def read_users(current_user: models.User = Depends(check_read_access), db=Depends(replica.get_read_session)):
+    return await database.run(db, _read_users)
+
+def _read_users(db: Session):
+    users = db.query(models.User).options(
+        selectinload(models.User.role).selectinload(models.Role.permissions),
+        selectinload(models.User.location),
+        selectinload(models.User.team)
+    ).all()
+    return [schemas.User.model_validate(u) for u in users]
 
 @router.post("/users", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, current_user: models.User = Depends(check_admin), db: Session = Depends(database.get_db)):
@@ -46,13 +56,10 @@ def create_user(user: schemas.UserCreate, current_user: models.User = Depends(ch
         team_id=user.team_id
     )
     db.add(db_user)
+    audit.record(current_user.id, "ADMIN_CREATE_USER", f"Created user {user.email}", db=db)
     db.commit()
     db.refresh(db_user)
-    
-    # Audit
-    log = models.AuditLog(user_id=current_user.id, action="ADMIN_CREATE_USER", details=f"Created user {user.email}")
-    db.add(log)
-    db.commit()
+    auth.invalidate_principals()
     
     return db_user
 
@@ -64,12 +71,9 @@ def unlock_user(user_id: int, current_user: models.User = Depends(check_admin),
     
     user.locked_until = None
     user.failed_login_attempts = 0
+    audit.record(current_user.id, "ADMIN_UNLOCK_USER", f"Unlocked user {user.email}", db=db)
     db.commit()
-    
-    # Audit
-    log = models.AuditLog(user_id=current_user.id, action="ADMIN_UNLOCK_USER", details=f"Unlocked user {user.email}")
-    db.add(log)
-    db.commit()
+    auth.invalidate_principals()
     
     return {"message": "User unlocked successfully"}
 
@@ -87,12 +91,9 @@ def admin_reset_password(
     # Use provided password instead of hardcoded default
     temp_password = reset_data.new_password
     user.password_hash = auth.get_password_hash(temp_password)
+    audit.record(current_user.id, "ADMIN_RESET_PASSWORD", f"Reset password for {user.email}", db=db)
     db.commit()
-    
-    # Audit
-    log = models.AuditLog(user_id=current_user.id, action="ADMIN_RESET_PASSWORD", details=f"Reset password for {user.email}")
-    db.add(log)
-    db.commit()
+    auth.invalidate_principals()
     
     return {"message": "Password reset successfully"}
 
@@ -107,30 +108,33 @@ def update_user_role_loc(user_id: int, update_data: schemas.AdminUserUpdate, cur
     if update_data.team_id: user.team_id = update_data.team_id
     if update_data.phone_number: user.phone_number = update_data.phone_number
     
+    audit.record(current_user.id, "ADMIN_UPDATE_USER", f"Updated User #{user.id} Role/Loc", db=db)
     db.commit()
     db.refresh(user)
-    
-    # Audit
-    log = models.AuditLog(user_id=current_user.id, action="ADMIN_UPDATE_USER", details=f"Updated User #{user.id} Role/Loc")
-    db.add(log)
-    db.commit()
+    auth.invalidate_principals()
     return user
 
 # --- Metadata Management ---
 @router.get("/permissions", response_model=List[schemas.Permission])
-def read_permissions(current_user: models.User = Depends(check_read_access), db: Session = Depends(database.get_db)):
-    return db.query(models.Permission).all()
+async def read_permissions(current_user: models.User = Depends(check_read_access), db=Depends(replica.get_read_session)):
+    return await database.run(db, lambda db: [schemas.Permission.model_validate(p) for p in db.query(models.Permission).all()])
 
 @router.get("/roles", response_model=List[schemas.Role])
-def read_roles(current_user: models.User = Depends(check_read_access), db: Session = Depends(database.get_db)):
-    return db.query(models.Role).all()
+async def read_roles(current_user: models.User = Depends(check_read_access), db=Depends(replica.get_read_session)):
+    return await database.run(db, lambda db: [
+        schemas.Role.model_validate(role) for role in db.query(models.Role).options(selectinload(models.Role.permissions)).all()
+    ])
 
 @router.post("/roles", response_model=schemas.Role)
 def create_role(role: schemas.RoleBase, current_user: models.User = Depends(check_admin), db: Session = Depends(database.get_db)):
-    db_role = models.Role(name=role.name)
+    if role.parent_id is not None and not db.query(models.Role).filter(models.Role.id == role.parent_id).first():
+        raise HTTPException(status_code=400, detail="Parent role not found")
+    db_role = models.Role(name=role.name, parent_id=role.parent_id)
     db.add(db_role)
     db.commit()
     db.refresh(db_role)
+    rbac.rebuild(db)
+    auth.invalidate_principals()
     return db_role
 
 @router.put("/roles/{role_id}/permissions")
@@ -146,18 +150,16 @@ def update_role_permissions(
     
     perms = db.query(models.Permission).filter(models.Permission.id.in_(update.permission_ids)).all()
     role.permissions = perms
+    audit.record(current_user.id, "ADMIN_UPDATE_ROLE_PERMS", f"Updated permissions for role {role.name}", db=db)
     db.commit()
-    
-    # Audit
-    log = models.AuditLog(user_id=current_user.id, action="ADMIN_UPDATE_ROLE_PERMS", details=f"Updated permissions for role {role.name}")
-    db.add(log)
-    db.commit()
+    rbac.rebuild(db)
+    auth.invalidate_principals()
     
     return {"message": "Permissions updated"}
 
 @router.get("/locations", response_model=List[schemas.Location])
-def read_locations(current_user: models.User = Depends(check_read_access), db: Session = Depends(database.get_db)):
-    return db.query(models.Location).all()
+async def read_locations(current_user: models.User = Depends(check_read_access), db=Depends(replica.get_read_session)):
+    return await database.run(db, lambda db: [schemas.Location.model_validate(l) for l in db.query(models.Location).all()])
 
 @router.post("/locations", response_model=schemas.Location)
 def create_location(location: schemas.LocationBase, current_user: models.User = Depends(check_admin), db: Session = Depends(database.get_db)):
@@ -168,8 +170,8 @@ def create_location(location: schemas.LocationBase, current_user: models.User =
     return db_loc
 
 @router.get("/teams", response_model=List[schemas.Team])
-def read_teams(current_user: models.User = Depends(check_read_access), db: Session = Depends(database.get_db)):
-    return db.query(models.Team).all()
+async def read_teams(current_user: models.User = Depends(check_read_access), db=Depends(replica.get_read_session)):
+    return await database.run(db, lambda db: [schemas.Team.model_validate(t) for t in db.query(models.Team).all()])
 
 @router.post("/teams", response_model=schemas.Team)
 def create_team(team: schemas.TeamBase, current_user: models.User = Depends(check_admin), db: Session = Depends(database.get_db)):
@@ -179,20 +181,39 @@ def create_team(team: schemas.TeamBase, current_user: models.User = Depends(chec
     db.refresh(db_team)
     return db_team
 
+# --- Metrics ---
+@router.get("/metrics")
+def read_metrics(current_user: models.User = Depends(check_admin)):
+    """Per-endpoint latency of this backend process, the password hashing queue and the audit writer."""
+    return {"endpoints": metrics.latency.summary(), "password_hashing": auth.hashing_stats(), "audit": audit.stats()}
+
 # --- Audit Logs ---
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from typing import Optional
+from sqlalchemy import tuple_
 
 @router.get("/audit-logs", response_model=List[schemas.AuditLog])
 def read_audit_logs(
+    response: Response,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
+    user_id: Optional[int] = None,
+    action: Optional[str] = None,
     sort_order: str = "desc",
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(check_admin), 
     db: Session = Depends(database.get_db)
 ):
+    audit.flush() # Include events this process has queued but not yet written
     query = db.query(models.AuditLog)
 
+    # Each filter combination is served by an index ending in (timestamp, id)
+    if user_id is not None:
+        query = query.filter(models.AuditLog.user_id == user_id)
+    if action:
+        query = query.filter(models.AuditLog.action == action)
+
     if start_date:
         query = query.filter(models.AuditLog.timestamp >= start_date)
     
@@ -201,10 +222,39 @@ def read_audit_logs(
         next_day = end_date + timedelta(days=1)
         query = query.filter(models.AuditLog.timestamp < next_day)
 
+    # Keyset pagination on (timestamp, id): the next page starts after the last row
+    # of this one, so deep pages cost the same as the first
+    key = tuple_(models.AuditLog.timestamp, models.AuditLog.id)
+    after = None
+    if cursor:
+        after_timestamp, after_id = pagination.decode_cursor(cursor, str, int)
+        try:
+            after = (datetime.fromisoformat(after_timestamp), after_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(key > after if sort_order == "asc" else key < after)
+
     if sort_order == "asc":
-        query = query.order_by(models.AuditLog.timestamp.asc())
+        query = query.order_by(models.AuditLog.timestamp.asc(), models.AuditLog.id.asc())
     else:
-        query = query.order_by(models.AuditLog.timestamp.desc())
+        query = query.order_by(models.AuditLog.timestamp.desc(), models.AuditLog.id.desc())
+
+    logs = query.limit(limit).all()
+
+    # Months moved to the cold archive (see audit_archive.py) are older than anything
+    # in the table; their segments are scanned only when start_date reaches back
+    if start_date and (sort_order == "asc" or len(logs) < limit):
+        try:
+            archived = audit_archive.scan(
+                datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date + timedelta(days=1), datetime.min.time()) if end_date else None,
+                user_id=user_id, action=action, after=after, descending=sort_order != "asc", limit=limit
+            )
+        except audit_archive.ArchiveCorrupted as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        logs = (archived + logs if sort_order == "asc" else logs + archived)[:limit]
 
-    logs = query.limit(200).all()
+    if len(logs) == limit:
+        last = logs[-1]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last.timestamp.isoformat(), last.id)
     return logs
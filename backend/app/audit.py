@@ -0,0 +1,138 @@
+from sqlalchemy.orm import Session
+from . import models, bulk_load
+from .database import SessionLocal
+import datetime
+import logging
+import os
+import threading
+
+# Audit sink. Events that only record that something happened (a view, an
+# export, a failed login) are queued and written by a background thread in
+# multi-row batches (COPY on Postgres, see bulk_load), so a request no longer
+# pays for its own audit commit. A batch is written once AUDIT_BATCH_SIZE events
+# are waiting, or at most AUDIT_FLUSH_SECONDS after the first of them was queued.
+# Timestamps are taken when the event is recorded, not when it is written.
+# Events that must be atomic with a data change pass the request's session
+# (record(..., db=db)) and are written in that transaction instead.
+# AUDIT_MODE=sync writes every queued event at once in its own commit (the old
+# behaviour), for deployments that cannot lose the last flush window on a crash.
+MODE = os.getenv("AUDIT_MODE", "async")
+BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0"))
+# Past this many unwritten events (e.g. the database is down) callers write their own
+QUEUE_LIMIT = int(os.getenv("AUDIT_QUEUE_LIMIT", "100000"))
+
+logger = logging.getLogger(__name__)
+
+def _write(events: list):
+    db = SessionLocal()
+    try:
+        bulk_load.insert_rows(db, models.AuditLog, events)
+        db.commit()
+    finally:
+        db.close()
+
+class AuditSink:
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_seconds: float = FLUSH_SECONDS, queue_limit: int = QUEUE_LIMIT):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_limit = queue_limit
+        self._pending = []
+        self._written = 0
+        self._failed_batches = 0
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock() # One batch in flight, so flush() also waits for the thread's batch
+        self._thread = None
+        self._stopped = False
+
+    def enqueue(self, event: dict):
+        with self._cond:
+            overflow = len(self._pending) >= self.queue_limit
+            if not overflow:
+                self._pending.append(event)
+                if self._thread is None and not self._stopped:
+                    self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                    self._thread.start()
+                # The first pending event starts the flush timer, a full batch ends it
+                if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                    self._cond.notify()
+        if overflow:
+            _write([event])
+        elif self._stopped:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._stopped:
+                    self._cond.wait()
+                if len(self._pending) < self.batch_size and not self._stopped:
+                    self._cond.wait(self.flush_seconds) # Let a batch build up
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit batch write failed; retrying")
+                with self._cond:
+                    self._cond.wait(self.flush_seconds)
+
+    def flush(self) -> int:
+        """Write every event recorded so far. On failure the batch is kept for the next attempt and the error raised."""
+        with self._write_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            written = 0
+            try:
+                while written < len(batch):
+                    chunk = batch[written:written + self.batch_size]
+                    _write(chunk)
+                    written += len(chunk)
+            except Exception:
+                with self._cond:
+                    self._failed_batches += 1
+                    self._pending[:0] = batch[written:]
+                raise
+            finally:
+                with self._cond:
+                    self._written += written
+            return written
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"mode": MODE, "pending": len(self._pending), "written": self._written, "failed_batches": self._failed_batches}
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Audit events lost at shutdown")
+
+_sink = AuditSink()
+
+def record(user_id: int, action: str, details: str = None, db: Session = None):
+    """
+    Record an audit event. With `db` the row is added to that session and commits
+    (or rolls back) with the caller's transaction; otherwise it is queued.
+    """
+    event = {"user_id": user_id, "action": action, "details": details, "timestamp": datetime.datetime.utcnow()}
+    if db is not None:
+        db.add(models.AuditLog(**event))
+    elif MODE == "sync":
+        _write([event])
+    else:
+        _sink.enqueue(event)
+
+def flush() -> int:
+    return _sink.flush()
+
+def stats() -> dict:
+    return _sink.stats()
+
+def shutdown():
+    _sink.shutdown()
@@ -0,0 +1,310 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from . import models, bulk_load
+from .database import SessionLocal
+import collections
+import datetime
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import threading
+
+# Cold storage for old audit events. On Postgres, `partition` turns audit_logs
+# into a table range-partitioned by month of `timestamp` (existing rows become the
+# DEFAULT partition). `archive` writes every complete month older than
+# AUDIT_RETENTION_DAYS to a gzip-compressed JSONL segment in AUDIT_ARCHIVE_DIR,
+# records its row count and SHA-256 in the manifest, and only then drops the
+# month's partition (or deletes its rows where the month has no partition of its
+# own, e.g. the DEFAULT partition or other engines). Re-running after a crash
+# merges into the existing segment by id, so no event is lost or duplicated.
+# read_audit_logs scans the segments a requested date range reaches.
+ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "90"))
+MONTHS_AHEAD = 3 # Partitions created in advance, so inserts never hit the DEFAULT partition
+MANIFEST_FILE = "manifest.json"
+COLUMNS = ("id", "user_id", "action", "details", "timestamp")
+ARCHIVE_BATCH_SIZE = 5000 # Rows fetched per round trip while archiving
+READ_BLOCK_BYTES = 1024 * 1024
+INDEXES = ("ix_audit_logs_id", "ix_audit_logs_timestamp", "ix_audit_logs_user_timestamp", "ix_audit_logs_action_timestamp")
+
+class ArchiveCorrupted(Exception):
+    pass
+
+def month_start(day) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+def next_month(month: datetime.date) -> datetime.date:
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def partition_name(month: datetime.date) -> str:
+    return f"audit_logs_{month:%Y_%m}"
+
+# --- Partitioning (Postgres) ---
+
+def is_partitioned(db: Session) -> bool:
+    if not bulk_load.is_postgres(db):
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'audit_logs'"
+    )).first() is not None
+
+def partition(db: Session) -> bool:
+    """Convert audit_logs into monthly range partitions, in one transaction. False if it already is."""
+    if not bulk_load.is_postgres(db):
+        raise RuntimeError("Partitioning audit_logs needs PostgreSQL")
+    if is_partitioned(db):
+        return False
+    db.execute(text("LOCK TABLE audit_logs IN ACCESS EXCLUSIVE MODE"))
+    # The current table (and all its rows) becomes the DEFAULT partition, so nothing is copied
+    db.execute(text("ALTER TABLE audit_logs RENAME TO audit_logs_default"))
+    # Replaced by the partitioned table's (id, timestamp) key when the table is attached
+    db.execute(text("ALTER TABLE audit_logs_default DROP CONSTRAINT audit_logs_pkey"))
+    for index in INDEXES:
+        db.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index.replace('audit_logs', 'audit_logs_default')}"))
+    db.execute(text("ALTER TABLE audit_logs_default ALTER COLUMN id DROP DEFAULT"))
+    db.execute(text("ALTER TABLE audit_logs_default ALTER COLUMN timestamp SET NOT NULL"))
+    # A partitioned table's primary key must include the partition key
+    db.execute(text("""
+        CREATE TABLE audit_logs (
+            id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'::regclass),
+            user_id INTEGER REFERENCES users(id),
+            action VARCHAR,
+            details VARCHAR,
+            timestamp TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    db.execute(text("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id"))
+    db.execute(text("CREATE INDEX ix_audit_logs_timestamp ON audit_logs (timestamp, id)"))
+    db.execute(text("CREATE INDEX ix_audit_logs_user_timestamp ON audit_logs (user_id, timestamp, id)"))
+    db.execute(text("CREATE INDEX ix_audit_logs_action_timestamp ON audit_logs (action, timestamp, id)"))
+    db.execute(text("ALTER TABLE audit_logs ATTACH PARTITION audit_logs_default DEFAULT"))
+    db.commit()
+    return True
+
+def _has_partition(db: Session, month: datetime.date) -> bool:
+    return db.execute(text(
+        "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'audit_logs'::regclass AND c.relname = :name"
+    ), {"name": partition_name(month)}).first() is not None
+
+def ensure_partitions(db: Session, months_ahead: int = MONTHS_AHEAD) -> list:
+    """Create the partitions for this month and the next `months_ahead`. Returns the names created."""
+    created = []
+    month = month_start(datetime.datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        if not _has_partition(db, month):
+            try:
+                with db.begin_nested():
+                    db.execute(text(
+                        f"CREATE TABLE {partition_name(month)} PARTITION OF audit_logs "
+                        f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+                    ))
+                created.append(partition_name(month))
+            except Exception:
+                # The DEFAULT partition already holds rows of this month; they stay there
+                print(f"[WARN] Skipped {partition_name(month)}: the DEFAULT partition has rows in that range")
+        month = next_month(month)
+    db.commit()
+    return created
+
+# --- Segments ---
+
+def _path(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, name)
+
+def read_manifest() -> dict:
+    """{"YYYY-MM": {"file", "rows", "sha256"}} for every archived month."""
+    try:
+        with open(_path(MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _write_atomic(name: str, data: bytes):
+    tmp = _path(name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _path(name))
+
+_verified = {} # file name -> sha256 already checked in this process
+_verified_lock = threading.Lock()
+
+def _verify(entry: dict):
+    with _verified_lock:
+        if _verified.get(entry["file"]) == entry["sha256"]:
+            return
+    digest = hashlib.sha256()
+    with open(_path(entry["file"]), "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b""):
+            digest.update(block)
+    if digest.hexdigest() != entry["sha256"]:
+        raise ArchiveCorrupted(f"Audit archive segment {entry['file']} does not match its checksum")
+    with _verified_lock:
+        _verified[entry["file"]] = entry["sha256"]
+
+def _iter_segment(entry: dict):
+    """A segment's rows in (timestamp, id) order, decoded one line at a time."""
+    _verify(entry)
+    with gzip.open(_path(entry["file"]), "rt") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+                yield row
+
+class _HashingWriter:
+    """File wrapper that hashes the (compressed) bytes as they are written."""
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.digest.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+def _write_segment(month: datetime.date, rows) -> dict:
+    """Stream `rows` (in (timestamp, id) order) into a new segment and return its manifest entry."""
+    tmp = _path(f"audit-{month:%Y-%m}.jsonl.gz.tmp")
+    count = 0
+    with open(tmp, "wb") as f:
+        hashed = _HashingWriter(f)
+        with gzip.GzipFile(fileobj=hashed, mode="wb") as out:
+            for row in rows:
+                out.write((json.dumps({**row, "timestamp": row["timestamp"].isoformat()}, separators=(",", ":")) + "\n").encode())
+                count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    digest = hashed.digest.hexdigest()
+    # Content-addressed name: a rewrite never replaces the file a reader may be verifying
+    entry = {"file": f"audit-{month:%Y-%m}-{digest[:12]}.jsonl.gz", "rows": count, "sha256": digest}
+    os.replace(tmp, _path(entry["file"]))
+    return entry
+
+def _merge(new_rows, old_rows):
+    """Merge two (timestamp, id)-ordered row streams; an id in both keeps the new row."""
+    last = None
+    for row in heapq.merge(new_rows, old_rows, key=lambda r: (r["timestamp"], r["id"])):
+        key = (row["timestamp"], row["id"])
+        if key != last: # On equal keys heapq.merge yields new_rows first
+            last = key
+            yield row
+
+# --- Archiving ---
+
+def archive_month(db: Session, month: datetime.date) -> int:
+    """Move one month of audit events from the database into its segment. Returns the rows moved."""
+    start, end = month_start(month), next_month(month_start(month))
+    in_month = (models.AuditLog.timestamp >= start) & (models.AuditLog.timestamp < end)
+    if db.query(models.AuditLog.id).filter(in_month).first() is None:
+        return 0
+
+    # Rows are streamed from the table (and the previous segment) into the new
+    # segment, so memory does not grow with the month
+    moved = 0
+    def table_rows():
+        nonlocal moved
+        query = db.query(*(getattr(models.AuditLog, c) for c in COLUMNS)).filter(in_month)\
+            .order_by(models.AuditLog.timestamp, models.AuditLog.id).yield_per(ARCHIVE_BATCH_SIZE)
+        for r in query:
+            moved += 1
+            yield dict(zip(COLUMNS, r))
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    manifest = read_manifest()
+    key = f"{start:%Y-%m}"
+    previous = manifest.get(key)
+    manifest[key] = _write_segment(start, _merge(table_rows(), _iter_segment(previous) if previous else iter(())))
+    _write_atomic(MANIFEST_FILE, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    if previous and previous["file"] != manifest[key]["file"]:
+        os.remove(_path(previous["file"]))
+
+    # The segment is durable: now the rows can go
+    if is_partitioned(db) and _has_partition(db, start):
+        db.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {partition_name(start)}"))
+        db.execute(text(f"DROP TABLE {partition_name(start)}"))
+    else:
+        db.query(models.AuditLog).filter(in_month).delete(synchronize_session=False)
+    db.commit()
+    return moved
+
+def archive(db: Session, retention_days: int = RETENTION_DAYS) -> dict:
+    """Archive every complete month that ends more than `retention_days` ago. Returns {"YYYY-MM": rows}."""
+    cutoff = month_start(datetime.datetime.utcnow() - datetime.timedelta(days=retention_days))
+    oldest = db.query(models.AuditLog.timestamp).filter(models.AuditLog.timestamp < cutoff).order_by(models.AuditLog.timestamp).first()
+    moved = {}
+    month = month_start(oldest[0]) if oldest else cutoff
+    while month < cutoff:
+        count = archive_month(db, month)
+        if count:
+            moved[f"{month:%Y-%m}"] = count
+        month = next_month(month)
+    return moved
+
+# --- Reads ---
+
+def _scan_segment(entry: dict, start: datetime.datetime, end: datetime.datetime, user_id: int, action: str,
+                  after: tuple, descending: bool, limit: int) -> list:
+    """Up to `limit` matching rows of one segment in scan order. Memory is bounded by `limit`."""
+    found = collections.deque(maxlen=limit) if descending else []
+    for row in _iter_segment(entry):
+        key = (row["timestamp"], row["id"])
+        if (end is not None and row["timestamp"] >= end) or (descending and after is not None and key >= after):
+            break # Segments are in ascending order: nothing further qualifies
+        if row["timestamp"] < start or (not descending and after is not None and key <= after):
+            continue
+        if (user_id is None or row["user_id"] == user_id) and (action is None or row["action"] == action):
+            found.append(row)
+            if not descending and len(found) >= limit:
+                break
+    return list(reversed(found)) if descending else found
+
+def scan(start: datetime.datetime, end: datetime.datetime = None, user_id: int = None, action: str = None,
+         after: tuple = None, descending: bool = True, limit: int = 200) -> list:
+    """
+    Archived events in [start, end) matching the filters, ordered by (timestamp, id)
+    and starting after the keyset `after`, as transient AuditLog objects. Only the
+    segments of months in the range are read, line by line.
+    """
+    manifest = read_manifest()
+    found = []
+    for key in sorted(manifest, reverse=descending):
+        if len(found) >= limit: # Months do not overlap, so later segments only sort after these
+            break
+        month = datetime.date.fromisoformat(key + "-01")
+        first, last = datetime.datetime.combine(month, datetime.time()), datetime.datetime.combine(next_month(month), datetime.time())
+        if last <= start or (end is not None and first >= end):
+            continue
+        found.extend(_scan_segment(manifest[key], start, end, user_id, action, after, descending, limit - len(found)))
+    return [models.AuditLog(**row) for row in found]
+
+if __name__ == "__main__":
+    # docker-compose exec backend python -m app.audit_archive partition   (once, Postgres)
+    # docker-compose exec backend python -m app.audit_archive archive     (e.g. daily from cron)
+    import argparse
+    parser = argparse.ArgumentParser(description="Partition audit_logs by month and archive old months to compressed segments.")
+    parser.add_argument("command", choices=["partition", "archive"])
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="keep events newer than this in the database")
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD, help="future monthly partitions to create")
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        if args.command == "partition":
+            print("Converted audit_logs to monthly partitions" if partition(db) else "audit_logs is already partitioned")
+        if is_partitioned(db):
+            for name in ensure_partitions(db, args.months_ahead):
+                print(f"Created partition {name}")
+        if args.command == "archive":
+            moved = archive(db, args.retention_days)
+            for month, count in moved.items():
+                print(f"Archived {count} audit events of {month}")
+            print(f"Segments in {os.path.abspath(ARCHIVE_DIR)}" if moved else "Nothing to archive")
+    finally:
+        db.close()
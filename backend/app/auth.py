@@ -1,12 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from . import schemas, models, database
+import asyncio
 import os
+import threading
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
@@ -17,11 +20,55 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# --- Password Hashing Executor ---
+# bcrypt is deliberately slow. Running it on the shared request threadpool lets a
+# burst of logins starve every other endpoint, so hashing gets its own small
+# pool. At most HASH_WORKERS run and HASH_QUEUE_LIMIT wait; beyond that callers
+# get a 503 straight away instead of queueing.
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_lock = threading.Lock()
+_hash_pending = 0 # Running + queued
+_hash_rejected = 0
+
+def _hash_done(_future):
+    global _hash_pending
+    with _hash_lock:
+        _hash_pending -= 1
+
+def _submit_hash(func, *args):
+    global _hash_pending, _hash_rejected
+    with _hash_lock:
+        if _hash_pending >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+            _hash_rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password operations in progress. Try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        _hash_pending += 1
+    future = _hash_executor.submit(func, *args)
+    future.add_done_callback(_hash_done)
+    return future
+
+def hashing_stats() -> dict:
+    with _hash_lock:
+        return {"workers": HASH_WORKERS, "queue_limit": HASH_QUEUE_LIMIT, "pending": _hash_pending, "rejected": _hash_rejected}
+
+def shutdown_hashing():
+    _hash_executor.shutdown(wait=False, cancel_futures=True)
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return _submit_hash(pwd_context.verify, plain_password, hashed_password).result()
+
+async def verify_password_async(plain_password, hashed_password):
+    """verify_password() without holding a request thread while waiting."""
+    return await asyncio.wrap_future(_submit_hash(pwd_context.verify, plain_password, hashed_password))
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _submit_hash(pwd_context.hash, password).result()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -29,7 +76,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # iat makes every login a distinct principal cache key
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -39,13 +87,79 @@ def create_password_reset_token(email: str):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+from collections import OrderedDict
 from sqlalchemy.orm import Session, joinedload
 from . import schemas, models, database
 import os
+import threading
+import time
+
+# --- Principal Cache ---
+# Resolving the user behind a token (User + Role + Permissions + Location + Team)
+# is the most frequent query in the app. Resolved users are cached detached,
+# keyed by (subject, token issue time), and merged into the request's session
+# without SQL. Endpoints that change users, roles or permissions call
+# invalidate_principals(), which bumps a version and so drops every entry.
+# The version is per process: other workers pick changes up within the TTL.
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+
+class PrincipalCache:
+    """LRU of resolved users, bounded by size and TTL, invalidated by a version counter."""
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict() # (email, iat) -> (version, expires_at, user)
+        self._lock = threading.Lock()
 
-# ... imports ...
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, expires_at, user = entry
+            if version != self.version or expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    def put(self, key, version: int, user):
+        with self._lock:
+            if version != self.version:
+                return # Invalidated while this user was being loaded
+            self._entries[key] = (version, time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+principal_cache = PrincipalCache()
+
+def invalidate_principals():
+    """Call after committing a change to users, roles or permissions."""
+    principal_cache.invalidate()
+
+def _load_principal(email: str):
+    """The user with role, permissions, location and team loaded, detached from any session."""
+    db = database.SessionLocal()
+    try:
+        # Eager load relationships to ensure Pydantic schema can serialize permissions/team/location
+        return db.query(models.User).options(
+            joinedload(models.User.role).joinedload(models.Role.permissions),
+            joinedload(models.User.location),
+            joinedload(models.User.team)
+        ).filter(models.User.email == email).first()
+    finally:
+        db.close()
+
+def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -60,14 +174,16 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-        
-    # Eager load relationships to ensure Pydantic schema can serialize permissions/team/location
-    user = db.query(models.User).options(
-        joinedload(models.User.role).joinedload(models.Role.permissions),
-        joinedload(models.User.location),
-        joinedload(models.User.team)
-    ).filter(models.User.email == token_data.email).first()
-    
+
+    key = (token_data.email, payload.get("iat"))
+    user = principal_cache.get(key)
     if user is None:
-        raise credentials_exception
-    return user
+        version = principal_cache.version
+        user = _load_principal(token_data.email)
+        if user is None:
+            raise credentials_exception
+        principal_cache.put(key, version, user)
+
+    request.state.user_id = user.id # For main.track_writes (read-your-writes, see replica.py)
+    # A per-request copy in the request's session (no SQL), so endpoints can modify it
+    return db.merge(user, load=False)
@@ -0,0 +1,60 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import io
+
+# Bulk writers for large uploads. On Postgres rows are streamed with
+# COPY FROM STDIN over the session's own DBAPI connection, so they commit or
+# roll back together with everything else in the transaction (e.g. audit rows).
+# Other engines fall back to the ORM's executemany-based bulk insert.
+
+def is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+def _copy_value(value) -> str:
+    # COPY text format: \N is NULL; backslash, tab and newlines must be escaped
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_rows(db: Session, table: str, columns: list, rows):
+    """COPY `rows` (iterables of values, in `columns` order; None is NULL) into `table`. Postgres only."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(v) for v in row))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+def insert_rows(db: Session, model, mappings: list):
+    """Insert plain mappings (no generated values needed back)."""
+    if not mappings:
+        return
+    if is_postgres(db):
+        columns = list(mappings[0].keys())
+        copy_rows(db, model.__tablename__, columns, ([m[c] for c in columns] for m in mappings))
+    else:
+        db.bulk_insert_mappings(model, mappings)
+
+def insert_with_ids(db: Session, model, mappings: list):
+    """
+    Insert mappings and set each mapping's "id" to its generated primary key.
+    On Postgres the ids are reserved from the table's sequence up front so the
+    rows can still be COPYed.
+    """
+    if not mappings:
+        return
+    if is_postgres(db):
+        ids = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+            {"table": model.__tablename__, "n": len(mappings)}
+        ).scalars().all()
+        for mapping, new_id in zip(mappings, ids):
+            mapping["id"] = new_id
+        insert_rows(db, model, mappings)
+    else:
+        db.bulk_insert_mappings(model, mappings, return_defaults=True)
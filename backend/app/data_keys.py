@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from cryptography.fernet import Fernet
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import models, security
+from .database import SessionLocal
+import os
+import threading
+
+# Envelope encryption. Each manager's patient PII is encrypted with that
+# manager's own data key (DEK). The data_keys table stores DEKs only wrapped
+# (sealed) under the master key from the keyring, so rotating the master key
+# re-wraps one small row per manager instead of re-encrypting every patient.
+# Ciphertext headers carry the DEK's key id, which is how reads find the key.
+# Unwrapped DEKs are kept in a bounded in-process LRU.
+CACHE_SIZE = int(os.getenv("DATA_KEY_CACHE_SIZE", "1024"))
+
+class DataKeyCache:
+    """LRU of unwrapped data keys by key id, with a manager -> key id map for writes."""
+
+    def __init__(self, max_keys: int = CACHE_SIZE):
+        self.max_keys = max_keys
+        self._keys = OrderedDict() # key id -> (manager_id, key)
+        self._by_manager = {}      # manager_id -> key id
+        self._lock = threading.Lock()
+
+    def get(self, kid: str):
+        with self._lock:
+            entry = self._keys.get(kid)
+            if entry is None:
+                return None
+            self._keys.move_to_end(kid)
+            return entry[1]
+
+    def for_manager(self, manager_id: int):
+        with self._lock:
+            kid = self._by_manager.get(manager_id)
+            if kid is None:
+                return None
+            self._keys.move_to_end(kid)
+            return self._keys[kid][1]
+
+    def put(self, kid: str, manager_id: int, key: str):
+        with self._lock:
+            self._keys[kid] = (manager_id, key)
+            self._keys.move_to_end(kid)
+            self._by_manager[manager_id] = kid
+            while len(self._keys) > self.max_keys:
+                old_kid, (old_manager, _) = self._keys.popitem(last=False)
+                if self._by_manager.get(old_manager) == old_kid:
+                    del self._by_manager[old_manager]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._by_manager.clear()
+
+_cache = DataKeyCache()
+
+def resolve(kids) -> dict:
+    """Unwrapped manager data keys for the given key ids ({key id: key}). Unknown ids are left out."""
+    keys = {}
+    missing = []
+    for kid in kids:
+        key = _cache.get(kid)
+        if key:
+            keys[kid] = key
+        else:
+            missing.append(kid)
+    if not missing:
+        return keys
+
+    db = SessionLocal()
+    try:
+        rows = db.query(models.DataKey).filter(
+            models.DataKey.key_id.in_(missing),
+            models.DataKey.manager_id.isnot(None)
+        ).all()
+    finally:
+        db.close()
+    for row in rows:
+        try:
+            key = security.unseal(row.wrapped_key)
+        except Exception:
+            continue # Wrapped under a master key we no longer have; its tokens fail to decrypt
+        _cache.put(row.key_id, row.manager_id, key)
+        keys[row.key_id] = key
+    return keys
+
+def for_manager(manager_id: int) -> str:
+    """The manager's data key, created (and committed on its own) on first use."""
+    key = _cache.for_manager(manager_id)
+    if key:
+        return key
+
+    # Own session: a key must never be used for writes unless it is stored
+    db = SessionLocal()
+    try:
+        for _ in range(3):
+            row = db.query(models.DataKey).filter(models.DataKey.manager_id == manager_id).first()
+            if row is None:
+                key = Fernet.generate_key().decode()
+                row = models.DataKey(key_id=security.key_id(key), manager_id=manager_id, wrapped_key=security.seal(key))
+                db.add(row)
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another process created this manager's key first (or a key id clash): look again
+                    db.rollback()
+                    continue
+            key = security.unseal(row.wrapped_key)
+            _cache.put(row.key_id, manager_id, key)
+            return key
+        raise RuntimeError(f"Could not create a data key for manager {manager_id}")
+    finally:
+        db.close()
+
+def encrypt_patients(rows: list, plain_rows: list, mode: str = None) -> list:
+    """security.encrypt_patients() for rows of several managers (anything with manager_id), each under its own data key."""
+    result = [None] * len(rows)
+    by_manager = {}
+    for i, row in enumerate(rows):
+        by_manager.setdefault(row.manager_id, []).append(i)
+    for manager_id, indexes in by_manager.items():
+        encrypted = security.encrypt_patients([plain_rows[i] for i in indexes], key=for_manager(manager_id), mode=mode)
+        for i, columns in zip(indexes, encrypted):
+            result[i] = columns
+    return result
+
+# --- Token Key ---
+# Blind-index and order-token keys derive from one shared key (the data_keys row
+# without a manager), not from the master key, so they survive master rotation.
+# It is generated on first use. Patients stored before it existed get their tokens
+# from `python -m app.search_index` and `python -m app.sort_keys`.
+_token_key = None
+
+def token_key() -> str:
+    global _token_key
+    if _token_key is None:
+        db = SessionLocal()
+        try:
+            rows = _token_key_rows(db)
+            if not rows:
+                key = Fernet.generate_key().decode()
+                db.add(models.DataKey(key_id=security.key_id(key), manager_id=None, wrapped_key=security.seal(key)))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                rows = _token_key_rows(db) # Lowest id wins if two processes raced
+            _token_key = security.unseal(rows[0].wrapped_key)
+        finally:
+            db.close()
+    return _token_key
+
+def _token_key_rows(db: Session) -> list:
+    return db.query(models.DataKey).filter(models.DataKey.manager_id.is_(None)).order_by(models.DataKey.id).all()
+
+def rotate_token_key(db: Session) -> int:
+    """
+    Rebuild the blind index and order tokens under a new token key, committing
+    per batch, then retire the old key. Returns the patients re-tokenized.
+    The new key is stored first (next to the old one, which stays in use until
+    the end), so an interrupted run resumes with the same key when re-run.
+    Running processes cache the old key until they restart.
+    """
+    from . import search_index, sort_keys
+    global _token_key
+    rows = _token_key_rows(db)
+    if len(rows) > 1:
+        new = rows[-1] # An earlier run stopped part-way
+    else:
+        key = Fernet.generate_key().decode()
+        new = models.DataKey(key_id=security.key_id(key), manager_id=None, wrapped_key=security.seal(key))
+        db.add(new)
+        db.commit()
+    key = security.unseal(new.wrapped_key)
+    count = search_index.rebuild_all(db, key=security.derive_index_key(key))
+    sort_keys.backfill(db, key=security.derive_order_key(key), rebuild=True)
+    db.query(models.DataKey).filter(models.DataKey.manager_id.is_(None), models.DataKey.id != new.id).delete(synchronize_session=False)
+    db.commit()
+    _token_key = None
+    return count
+
+# --- Master Key Rotation ---
+
+def rewrap(db: Session, master_key: str) -> int:
+    """Re-seal every data key under `master_key` in one transaction. The keys themselves (and all patient data) are unchanged."""
+    rows = db.query(models.DataKey).with_for_update().all()
+    for row in rows:
+        row.wrapped_key = security.seal(security.unseal(row.wrapped_key), key=master_key)
+    db.commit()
+    return len(rows)
+
+if __name__ == "__main__":
+    # Stop the API first: running processes keep using the token key they cached.
+    # docker-compose exec backend python -m app.data_keys rotate-token-key
+    import argparse
+    parser = argparse.ArgumentParser(description="Data key maintenance.")
+    parser.add_argument("command", choices=["rotate-token-key"])
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        count = rotate_token_key(db)
+    finally:
+        db.close()
+    print(f"Rebuilt search and order tokens of {count} patients under a new token key")
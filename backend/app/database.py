@@ -1,14 +1,72 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 import os
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL is not set")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Connection pool (not SQLite). Connections are pinged before use and recycled,
+# so a restarted database or an idle-killing proxy costs a reconnect instead of a
+# failed request. DB_STATEMENT_TIMEOUT_MS (Postgres, 0 = off) cancels any single
+# statement that runs longer, including the CLI jobs'.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# DATABASE_ASYNC=1 adds an asyncio engine (asyncpg / aiosqlite) for get_session()
+ASYNC_ENABLED = os.getenv("DATABASE_ASYNC", "0") == "1"
+# Optional streaming replica for read-heavy endpoints (see replica.py). Without it
+# the read session factories are the primary's.
+SQLALCHEMY_READ_URL = os.getenv("DATABASE_READ_URL") or None
+
+def engine_options(url: str, asynchronous: bool = False) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    options = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT_SECONDS,
+        "pool_recycle": POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+    }
+    if STATEMENT_TIMEOUT_MS and url.startswith("postgresql"):
+        if asynchronous:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def async_url(url: str) -> str:
+    """The asyncio driver URL for a sync DATABASE_URL (DATABASE_ASYNC_URL overrides it)."""
+    scheme, rest = url.split("://", 1)
+    driver = {"postgresql": "postgresql+asyncpg", "postgresql+psycopg2": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+    return f"{driver.get(scheme, scheme)}://{rest}"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = SessionLocal
+if SQLALCHEMY_READ_URL:
+    read_engine = create_engine(SQLALCHEMY_READ_URL, **engine_options(SQLALCHEMY_READ_URL))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if ASYNC_ENABLED:
+    # Imported only here: needs greenlet and the async driver
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    _async_database_url = os.getenv("DATABASE_ASYNC_URL") or async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(_async_database_url, **engine_options(_async_database_url, asynchronous=True))
+    AsyncSessionLocal = AsyncReadSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+    if SQLALCHEMY_READ_URL:
+        _async_read_url = os.getenv("DATABASE_READ_ASYNC_URL") or async_url(SQLALCHEMY_READ_URL)
+        async_read_engine = create_async_engine(_async_read_url, **engine_options(_async_read_url, asynchronous=True))
+        AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False)
 
 Base = declarative_base()
 
@@ -18,3 +76,36 @@ def get_db():
         yield db
     finally:
         db.close()
+
+@asynccontextmanager
+async def session_scope(replica: bool = False):
+    """
+    A session for database.run(): an AsyncSession with DATABASE_ASYNC=1, otherwise
+    a regular Session. `replica` picks the read replica's engine, if configured.
+    """
+    if AsyncSessionLocal is not None:
+        async with (AsyncReadSessionLocal if replica else AsyncSessionLocal)() as db:
+            yield db
+    else:
+        db = (ReadSessionLocal if replica else SessionLocal)()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close) # May roll back over the network
+
+async def get_session():
+    """Primary session dependency for `async def` endpoints that call database.run()."""
+    async with session_scope() as db:
+        yield db
+
+async def run(db, fn, *args, **kwargs):
+    """
+    Call fn(session, *args, **kwargs), written against the sync ORM, with a session
+    from get_session(). On the async engine it runs via AsyncSession.run_sync, so
+    waiting on the database holds no thread; otherwise it runs in the threadpool
+    exactly like a sync endpoint. On the async engine fn runs on the event loop, so
+    it should only query: decryption and other CPU work belong in run_in_threadpool.
+    """
+    if AsyncSessionLocal is not None:
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
@@ -0,0 +1,138 @@
+from sqlalchemy import select
+from xml.sax.saxutils import escape
+from . import models, security, replica
+import csv
+import io
+import re
+import zipfile
+
+# Streaming patient export. Rows are read through a server-side cursor
+# (yield_per), decrypted one chunk at a time and written straight to the response,
+# so memory is bounded by one chunk and the first bytes go out immediately.
+COLUMNS = ["Patient ID", "First Name", "Last Name", "DOB", "Gender"]
+CHUNK_SIZE = 2000
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def iter_chunks(manager_id: int, read_after: float = 0.0, chunk_size: int = CHUNK_SIZE):
+    """Yield lists of decrypted (patient_id, first_name, last_name, dob, gender) rows, ordered by Patient ID."""
+    # Own session: the response body is produced after the request's session is gone.
+    # A report read, so it may come from the replica (`read_after`: the client's
+    # read-your-writes window, see replica.py).
+    db = replica.session_factory(manager_id, read_after)()
+    try:
+        stmt = select(
+            models.Patient.patient_id,
+            models.Patient.first_name,
+            models.Patient.last_name,
+            models.Patient.dob,
+            models.Patient.gender,
+            models.Patient.record
+        ).where(models.Patient.manager_id == manager_id).order_by(models.Patient.patient_id)
+
+        for partition in db.execute(stmt.execution_options(yield_per=chunk_size)).partitions():
+            yield [
+                (p.patient_id, *(plain[field] for field in security.PII_FIELDS))
+                for p, plain in zip(partition, security.decrypt_patients(partition))
+            ]
+    finally:
+        db.close()
+
+def stream_csv(manager_id: int, read_after: float = 0.0):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+
+    for chunk in iter_chunks(manager_id, read_after):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+# --- XLSX ---
+# openpyxl can only save a whole workbook, so the sheet XML is written by hand
+# into a zip that is emitted as it is produced (data descriptors, no seeking).
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Patients" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+# Control characters are not allowed in XML 1.0
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _xlsx_row(values) -> str:
+    cells = "".join(
+        f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_ILLEGAL_XML.sub("", v or ""))}</t></is></c>'
+        for v in values
+    )
+    return f"<row>{cells}</row>"
+
+class _Pipe:
+    """Write-only, unseekable sink; what the zip writer produced is collected with drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_xlsx(manager_id: int, read_after: float = 0.0):
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK)
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        yield pipe.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write((_SHEET_START + _xlsx_row(COLUMNS)).encode())
+            for chunk in iter_chunks(manager_id, read_after):
+                sheet.write("".join(_xlsx_row(row) for row in chunk).encode())
+                yield pipe.drain()
+            sheet.write(_SHEET_END.encode())
+    yield pipe.drain()
+
+STREAMERS = {"csv": stream_csv, "xlsx": stream_xlsx}
@@ -0,0 +1,160 @@
+from collections import Counter
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+from openpyxl import load_workbook
+from . import models, security, data_keys, search_index, sort_keys, patient_cache, stats, bulk_load, audit
+import os
+import tempfile
+
+# Streaming patient upload pipeline:
+#   spool request body to disk -> read rows with openpyxl (read-only) ->
+#   validate, encrypt and insert CHUNK_SIZE rows at a time.
+# Peak memory is bounded by one chunk, independent of file size.
+REQUIRED_COLUMNS = ["Patient ID", "First Name", "Last Name", "DOB", "Gender"]
+CHUNK_SIZE = 2000
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+class UploadError(Exception):
+    """Problem with the uploaded file itself (reported to the client as 400)."""
+
+async def spool(file: UploadFile) -> str:
+    """Copy the upload to a temporary file without holding it in memory. Caller deletes it."""
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    with os.fdopen(fd, "wb") as out:
+        while chunk := await file.read(SPOOL_CHUNK_BYTES):
+            out.write(chunk)
+    return path
+
+def _cell(value) -> str:
+    return "" if value is None else str(value)
+
+def iter_rows(path: str):
+    """Yield (patient_id, first_name, last_name, dob, gender) as strings, one row at a time."""
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except Exception:
+        raise UploadError("Could not read Excel file.")
+
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [_cell(h).strip() for h in next(rows, ())]
+        if not all(col in header for col in REQUIRED_COLUMNS):
+            raise UploadError(f"Missing columns. Required: {REQUIRED_COLUMNS}")
+        positions = [header.index(col) for col in REQUIRED_COLUMNS]
+
+        for row in rows:
+            if row is None or all(v is None for v in row):
+                continue # Trailing/blank rows
+            yield tuple(_cell(row[i]) if i < len(row) else "" for i in positions)
+    finally:
+        wb.close()
+
+def inspect(path: str):
+    """
+    Cheap up-front validation (readable workbook, required header) before a job
+    is queued. Returns the data row count from the sheet dimension, or None if
+    the file does not record one.
+    """
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except Exception:
+        raise UploadError("Could not read Excel file.")
+    try:
+        ws = wb.active
+        header = [_cell(h).strip() for h in next(ws.iter_rows(max_row=1, values_only=True), ())]
+        if not all(col in header for col in REQUIRED_COLUMNS):
+            raise UploadError(f"Missing columns. Required: {REQUIRED_COLUMNS}")
+        return ws.max_row - 1 if ws.max_row else None
+    finally:
+        wb.close()
+
+def chunked(iterable, size: int = CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _check_duplicates(db: Session, ids: list, seen: set):
+    # Global uniqueness (across managers) to prevent confusion, plus duplicates within the file.
+    # Earlier chunks are already flushed in this transaction, so the DB check covers them too.
+    existing_ids = [p[0] for p in db.query(models.Patient.patient_id).filter(models.Patient.patient_id.in_(ids)).all()]
+    for pid in ids:
+        if pid in seen:
+            existing_ids.append(pid)
+        seen.add(pid)
+    if existing_ids:
+        raise UploadError(f"Duplicate Records Found: The following Patient IDs already exist: {', '.join(existing_ids[:5])}...")
+
+def encrypt_chunk(manager_id: int, chunk: list):
+    """Encrypt one chunk of plaintext rows. Returns (patient mappings, plaintext dicts)."""
+    plain_rows = [dict(zip(security.PII_FIELDS, row[1:])) for row in chunk]
+    # One bulk job for the whole chunk, so it can fan out across cores
+    encrypted = security.encrypt_patients(plain_rows, key=data_keys.for_manager(manager_id))
+
+    mappings = [
+        {
+            "patient_id": row[0],
+            **columns,
+            "manager_id": manager_id,
+            **sort_keys.order_columns(plain)
+        }
+        for row, plain, columns in zip(chunk, plain_rows, encrypted)
+    ]
+    return mappings, plain_rows
+
+def insert_chunk(db: Session, manager_id: int, mappings: list, plain_rows: list):
+    """Insert one encrypted chunk together with its search tokens."""
+    # COPY on Postgres (see bulk_load.py); the generated ids are needed by the search tokens
+    bulk_load.insert_with_ids(db, models.Patient, mappings)
+    search_index.index_rows(db, (
+        (m["id"], manager_id, plain) for m, plain in zip(mappings, plain_rows)
+    ))
+
+def ingest(db: Session, path: str, manager_id: int, on_progress=None, upload_job_id: str = None) -> int:
+    """
+    Load a spooled .xlsx into `patients` for one manager. Everything runs in one
+    transaction: on any error nothing is committed. Raises UploadError for bad input.
+    `on_progress(parsed=, encrypted=, inserted=)` is called as each chunk advances.
+    Rows are tagged with `upload_job_id`, so the whole upload can be deleted later.
+    """
+    parsed = encrypted = count = 0
+    seen = set()
+    stat_changes = Counter()
+
+    def report():
+        if on_progress:
+            on_progress(parsed=parsed, encrypted=encrypted, inserted=count)
+
+    try:
+        for chunk in chunked(iter_rows(path)):
+            parsed += len(chunk)
+            report()
+            _check_duplicates(db, [row[0] for row in chunk], seen)
+            mappings, plain_rows = encrypt_chunk(manager_id, chunk)
+            for mapping in mappings:
+                mapping["upload_job_id"] = upload_job_id
+            encrypted += len(chunk)
+            report()
+            insert_chunk(db, manager_id, mappings, plain_rows)
+            stat_changes.update(stats.deltas((row[4], row[3]) for row in chunk))
+            count += len(chunk)
+            report()
+
+        stats.apply(db, stat_changes)
+        patient_cache.bump_version(db, manager_id)
+
+        # Audit Log, in the upload's transaction
+        audit.record(manager_id, "UPLOAD_PATIENTS", f"Uploaded {count} patients", db=db)
+
+        # Audit Log (Encryption)
+        audit.record(manager_id, "ENCRYPTION_OPERATION", f"Encrypted {count} patient records", db=db)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return count
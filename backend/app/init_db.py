@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session
 from .database import engine, SessionLocal, Base
-from . import models, auth
+from . import models, auth, stats, migrations
 import time
 import os
 import json
@@ -46,6 +46,11 @@ def wait_for_db(db_engine):
 def init_db():
     wait_for_db(engine)
     Base.metadata.create_all(bind=engine)
+    # Columns and indexes that create_all cannot add to existing tables
+    for column in migrations.add_feature_columns(engine):
+        print(f"Added column {column}")
+    if migrations.MIGRATE_ON_STARTUP:
+        migrations.migrate(engine)
     db = SessionLocal()
 
     # 1. Permissions (Configurable Permissions System)
@@ -67,7 +72,9 @@ def init_db():
         perm_map[p_name] = perm
 
     # 2. Roles (Hierarchical Role Structures)
-    # Strategy: "Admin" is top. "Manager" reports to Admin. "User" reports to Manager.
+    # A role inherits every permission of its parent (see rbac.py), so parents are
+    # the more restricted roles: "Manager" extends "User". Admin stays separate so
+    # it never inherits patient access.
     # Also assigning permissions to roles to show configurability.
     
     # Create Role objects first without parents
@@ -93,18 +100,18 @@ def init_db():
     admin_role.permissions = [perm_map[p] for p in admin_perms if p in perm_map]
     db.add(admin_role)
 
-    # Manager: Parent=Admin, Perms=Patient Management (NO USER READ)
+    # Manager: Parent=User, Perms=Patient Management (NO USER READ)
     manager_role = role_objs["Manager"]
-    manager_role.parent_id = admin_role.id # Hierarchy: Manager -> Admin
+    manager_role.parent_id = role_objs["User"].id # Hierarchy: Manager extends User
     manager_perms = [
         "patient.create", "patient.read", "patient.update", "patient.delete"
     ]
     manager_role.permissions = [perm_map[p] for p in manager_perms if p in perm_map]
     db.add(manager_role)
 
-    # User: Parent=Manager, Perms=Patient Read Only
+    # User: Parent=None, Perms=Patient Read Only
     user_role = role_objs["User"]
-    user_role.parent_id = manager_role.id # Hierarchy: User -> Manager
+    user_role.parent_id = None
     user_perms = ["patient.read"]
     user_role.permissions = [perm_map[p] for p in user_perms]
     db.add(user_role)
@@ -195,6 +202,11 @@ def init_db():
         print(f"Created: {email} ({role_name})")
 
     db.commit()
+
+    # Backfill the stats rollup for databases that predate it
+    stats.rebuild_if_empty(db)
+    # Its check would otherwise hold a read lock on patients for the process's lifetime
+    db.close()
     print("Database Initialized")
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import pydantic
-from . import models, schemas, auth, database, init_db, patients, admin
+import time
+from . import models, schemas, auth, database, init_db, patients, admin, security, upload_jobs, pagination, rbac, metrics, audit, replica
 
 # Rate Limiting Setup
 # Global Limit: 100 requests per minute per IP
@@ -35,44 +37,85 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, replica.MARKER_HEADER],
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        # Route template (e.g. /patients/{patient_id}), so ids do not split the stats
+        route = request.scope.get("route")
+        endpoint = f"{request.method} {route.path if route else request.url.path}"
+        metrics.latency.record(endpoint, time.perf_counter() - started)
+
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    response = await call_next(request)
+    # The user's following reads stay on the primary for a while (see replica.py)
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is not None and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        replica.issue_marker(response, user_id, replica.note_write(user_id))
+    return response
+
 @app.on_event("startup")
 def on_startup():
     init_db.init_db()
-
-def log_audit(db: Session, user_id: int, action: str, details: str = None):
-    log = models.AuditLog(user_id=user_id, action=action, details=details)
-    db.add(log)
-    db.commit()
+    rbac.rebuild()
+    # Jobs left queued/running by a previous process would otherwise never finish
+    db = database.SessionLocal()
+    try:
+        recovered = upload_jobs.recover(db)
+    finally:
+        db.close()
+    if recovered:
+        print(f"Failed {recovered} upload jobs interrupted by a restart")
+
+@app.on_event("shutdown")
+def on_shutdown():
+    upload_jobs.shutdown()
+    auth.shutdown_hashing()
+    security.shutdown_pool()
+    audit.shutdown()
 
 @app.post("/login", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    # Async so that waiting on bcrypt (auth's hashing executor) holds no request thread;
+    # the DB steps are sync and run in the threadpool
+    user = await run_in_threadpool(_login_user, db, form_data.username)
+    valid = user is not None and await auth.verify_password_async(form_data.password, user.password_hash)
+    return await run_in_threadpool(_finish_login, db, user, valid)
+
+def _login_user(db: Session, email: str):
+    user = db.query(models.User).filter(models.User.email == email).first()
     
     # Check Lockout
     if user and user.locked_until:
         import datetime
         if datetime.datetime.utcnow() < user.locked_until:
-            log_audit(db, user.id, "LOGIN_LOCKED", "Attempted login while locked")
+            audit.record(user.id, "LOGIN_LOCKED", "Attempted login while locked") # Queued: no change to be atomic with
             raise HTTPException(status_code=400, detail="Account locked due to too many failed attempts. Try again later.")
         else:
             # Unlock
             user.locked_until = None
             user.failed_login_attempts = 0
             db.commit()
+    return user
 
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+def _finish_login(db: Session, user, valid: bool):
+    if not valid:
         if user:
             user.failed_login_attempts += 1
             if user.failed_login_attempts >= 3:
                 import datetime
                 user.locked_until = datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
                 detail_msg = "Account locked for 15 minutes"
-                log_audit(db, user.id, "ACCOUNT_LOCKED", "3 failed attempts")
+                audit.record(user.id, "ACCOUNT_LOCKED", "3 failed attempts", db=db)
             else:
                 detail_msg = "Incorrect username or password"
-                log_audit(db, user.id, "LOGIN_FAILED", f"Attempt {user.failed_login_attempts}/3")
+                audit.record(user.id, "LOGIN_FAILED", f"Attempt {user.failed_login_attempts}/3", db=db)
             db.commit()
         
         raise HTTPException(
@@ -84,7 +127,7 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     # Login Success
     user.failed_login_attempts = 0
     user.locked_until = None
-    log_audit(db, user.id, "LOGIN_SUCCESS", "User logged in")
+    audit.record(user.id, "LOGIN_SUCCESS", "User logged in", db=db)
     db.commit()
 
     access_token = auth.create_access_token(data={"sub": user.email})
@@ -116,8 +159,9 @@ def reset_password(token: str, new_password: str, db: Session = Depends(database
         raise HTTPException(status_code=404, detail="User not found")
         
     user.password_hash = auth.get_password_hash(new_password)
-    log_audit(db, user.id, "PASSWORD_RESET", "User reset password")
+    audit.record(user.id, "PASSWORD_RESET", "User reset password", db=db)
     db.commit()
+    auth.invalidate_principals()
     return {"message": "Password updated successfully"}
 
 @app.get("/users/me", response_model=schemas.User)
@@ -130,8 +174,9 @@ def update_password(pass_data: schemas.PasswordUpdate, current_user: models.User
         raise HTTPException(status_code=400, detail="Incorrect old password")
     
     current_user.password_hash = auth.get_password_hash(pass_data.new_password)
-    log_audit(db, current_user.id, "PASSWORD_CHANGE", "User changed password")
+    audit.record(current_user.id, "PASSWORD_CHANGE", "User changed password", db=db)
     db.commit()
+    auth.invalidate_principals()
     return {"message": "Password updated successfully"}
 
 @app.put("/users/me/profile", response_model=schemas.User)
@@ -147,8 +192,9 @@ def update_profile(profile_data: schemas.UserUpdate, current_user: models.User =
             raise HTTPException(status_code=400, detail="Email already in use")
         current_user.email = profile_data.email
         
-    log_audit(db, current_user.id, "PROFILE_UPDATE", "User updated profile details")
+    audit.record(current_user.id, "PROFILE_UPDATE", "User updated profile details", db=db)
     db.commit()
+    auth.invalidate_principals()
     db.refresh(current_user)
     return current_user
 
@@ -194,8 +240,9 @@ def reset_password_with_otp(req: OTPReset, db: Session = Depends(database.get_db
         raise HTTPException(status_code=404, detail="User not found")
         
     user.password_hash = auth.get_password_hash(req.new_password)
-    log_audit(db, user.id, "PASSWORD_RESET_OTP", "User reset password via OTP")
+    audit.record(user.id, "PASSWORD_RESET_OTP", "User reset password via OTP", db=db)
     db.commit()
+    auth.invalidate_principals()
     return {"message": "Password reset successfully"}
 
 
@@ -0,0 +1,44 @@
+from collections import deque
+import threading
+
+# In-process request latency per endpoint ("METHOD /route/path"). Keeps the most
+# recent SAMPLE_SIZE durations per endpoint for percentiles, plus running totals.
+# Streaming responses are measured up to the start of the response body.
+SAMPLE_SIZE = 1000
+
+class LatencyStats:
+    def __init__(self, sample_size: int = SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._endpoints = {} # endpoint -> [count, total seconds, max seconds, deque of recent seconds]
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float):
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = [0, 0.0, 0.0, deque(maxlen=self.sample_size)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3].append(seconds)
+
+    def summary(self) -> dict:
+        """{endpoint: {count, avg_ms, p50_ms, p95_ms, p99_ms, max_ms}}; percentiles over recent requests."""
+        with self._lock:
+            entries = {name: (count, total, peak, sorted(recent)) for name, (count, total, peak, recent) in self._endpoints.items()}
+        return {
+            name: {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 2),
+                "p50_ms": _percentile_ms(recent, 0.50),
+                "p95_ms": _percentile_ms(recent, 0.95),
+                "p99_ms": _percentile_ms(recent, 0.99),
+                "max_ms": round(peak * 1000, 2),
+            }
+            for name, (count, total, peak, recent) in sorted(entries.items())
+        }
+
+def _percentile_ms(ordered: list, q: float) -> float:
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+latency = LatencyStats()
@@ -0,0 +1,213 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from . import models
+import datetime
+import os
+
+# Versioned schema migrations. create_all() only creates missing tables, so any
+# column or index added to an existing table needs a migration here. Applied
+# versions are recorded in schema_migrations; init_db runs the pending ones at
+# startup (MIGRATE_ON_STARTUP=0 leaves that to `python -m app.migrations`).
+# Every step checks what already exists, so on a fresh database, where create_all
+# has built the current schema, they are no-ops. Index builds on Postgres use
+# CREATE INDEX CONCURRENTLY and lock no table against writes. Concurrent builds
+# cannot run in a transaction, so such migrations run in autocommit mode and a
+# failed build (an INVALID index) is dropped and rebuilt on the next run.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+ADVISORY_LOCK_ID = 7215031 # One migrating process at a time
+
+MIGRATIONS = [] # (version, name, function, concurrent), in order
+
+class MigrationBlocked(Exception):
+    """A step that cannot apply until the data is fixed by hand. It stays pending; later steps still run."""
+
+def migration(version: int, name: str, concurrent: bool = False):
+    def register(func):
+        MIGRATIONS.append((version, name, func, concurrent))
+        return func
+    return register
+
+# --- Helpers ---
+
+def _is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    if not _has_column(conn, table, column):
+        # IF NOT EXISTS: add_feature_columns runs without the advisory lock
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {'IF NOT EXISTS ' if _is_postgres(conn) else ''}{column} {ddl}"))
+
+def _index(conn: Connection, table: str, name: str):
+    """The index's reflection entry (with "unique"), or None. An INVALID Postgres index is dropped first."""
+    if _is_postgres(conn):
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+        ), {"name": name}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            return None
+    return next((ix for ix in inspect(conn).get_indexes(table) if ix["name"] == name), None)
+
+def _is_partitioned(conn: Connection, table: str) -> bool:
+    return _is_postgres(conn) and conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table"
+    ), {"table": table}).first() is not None
+
+def _create_index(conn: Connection, table: str, name: str, columns: list, unique: bool = False):
+    if _index(conn, table, name) is not None:
+        return
+    # Partitioned parents cannot be indexed concurrently (audit_logs, see audit_archive.py)
+    concurrently = "CONCURRENTLY " if _is_postgres(conn) and not _is_partitioned(conn, table) else ""
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}{name} ON {table} ({', '.join(columns)})"))
+
+def _drop_index(conn: Connection, name: str):
+    conn.execute(text(f"DROP INDEX {'CONCURRENTLY ' if _is_postgres(conn) else ''}IF EXISTS {name}"))
+
+# --- Feature columns ---
+# Columns that features added to tables which already existed, as (table, column,
+# DDL), per feature. Each is nullable or has a constant default, so adding it is a
+# metadata-only change, and no request can be served without it. init_db adds
+# them on every start, even with MIGRATE_ON_STARTUP=0; step 001 adds the same
+# ones. Index builds and backfills stay in the numbered steps.
+FEATURE_COLUMNS = {
+    "order tokens (ADR 013)": [("patients", f"{field}_order", "INTEGER") for field in ("first_name", "last_name", "dob", "gender")],
+    "patient cache data version (ADR 014)": [("users", "patient_data_version", "INTEGER NOT NULL DEFAULT 0")],
+    "row record mode (ADR 017)": [("patients", "record", "VARCHAR")],
+}
+
+def add_feature_columns(engine: Engine) -> list:
+    """Add any missing feature column. Returns the "table.column" names added."""
+    added = []
+    with engine.begin() as conn:
+        for columns in FEATURE_COLUMNS.values():
+            for table, column, ddl in columns:
+                if not _has_column(conn, table, column):
+                    _add_column(conn, table, column, ddl)
+                    added.append(f"{table}.{column}")
+    return added
+
+# --- Migrations ---
+
+@migration(1, "patient_and_user_columns")
+def _patient_and_user_columns(conn: Connection):
+    # Row record mode, order tokens and the cache data version on pre-existing tables
+    for columns in FEATURE_COLUMNS.values():
+        for table, column, ddl in columns:
+            _add_column(conn, table, column, ddl)
+
+@migration(2, "patient_manager_indexes", concurrent=True)
+def _patient_manager_indexes(conn: Connection):
+    # Every patient query filters on manager_id; (manager_id, patient_id, id) also serves keyset paging
+    _create_index(conn, "patients", "ix_patients_manager_patient_id", ["manager_id", "patient_id", "id"])
+    for field in ("first_name", "last_name", "dob", "gender"):
+        _create_index(conn, "patients", f"ix_patients_manager_{field}_order", ["manager_id", f"{field}_order"])
+
+@migration(3, "unique_patient_id", concurrent=True)
+def _unique_patient_id(conn: Connection):
+    # Uploads already reject IDs that exist; the index makes it a guarantee
+    existing = _index(conn, "patients", "ix_patients_patient_id")
+    if existing is not None and existing["unique"]:
+        return
+    if _is_partitioned(conn, "patients"):
+        return # Enforced through the patient_ids table there (see patient_partitions.py)
+    duplicates = conn.execute(text(
+        "SELECT patient_id FROM patients GROUP BY patient_id HAVING COUNT(*) > 1 LIMIT 10"
+    )).scalars().all()
+    if duplicates:
+        # Stays pending (and is retried on every run) until the duplicates are resolved by hand
+        raise MigrationBlocked(f"duplicate patient IDs, cannot add the unique index: {', '.join(duplicates)}")
+    if _is_postgres(conn):
+        _create_index(conn, "patients", "ix_patients_patient_id_unique", ["patient_id"], unique=True)
+        _drop_index(conn, "ix_patients_patient_id")
+        conn.execute(text("ALTER INDEX ix_patients_patient_id_unique RENAME TO ix_patients_patient_id"))
+    else:
+        _drop_index(conn, "ix_patients_patient_id")
+        _create_index(conn, "patients", "ix_patients_patient_id", ["patient_id"], unique=True)
+
+@migration(4, "audit_log_indexes", concurrent=True)
+def _audit_log_indexes(conn: Connection):
+    _create_index(conn, "audit_logs", "ix_audit_logs_timestamp", ["timestamp", "id"])
+    _create_index(conn, "audit_logs", "ix_audit_logs_user_timestamp", ["user_id", "timestamp", "id"])
+    _create_index(conn, "audit_logs", "ix_audit_logs_action_timestamp", ["action", "timestamp", "id"])
+
+@migration(5, "users_role_id_index", concurrent=True)
+def _users_role_id_index(conn: Connection):
+    _create_index(conn, "users", "ix_users_role_id", ["role_id"])
+
+@migration(6, "patient_upload_job", concurrent=True)
+def _patient_upload_job(conn: Connection):
+    # Lets a manager delete everything one upload inserted
+    _add_column(conn, "patients", "upload_job_id", "VARCHAR")
+    _create_index(conn, "patients", "ix_patients_manager_upload_job", ["manager_id", "upload_job_id"])
+
+@migration(7, "upload_job_worker")
+def _upload_job_worker(conn: Connection):
+    # Lets a restarted process find and fail the jobs its predecessor left unfinished
+    _add_column(conn, "upload_jobs", "worker", "VARCHAR")
+    _add_column(conn, "upload_jobs", "spool_path", "VARCHAR")
+
+# --- Runner ---
+
+def applied(engine: Engine) -> dict:
+    """{version: applied_at} of the migrations recorded in the database."""
+    models.SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT version, applied_at FROM schema_migrations")).all())
+
+def migrate(engine: Engine) -> list:
+    """Apply pending migrations in order. Returns the names applied; blocked steps are reported and skipped."""
+    done = applied(engine)
+    pending = [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in done]
+    if not pending:
+        return []
+
+    names = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        if _is_postgres(lock_conn):
+            lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        try:
+            done = applied(engine) # Another process may have migrated while we waited
+            for version, name, func, concurrent in pending:
+                if version in done:
+                    continue
+                try:
+                    if concurrent:
+                        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                            func(conn)
+                        with engine.begin() as conn:
+                            _record(conn, version, name)
+                    else:
+                        with engine.begin() as conn: # The schema change and its record commit together
+                            func(conn)
+                            _record(conn, version, name)
+                except MigrationBlocked as e:
+                    print(f"[WARN] Migration {version:03d} {name} left pending: {e}")
+                    continue
+                print(f"Applied migration {version:03d} {name}")
+                names.append(name)
+        finally:
+            if _is_postgres(lock_conn):
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ADVISORY_LOCK_ID})
+    return names
+
+def _record(conn: Connection, version: int, name: str):
+    conn.execute(models.SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.datetime.utcnow()))
+
+if __name__ == "__main__":
+    # docker-compose exec backend python -m app.migrations            (apply pending)
+    # docker-compose exec backend python -m app.migrations --status
+    import argparse
+    from .database import engine
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+    args = parser.parse_args()
+    if args.status:
+        done = applied(engine)
+        for version, name, _, _ in sorted(MIGRATIONS, key=lambda m: m[0]):
+            print(f"{version:03d} {name:<28} {done[version] if version in done else 'pending'}")
+    else:
+        names = migrate(engine)
+        print(f"Applied {len(names)} migrations" if names else "Schema is up to date")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Table
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Table, Index
 from sqlalchemy.orm import relationship, backref
 import datetime
 from .database import Base
@@ -21,7 +21,7 @@ class Role(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     
-    # Hierarchy Support: A role can have a parent role (e.g. Manager -> Admin)
+    # Hierarchy Support: A role inherits all permissions of its parent role (e.g. Manager extends User)
     parent_id = Column(Integer, ForeignKey('roles.id'), nullable=True)
     children = relationship("Role", backref=backref("parent", remote_side=[id]))
 
@@ -49,7 +49,7 @@ class User(Base):
     password_hash = Column(String)
     is_active = Column(Boolean, default=True)
     
-    role_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    role_id = Column(Integer, ForeignKey("roles.id"), nullable=False, index=True)
     location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
     team_id = Column(Integer, ForeignKey("teams.id"), nullable=False)
     
@@ -66,6 +66,9 @@ class User(Base):
 
     locked_until = Column(DateTime, nullable=True)
 
+    # Bumped on every write to this manager's patients; invalidates decrypted caches
+    patient_data_version = Column(Integer, default=0, server_default="0", nullable=False)
+
     patients = relationship("Patient", back_populates="manager")
     audit_logs = relationship("AuditLog", back_populates="user")
 
@@ -79,10 +82,18 @@ class AuditLog(Base):
     
     user = relationship("User", back_populates="audit_logs")
 
+    __table_args__ = (
+        # The audit log is browsed newest first, optionally by user or action; id breaks ties for keyset paging
+        Index("ix_audit_logs_timestamp", "timestamp", "id"),
+        Index("ix_audit_logs_user_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_audit_logs_action_timestamp", "action", "timestamp", "id"),
+    )
+
 class Patient(Base):
+    # Optionally hash-partitioned by manager_id on Postgres (see patient_partitions.py)
     __tablename__ = "patients"
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(String, index=True) # Unencrypted ID from Excel
+    patient_id = Column(String, unique=True, index=True) # Unencrypted ID from Excel, unique across managers (through patient_ids when partitioned)
 
     
     # Encrypted Fields
@@ -90,7 +101,83 @@ class Patient(Base):
     last_name = Column(String)
     dob = Column(String)
     gender = Column(String)
+    # Row mode (PATIENT_RECORD_MODE=row): all four fields above in one encrypted
+    # record, with the field columns NULL. See security.encrypt_patients.
+    record = Column(String, nullable=True)
+
+    # Order tokens for the encrypted fields (see security.order_token), so sorted
+    # pages can be served by ORDER BY ... LIMIT. NULL until backfilled.
+    first_name_order = Column(Integer, nullable=True)
+    last_name_order = Column(Integer, nullable=True)
+    dob_order = Column(Integer, nullable=True)
+    gender_order = Column(Integer, nullable=True)
     
     manager_id = Column(Integer, ForeignKey("users.id"))
     manager = relationship("User", back_populates="patients")
-
+    upload_job_id = Column(String, nullable=True) # UploadJob that inserted the row (NULL for older rows)
+
+    # Blind index rows are removed by the DB (ON DELETE CASCADE), not loaded by the ORM
+    search_tokens = relationship("PatientSearchToken", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Every patient query is scoped to a manager and ordered by patient_id (id breaks ties for keyset paging)
+        Index("ix_patients_manager_patient_id", "manager_id", "patient_id", "id"),
+        Index("ix_patients_manager_first_name_order", "manager_id", "first_name_order"),
+        Index("ix_patients_manager_last_name_order", "manager_id", "last_name_order"),
+        Index("ix_patients_manager_dob_order", "manager_id", "dob_order"),
+        Index("ix_patients_manager_gender_order", "manager_id", "gender_order"),
+        Index("ix_patients_manager_upload_job", "manager_id", "upload_job_id"),
+    )
+
+class PatientStat(Base):
+    """Rollup of patient counts by gender and birth year, maintained as deltas (see stats.py)."""
+    __tablename__ = "patient_stats"
+    gender = Column(String, primary_key=True) # Male / Female / Other
+    birth_year = Column(Integer, primary_key=True) # 0 = unknown DOB
+    count = Column(Integer, nullable=False, default=0)
+
+class PatientSearchToken(Base):
+    """Blind index entry: HMAC of a normalized prefix of one encrypted Patient field."""
+    __tablename__ = "patient_search_tokens"
+    id = Column(Integer, primary_key=True)
+    patient_row_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=False, index=True)
+    manager_id = Column(Integer, nullable=False) # Denormalized so lookups stay within one manager
+    token = Column(String(32), nullable=False)
+
+    __table_args__ = (
+        Index("ix_patient_search_tokens_manager_token", "manager_id", "token"),
+    )
+
+
+class UploadJob(Base):
+    """Background patient upload (see upload_jobs.py); progress is polled by the client."""
+    __tablename__ = "upload_jobs"
+    id = Column(String(32), primary_key=True) # uuid4 hex
+    manager_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued") # queued, running, completed, failed
+    rows_total = Column(Integer, nullable=True) # From the sheet dimension, if recorded
+    rows_parsed = Column(Integer, nullable=False, default=0)
+    rows_encrypted = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    worker = Column(String, nullable=True) # "host:pid" of the process running it
+    spool_path = Column(String, nullable=True) # Spooled upload, deleted when the job ends
+
+class DataKey(Base):
+    """Envelope data key, stored wrapped by the master key (see data_keys.py)."""
+    __tablename__ = "data_keys"
+    id = Column(Integer, primary_key=True)
+    key_id = Column(String(8), unique=True, nullable=False) # security.key_id() of the unwrapped key, as in ciphertext headers
+    manager_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=True) # NULL: the shared search/sort token key
+    wrapped_key = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class SchemaMigration(Base):
+    """Applied versioned schema migration (see migrations.py)."""
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
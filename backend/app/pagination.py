@@ -0,0 +1,21 @@
+from fastapi import HTTPException
+import base64
+import json
+
+# Opaque keyset cursors: the sort key of the last row of a page, base64url-encoded.
+# The next page is "rows after this key" on a matching composite index, so it
+# costs the same at any depth and is stable under concurrent inserts and deletes.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """Decode a cursor whose values have the given types. Malformed cursors are a 400."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(values) != len(types) or not all(isinstance(v, t) for v, t in zip(values, types)):
+            raise ValueError
+        return tuple(values)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from . import models, security, replica
+import os
+import threading
+import time
+
+# In-process cache of decrypted patient rows, so paging and re-sorting a hot
+# manager's list does not hit Fernet again. Entries are tagged with the manager's
+# data version (users.patient_data_version); any write bumps the version in the
+# same transaction, which makes every worker drop its stale copy on next read.
+MAX_BYTES = int(os.getenv("PATIENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TTL_SECONDS = int(os.getenv("PATIENT_CACHE_TTL_SECONDS", "300"))
+
+# Rough per-row overhead of the projection dict on top of the string payloads
+_ROW_OVERHEAD_BYTES = 400
+
+class _Entry:
+    __slots__ = ("version", "expires_at", "rows", "size")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.expires_at = time.monotonic() + TTL_SECONDS
+        self.rows = {}
+        self.size = 0
+
+class DecryptedPatientCache:
+    """LRU over managers, bounded by TTL and an approximate total memory cap."""
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # manager_id -> _Entry
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, manager_id: int):
+        entry = self._entries.pop(manager_id, None)
+        if entry:
+            self._size -= entry.size
+
+    def get(self, manager_id: int, version: int, ids) -> dict:
+        """Cached rows ({row id: projection}) among `ids` for this version."""
+        with self._lock:
+            entry = self._entries.get(manager_id)
+            if entry is None:
+                return {}
+            if entry.version != version or entry.expires_at < time.monotonic():
+                self._drop(manager_id)
+                return {}
+            self._entries.move_to_end(manager_id)
+            return {i: entry.rows[i] for i in ids if i in entry.rows}
+
+    def put(self, manager_id: int, version: int, rows: list):
+        with self._lock:
+            entry = self._entries.get(manager_id)
+            if entry is not None and entry.version != version:
+                if entry.version > version:
+                    return # A newer reader got here first; these rows may be stale
+                self._drop(manager_id)
+                entry = None
+            if entry is None:
+                entry = self._entries[manager_id] = _Entry(version)
+            self._entries.move_to_end(manager_id)
+
+            for row in rows:
+                if row["id"] in entry.rows:
+                    continue
+                size = _ROW_OVERHEAD_BYTES + sum(len(v) for v in row.values() if isinstance(v, str))
+                # Make room by evicting least recently used managers, never the current one
+                while self._size + size > self.max_bytes and next(iter(self._entries)) != manager_id:
+                    self._drop(next(iter(self._entries)))
+                if self._size + size > self.max_bytes:
+                    return # This manager alone fills the cache; keep what we have
+                entry.rows[row["id"]] = row
+                entry.size += size
+                self._size += size
+
+    def invalidate(self, manager_id: int):
+        with self._lock:
+            self._drop(manager_id)
+
+cache = DecryptedPatientCache()
+
+def data_version(db: Session, manager_id: int) -> int:
+    return db.query(models.User.patient_data_version).filter(models.User.id == manager_id).scalar() or 0
+
+def bump_version(db: Session, manager_id: int):
+    """Call in the same transaction as any write to the manager's patients."""
+    db.query(models.User).filter(models.User.id == manager_id).update(
+        {models.User.patient_data_version: models.User.patient_data_version + 1},
+        synchronize_session=False
+    )
+    cache.invalidate(manager_id)
+    replica.note_write(manager_id)
+
+def decrypt_rows(manager_id: int, version: int, raw_patients) -> list:
+    """Decrypt patient rows (in order), reusing and filling the cache."""
+    raw_patients = list(raw_patients)
+    cached = cache.get(manager_id, version, [p.id for p in raw_patients])
+    missing = [p for p in raw_patients if p.id not in cached]
+
+    # Cache misses are decrypted as one bulk job (parallel for large pages)
+    fresh = []
+    for p, plain in zip(missing, security.decrypt_patients(missing)):
+        row = {
+            "id": p.id,
+            "patient_id": p.patient_id, # Unencrypted
+            **plain,
+            "manager_id": p.manager_id
+        }
+        cached[p.id] = row
+        fresh.append(row)
+    if fresh:
+        cache.put(manager_id, version, fresh)
+    return [cached[p.id] for p in raw_patients]
@@ -0,0 +1,161 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from . import bulk_load
+from .database import SessionLocal
+import os
+
+# Opt-in layout for Postgres: `partition` turns patients into a table hash-
+# partitioned on manager_id, so a manager's scans, searches and deletes touch one
+# small partition (and its indexes), and vacuum/reindex run per partition.
+# Unlike audit_logs (see audit_archive.py) the old table cannot simply be attached,
+# since a hash-partitioned table has no DEFAULT partition: rows are copied into the
+# new layout inside one transaction that locks patients and patient_search_tokens.
+# The modulus is fixed at conversion time; changing it means converting again.
+# A unique index there must include manager_id, so global patient_id uniqueness
+# moves to a side table, patient_ids, kept in step by a trigger on every insert,
+# delete and patient_id update: a duplicate fails with a unique violation, as the
+# unique index (migration 003) does on the plain table.
+PARTITIONS = int(os.getenv("PATIENT_PARTITIONS", "16"))
+COLUMNS = (
+    "id", "patient_id", "first_name", "last_name", "dob", "gender", "record",
+    "first_name_order", "last_name_order", "dob_order", "gender_order", "manager_id", "upload_job_id",
+)
+TOKEN_FK = "patient_search_tokens_patient_row_id_fkey"
+ID_TABLE = "patient_ids"
+
+def partition_name(remainder: int) -> str:
+    return f"patients_p{remainder:02d}"
+
+def is_partitioned(db: Session) -> bool:
+    if not bulk_load.is_postgres(db):
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'patients'"
+    )).first() is not None
+
+def partition(db: Session, partitions: int = PARTITIONS) -> bool:
+    """Convert patients into `partitions` hash partitions on manager_id, in one transaction. False if it already is."""
+    if not bulk_load.is_postgres(db):
+        raise RuntimeError("Partitioning patients needs PostgreSQL")
+    if not 1 <= partitions <= 100:
+        raise ValueError("partitions must be between 1 and 100")
+    if is_partitioned(db):
+        return False
+    db.execute(text("LOCK TABLE patients, patient_search_tokens IN ACCESS EXCLUSIVE MODE"))
+    # The partition key is part of the primary key, so it cannot be NULL
+    orphans = db.execute(text("SELECT COUNT(*) FROM patients WHERE manager_id IS NULL")).scalar()
+    if orphans:
+        raise RuntimeError(f"{orphans} patients have no manager; assign or delete them first")
+    duplicates = db.execute(text(
+        "SELECT patient_id FROM patients GROUP BY patient_id HAVING COUNT(*) > 1 LIMIT 10"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"duplicate patient IDs; resolve them first (see migration 003): {', '.join(duplicates)}")
+
+    db.execute(text(f"ALTER TABLE patient_search_tokens DROP CONSTRAINT IF EXISTS {TOKEN_FK}"))
+    db.execute(text("ALTER TABLE patients RENAME TO patients_unpartitioned"))
+    db.execute(text("ALTER TABLE patients_unpartitioned RENAME CONSTRAINT patients_pkey TO patients_unpartitioned_pkey"))
+    # Index names are schema-wide; the old ones go with the old table
+    for (index,) in db.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'patients_unpartitioned' AND indexname LIKE 'ix_patients_%'"
+    )).all():
+        db.execute(text(f"DROP INDEX {index}"))
+    db.execute(text("ALTER TABLE patients_unpartitioned ALTER COLUMN id DROP DEFAULT"))
+
+    # A partitioned table's primary key (and any unique index) must include the partition key
+    db.execute(text("""
+        CREATE TABLE patients (
+            id INTEGER NOT NULL DEFAULT nextval('patients_id_seq'::regclass),
+            patient_id VARCHAR,
+            first_name VARCHAR,
+            last_name VARCHAR,
+            dob VARCHAR,
+            gender VARCHAR,
+            record VARCHAR,
+            first_name_order INTEGER,
+            last_name_order INTEGER,
+            dob_order INTEGER,
+            gender_order INTEGER,
+            manager_id INTEGER NOT NULL REFERENCES users(id),
+            upload_job_id VARCHAR,
+            PRIMARY KEY (id, manager_id)
+        ) PARTITION BY HASH (manager_id)
+    """))
+    db.execute(text("ALTER SEQUENCE patients_id_seq OWNED BY patients.id"))
+    for remainder in range(partitions):
+        db.execute(text(
+            f"CREATE TABLE {partition_name(remainder)} PARTITION OF patients "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        ))
+    db.execute(text("CREATE INDEX ix_patients_id ON patients (id)"))
+    db.execute(text("CREATE INDEX ix_patients_patient_id ON patients (patient_id)"))
+    db.execute(text("CREATE INDEX ix_patients_manager_patient_id ON patients (manager_id, patient_id, id)"))
+    for field in ("first_name", "last_name", "dob", "gender"):
+        db.execute(text(f"CREATE INDEX ix_patients_manager_{field}_order ON patients (manager_id, {field}_order)"))
+    db.execute(text("CREATE INDEX ix_patients_manager_upload_job ON patients (manager_id, upload_job_id)"))
+
+    columns = ", ".join(COLUMNS)
+    db.execute(text(f"INSERT INTO patients ({columns}) SELECT {columns} FROM patients_unpartitioned"))
+    _enforce_unique_patient_id(db)
+    # Tokens carry their patient's manager_id, so the cascade can reference the new key
+    db.execute(text(
+        f"ALTER TABLE patient_search_tokens ADD CONSTRAINT {TOKEN_FK} FOREIGN KEY (patient_row_id, manager_id) "
+        "REFERENCES patients (id, manager_id) ON DELETE CASCADE"
+    ))
+    db.execute(text("DROP TABLE patients_unpartitioned"))
+    db.commit()
+    db.execute(text("ANALYZE patients"))
+    db.commit()
+    return True
+
+def _enforce_unique_patient_id(db: Session):
+    # Filled in one statement after the copy; the trigger keeps it in step from here on
+    db.execute(text(f"CREATE TABLE {ID_TABLE} (patient_id VARCHAR PRIMARY KEY)"))
+    db.execute(text(f"INSERT INTO {ID_TABLE} SELECT patient_id FROM patients WHERE patient_id IS NOT NULL"))
+    db.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {ID_TABLE}_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' AND OLD.patient_id IS NOT NULL THEN
+                DELETE FROM {ID_TABLE} WHERE patient_id = OLD.patient_id;
+            END IF;
+            IF TG_OP <> 'DELETE' AND NEW.patient_id IS NOT NULL THEN
+                INSERT INTO {ID_TABLE} (patient_id) VALUES (NEW.patient_id);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    db.execute(text(
+        f"CREATE TRIGGER {ID_TABLE}_sync AFTER INSERT OR DELETE OR UPDATE OF patient_id ON patients "
+        f"FOR EACH ROW EXECUTE FUNCTION {ID_TABLE}_sync()"
+    ))
+
+def partition_sizes(db: Session) -> list:
+    """[(partition, estimated rows, total bytes)] for a partitioned patients table."""
+    return db.execute(text(
+        "SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'patients'::regclass ORDER BY c.relname"
+    )).all()
+
+if __name__ == "__main__":
+    # docker-compose exec backend python -m app.patient_partitions partition --partitions 16   (once, Postgres)
+    # docker-compose exec backend python -m app.patient_partitions status
+    import argparse
+    parser = argparse.ArgumentParser(description="Hash-partition the patients table by manager.")
+    parser.add_argument("command", choices=["partition", "status"])
+    parser.add_argument("--partitions", type=int, default=PARTITIONS, help="number of hash partitions (fixed once created)")
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        if args.command == "partition":
+            converted = partition(db, args.partitions)
+            print(f"Converted patients to {args.partitions} hash partitions" if converted else "patients is already partitioned")
+            if converted:
+                print(f"Patient IDs stay unique across managers through the {ID_TABLE} table, kept by a trigger on patients")
+        if not is_partitioned(db):
+            print("patients is not partitioned")
+        elif args.command == "status":
+            for name, rows, size in partition_sizes(db):
+                print(f"{name:<14} ~{max(rows, 0):>10} rows {size / 1024 / 1024:>10.1f} MB")
+    finally:
+        db.close()
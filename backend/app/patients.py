@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, Request, UploadFile, File, HTTPException
+from fastapi.responses import Response, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import tuple_, delete, select
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from collections import Counter
 import pandas as pd
-import io
+import asyncio
 import datetime
-from . import models, schemas, database, auth, security
+import io
+import os
+from . import models, schemas, database, replica, security, data_keys, search_index, sort_keys, patient_cache, stats, ingest, upload_jobs, export, pagination, rbac, audit
 
 router = APIRouter(
     prefix="/patients",
@@ -13,76 +18,28 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# The stats, job polling and list endpoints are async and run their (sync ORM) queries
+# through database.run(): on the async engine (DATABASE_ASYNC=1) waiting on the
+# database holds no threadpool thread. CPU work (decryption) stays in the threadpool. Stats and list read from the replica, if any
+# (see replica.py); job polling stays on the primary, where the job writes.
 @router.get("/stats")
-def get_patient_stats(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    # Permission Check
-    perms = [p.name for p in current_user.role.permissions]
-    if "report.view" not in perms:
-        raise HTTPException(status_code=403, detail="Not authorized. Missing 'report.view' permission.")
-
-    # 1. Total Patients
-    total_patients = db.query(models.Patient).count()
+async def get_patient_stats(current_user: models.User = Depends(rbac.require_permission("report.view")), db=Depends(replica.get_read_session)):
+    return await database.run(db, _patient_stats)
 
-    # 2. Total Users
-    total_users = db.query(models.User).count()
-
-    # 3. Decrypt and Aggregate Gender & Age
-    patients = db.query(models.Patient.dob, models.Patient.gender).all()
-    
-    male_count = 0
-    female_count = 0
-    
-    age_groups = { "0-18": 0, "19-35": 0, "36-50": 0, "51-70": 0, "70+": 0 }
-    
-    now_year = datetime.datetime.utcnow().year
-    
-    for p in patients:
-        try:
-            gender = security.decrypt(p.gender)
-            dob_str = security.decrypt(p.dob) 
-            
-            if gender == "Male":
-                male_count += 1
-            elif gender == "Female":
-                female_count += 1
-                
-            if dob_str:
-                dob_date = None
-                for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%m/%d/%Y"):
-                    try:
-                        dob_date = datetime.datetime.strptime(dob_str.split(" ")[0], fmt)
-                        break
-                    except:
-                        pass
-                
-                if dob_date:
-                    age = now_year - dob_date.year
-                    if age <= 18: age_groups["0-18"] += 1
-                    elif age <= 35: age_groups["19-35"] += 1
-                    elif age <= 50: age_groups["36-50"] += 1
-                    elif age <= 70: age_groups["51-70"] += 1
-                    else: age_groups["70+"] += 1
-                    
-        except Exception:
-            continue
-            
-    male_pct = round((male_count / total_patients * 100)) if total_patients else 0
-    female_pct = round((female_count / total_patients * 100)) if total_patients else 0
+def _patient_stats(db: Session):
+    # Totals and distributions come from the incrementally maintained rollup (see stats.py),
+    # so this is O(1) in the number of patients and decrypts nothing.
+    report = stats.summary(db)
 
     return {
-        "total_patients": total_patients,
-        "total_users": total_users,
-        "gender_distribution": {"male_percentage": male_pct, "female_percentage": female_pct},
-        "age_groups": age_groups
+        "total_patients": report["total_patients"],
+        "total_users": db.query(models.User).count(),
+        "gender_distribution": report["gender_distribution"],
+        "age_groups": report["age_groups"]
     }
 
 @router.get("/template")
-def get_template(current_user: models.User = Depends(auth.get_current_user)):
-    # Permission Check
-    user_perms = [p.name for p in current_user.role.permissions]
-    if "patient.create" not in user_perms:
-       raise HTTPException(status_code=403, detail="Not authorized. Missing 'patient.create' permission.")
-
+def get_template(current_user: models.User = Depends(rbac.require_permission("patient.create"))):
     df = pd.DataFrame(columns=["Patient ID", "First Name", "Last Name", "DOB", "Gender"])
     # Create valid sample row
     df.loc[0] = ["P001", "John", "Doe", "1980-01-01", "Male"]
@@ -100,119 +57,142 @@ def get_template(current_user: models.User = Depends(auth.get_current_user)):
 @router.post("/upload")
 async def upload_patients(
     file: UploadFile = File(...), 
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(rbac.require_permission("patient.create")),
     db: Session = Depends(database.get_db)
 ):
-    # Permission Check
-    user_perms = [p.name for p in current_user.role.permissions]
-    if "patient.create" not in user_perms:
-       raise HTTPException(status_code=403, detail="Not authorized. Missing 'patient.create' permission.")
-
     if not file.filename.endswith('.xlsx'):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload .xlsx file.")
-    
-    contents = await file.read()
-    try:
-        df = pd.read_excel(io.BytesIO(contents))
-    except Exception:
-        raise HTTPException(status_code=400, detail="Could not read Excel file.")
-    
-    required_columns = ["Patient ID", "First Name", "Last Name", "DOB", "Gender"]
-    if not all(col in df.columns for col in required_columns):
-         raise HTTPException(status_code=400, detail=f"Missing columns. Required: {required_columns}")
-    
-    # ---------------------------------------------------------
-    # VALIDATION: Check for Duplicate Patient IDs
-    # ---------------------------------------------------------
-    # Get all IDs from the upload
-    uploaded_ids = df["Patient ID"].astype(str).tolist()
-    
-    # Check DB for any matching IDs (Global Uniqueness Check)
-    # or Local Uniqueness (manager specific). Here we use Global to prevent confusion.
-    existing_patients = db.query(models.Patient.patient_id)\
-        .filter(models.Patient.patient_id.in_(uploaded_ids))\
-        .all()
-    
-    existing_ids = [p[0] for p in existing_patients]
-    if existing_ids:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Duplicate Records Found: The following Patient IDs already exist: {', '.join(existing_ids[:5])}..."
-        )
-    # ---------------------------------------------------------
-
-    # helper to safely encrypt series
-    def encrypt_series(series):
-        return series.astype(str).apply(lambda x: security.encrypt(x))
-
-    # Encrypt in memory using Pandas (faster than row iteration)
-    # This prepares the data for bulk insert
-    df["First Name"] = encrypt_series(df["First Name"])
-    df["Last Name"] = encrypt_series(df["Last Name"])
-    df["DOB"] = encrypt_series(df["DOB"])
-    df["Gender"] = encrypt_series(df["Gender"])
-
-    # Prepare mappings for bulk insert
-    # Optimization: Use bulk_insert_mappings for massive speedup vs add() loop
-    patient_mappings = []
-    
-    # We can zip it for speed
-    records = df.to_dict('records')
-    for row in records:
-        patient_mappings.append({
-            "patient_id": str(row["Patient ID"]),
-            "first_name": row["First Name"],
-            "last_name": row["Last Name"],
-            "dob": row["DOB"],
-            "gender": row["Gender"],
-            "manager_id": current_user.id
-        })
-    
-    # Perform Bulk Insert
+
+    # Stream to disk, check the header, then hand the file to a background job
+    # (see upload_jobs.py). The client polls the job instead of holding this request open.
+    path = await ingest.spool(file)
     try:
-        db.bulk_insert_mappings(models.Patient, patient_mappings)
-        count = len(patient_mappings)
-        
-        # Audit Log
-        log = models.AuditLog(user_id=current_user.id, action="UPLOAD_PATIENTS", details=f"Uploaded {count} patients")
-        db.add(log)
+        rows_total = await run_in_threadpool(ingest.inspect, path)
+    except ingest.UploadError as e:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = upload_jobs.submit(db, current_user.id, file.filename, path, rows_total)
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "message": "Upload accepted. Processing in background."
+    })
+
+def _get_upload_job(db: Session, job_id: str, current_user: models.User):
+    # REQ: Data Isolation - managers only see their own jobs
+    job = upload_jobs.get(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
+@router.get("/upload-jobs/{job_id}", response_model=schemas.UploadJob)
+async def get_upload_job(
+    job_id: str,
+    response: Response,
+    current_user: models.User = Depends(rbac.require_permission("patient.create")),
+    db=Depends(database.get_session)
+):
+    job = await database.run(db, lambda db: schemas.UploadJob.model_validate(_get_upload_job(db, job_id, current_user)))
+    # The rows were written by the upload's process; the client's next reads stay
+    # on the primary until the window after the job finished ends (see replica.py)
+    if job.finished_at:
+        finished = job.finished_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        replica.issue_marker(response, current_user.id, finished + replica.READ_YOUR_WRITES_SECONDS)
+    return job
+
+@router.get("/upload-jobs/{job_id}/events")
+async def stream_upload_job(
+    job_id: str,
+    current_user: models.User = Depends(rbac.require_permission("patient.create")),
+    db=Depends(database.get_session)
+):
+    # Server-Sent Events alternative to polling: one event per progress change, ends when the job finishes
+    await database.run(db, _get_upload_job, job_id, current_user)
+    manager_id = current_user.id
+
+    async def events():
+        last = None
+        while True:
+            job = await run_in_threadpool(upload_jobs.snapshot, job_id, manager_id)
+            payload = schemas.UploadJob.model_validate(job).model_dump_json()
+            if payload != last:
+                last = payload
+                yield f"data: {payload}\n\n"
+            if job.status in upload_jobs.FINISHED:
+                break
+            if upload_jobs.is_orphan(job):
+                # Its process is gone: fail it, and the next event reports that
+                await run_in_threadpool(upload_jobs.recover_one, job_id)
+            await asyncio.sleep(upload_jobs.PROGRESS_INTERVAL_SECONDS)
 
-        # Audit Log (Encryption)
-        log_encrypt = models.AuditLog(user_id=current_user.id, action="ENCRYPTION_OPERATION", details=f"Encrypted {count} patient records")
-        db.add(log_encrypt)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error during bulk upload: {str(e)}")
+@router.get("/export")
+def export_patients(
+    request: Request,
+    format: str = "csv",
+    current_user: models.User = Depends(rbac.require_permission("patient.read")),
+    db: Session = Depends(database.get_db)
+):
+    if format not in export.STREAMERS:
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'csv' or 'xlsx'.")
 
-    return {"message": f"Successfully uploaded {count} patients."}
+    # Audit Log: one entry for the whole export
+    count = db.query(models.Patient.id).filter(models.Patient.manager_id == current_user.id).count()
+    audit.record(current_user.id, "EXPORT_PATIENTS", f"Exported {count} decrypted patient records | Format: {format}")
+
+    # Rows are streamed from a server-side cursor and decrypted chunk by chunk (see export.py)
+    return StreamingResponse(
+        export.STREAMERS[format](current_user.id, replica.read_after(request, current_user.id)),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=patients.{format}"}
+    )
 
 @router.get("/", response_model=List[schemas.Patient])
-def read_patients(
+async def read_patients(
+    response: Response,
     search: Optional[str] = None,
     sort_by: Optional[str] = "patient_id",
     skip: int = 0,
     limit: int = 100,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(rbac.require_permission("patient.read")),
+    db=Depends(replica.get_read_session)
 ):
-    # Permission Check
-    user_perms = [p.name for p in current_user.role.permissions]
-    if "patient.read" not in user_perms:
-       raise HTTPException(status_code=403, detail="Not authorized. Missing 'patient.read' permission.")
+    # Keyset pagination is on (patient_id, id), so it only applies to the default sort
+    can_paginate_in_db = sort_by == "patient_id"
+    if cursor and not can_paginate_in_db:
+        raise HTTPException(status_code=400, detail="cursor is only supported with sort_by=patient_id")
+    after = pagination.decode_cursor(cursor, str, int) if cursor else None
 
-    # Audit Log (Viewing/Access)
+    # Only the SQL goes through database.run(). Key resolution, decryption and the
+    # in-memory sort run in the threadpool: on the async engine run() executes on
+    # the event loop, and a large page would stall every other request.
+    search_filter = await run_in_threadpool(_begin_read, current_user.id, search, sort_by, limit)
+    data_version, raw_patients, page_start = await database.run(
+        db, _fetch_patients, response, search_filter, sort_by, skip, limit, after, current_user.id
+    )
+    return await run_in_threadpool(_decrypt_page, current_user.id, data_version, raw_patients, sort_by, page_start, limit)
+
+def _begin_read(manager_id: int, search: Optional[str], sort_by: Optional[str], limit: int):
+    # Audit Log (Viewing/Access), queued: a read commits nothing
     action_details = f"Action: View | Search: '{search}' | Sort: '{sort_by}' | Limit: {limit}"
-    log = models.AuditLog(user_id=current_user.id, action="ACCESS_PATIENTS", details=action_details)
-    db.add(log)
+    audit.record(manager_id, "ACCESS_PATIENTS", action_details)
     
     # Audit Log (Decryption)
     # We log that decryption was performed for the user session
-    log_decrypt = models.AuditLog(user_id=current_user.id, action="DECRYPTION_OPERATION", details="Decrypted patient records for display")
-    db.add(log_decrypt)
+    audit.record(manager_id, "DECRYPTION_OPERATION", "Decrypted patient records for display")
 
-    db.commit()
+    # Search runs in SQL against the blind index (see search_index.py); the term is
+    # hashed with the token key here, outside the database call
+    return search_index.search_clause(manager_id, search) if search else None
+
+def _fetch_patients(db: Session, response: Response, search_filter, sort_by: Optional[str], skip: int, limit: int, after, manager_id: int):
+    """The encrypted rows for one page: (data version, rows, offset of the page within rows)."""
+    # Read the version before the rows: a racing write leaves our cached rows tagged
+    # with an older version, which the next read discards.
+    data_version = patient_cache.data_version(db, manager_id)
 
     # Step A: Fetch records for the current Manager
     # REQ: Access Control & Performance > 50k
@@ -226,163 +206,196 @@ def read_patients(
         models.Patient.last_name,
         models.Patient.dob,
         models.Patient.gender,
+        models.Patient.record,
         models.Patient.manager_id
-    ).filter(models.Patient.manager_id == current_user.id)
+    ).filter(models.Patient.manager_id == manager_id)
 
-    # If no search text and sorting by patient_id, we can paginate in DB
-    can_paginate_in_db = (not search) and (sort_by == "patient_id")
-    
-    if can_paginate_in_db:
-        # SQL-side sort and limit (Very Fast)
-        query = query.order_by(models.Patient.patient_id.asc()).offset(skip).limit(limit)
-        raw_patients = query.all()
-    else:
-        # Must fetch all to decrypt and filter/sort in Python (Slower but Secure)
+    # Optimization 2: only rows matching the search are fetched and decrypted
+    if search_filter is not None:
+        query = query.filter(search_filter)
+
+    if sort_by == "patient_id":
+        # SQL-side sort and limit (Very Fast), on the (manager_id, patient_id, id) index.
+        # With a cursor the page starts right after the previous one instead of
+        # walking `skip` rows (skip, if also given, counts from the cursor).
+        if after:
+            query = query.filter(tuple_(models.Patient.patient_id, models.Patient.id) > after)
+        query = query.order_by(models.Patient.patient_id.asc(), models.Patient.id.asc()).offset(skip).limit(limit)
         raw_patients = query.all()
+        if raw_patients and len(raw_patients) == limit:
+            last = raw_patients[-1]
+            response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last.patient_id, last.id)
+        return data_version, raw_patients, 0
+    if sort_by in security.ORDER_FIELDS and sort_keys.is_backfilled(query, sort_by):
+        # Optimization 3: Encrypted sort fields paginate on their order tokens (see sort_keys.py).
+        # Only the buckets touching the requested page are fetched and decrypted.
+        raw_patients, page_start = sort_keys.bucket_window(query, sort_by, skip, limit)
+        return data_version, raw_patients, page_start
+    # Must fetch all to decrypt and filter/sort in Python (Slower but Secure)
+    return data_version, query.all(), skip
 
+def _decrypt_page(manager_id: int, data_version: int, raw_patients: list, sort_by: Optional[str], page_start: int, limit: int):
     # Step B: Decrypt fields in Python memory
-    # Optimization: List comprehension is faster than append loop
-    decrypted_patients = [
-        {
-            "id": p.id,
-            "patient_id": p.patient_id, # Unencrypted
-            "first_name": security.decrypt(p.first_name),
-            "last_name": security.decrypt(p.last_name),
-            "dob": security.decrypt(p.dob),
-            "gender": security.decrypt(p.gender),
-            "manager_id": p.manager_id
-        }
-        for p in raw_patients
-    ]
+    # Optimization 4: Rows already decrypted for this manager (same data version) come from cache
+    decrypted_patients = patient_cache.decrypt_rows(manager_id, data_version, raw_patients)
         
-    # Step C: Apply Search (Filter), Sort, and Pagination on the decrypted list
+    # Step C: Apply Sort and Pagination on the decrypted list
     # Only needed if we haven't already paginated in DB
-    if can_paginate_in_db:
+    if sort_by == "patient_id":
         return decrypted_patients
 
-    filtered_patients = decrypted_patients
-    if search:
-        search_lower = search.lower()
-        filtered_patients = [
-            p for p in decrypted_patients 
-            if search_lower in p["patient_id"].lower() or 
-               search_lower in p["first_name"].lower() or 
-               search_lower in p["last_name"].lower() or
-               search_lower in p["dob"].lower() or
-               search_lower in p["gender"].lower()
-        ]
-        
     # Sort
-    # Simple sort implementation
-    if sort_by in ["first_name", "last_name", "dob", "gender", "patient_id"]:
-        filtered_patients.sort(key=lambda x: x.get(sort_by, "").lower())
+    # Same ordering as the order tokens, so both paths return identical pages
+    if sort_by in security.ORDER_FIELDS:
+        decrypted_patients.sort(key=lambda x: sort_keys.sort_key(sort_by, x))
         
-    # Pagination
-    start = skip
-    end = skip + limit
-    paginated_patients = filtered_patients[start:end]
-    
-    # Step D: Return the resulting JSON
-    return paginated_patients
+    # Step D: Return the resulting page
+    return decrypted_patients[page_start:page_start + limit]
 
 @router.patch("/{patient_id}", response_model=schemas.Patient)
 def update_patient(
     patient_id: int, 
     patient_update: schemas.PatientUpdate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(rbac.require_permission("patient.update")),
     db: Session = Depends(database.get_db)
-):# REQ: Only Managers should access patient data functionality
-    if not current_user.role or current_user.role.name != "Manager":
-       raise HTTPException(status_code=403, detail="Not authorized. Only Managers can update patient data.")
-
+):
     # REQ: Data Isolation - ensure they own the record
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id, models.Patient.manager_id == current_user.id).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    if patient_update.first_name is not None:
-        patient.first_name = security.encrypt(patient_update.first_name)
-    if patient_update.last_name is not None:
-        patient.last_name = security.encrypt(patient_update.last_name)
-    if patient_update.dob is not None:
-        patient.dob = security.encrypt(patient_update.dob)
-    if patient_update.gender is not None:
-        patient.gender = security.encrypt(patient_update.gender)
+    old = security.decrypt_patients([patient])[0]
+    changes = {field: value for field, value in patient_update.model_dump().items() if value is not None}
+    if any(old[field] == security.DECRYPTION_FAILED for field in security.PII_FIELDS if field not in changes):
+        # Re-encrypting would overwrite the unreadable values with the failure marker
+        raise HTTPException(status_code=409, detail="Stored patient data could not be decrypted. Provide all fields to overwrite it.")
+    old_category = (old["gender"], old["dob"])
+
+    # The whole record is re-encrypted (in the configured storage mode)
+    plain = {**old, **changes}
+    for column, value in security.encrypt_patients([plain], key=data_keys.for_manager(patient.manager_id))[0].items():
+        setattr(patient, column, value)
+
+    # Keep the blind index and order tokens in sync with the new values
+    search_index.reindex_patient(db, patient, plain)
+    for column, token in sort_keys.order_columns(plain).items():
+        setattr(patient, column, token)
+    stat_changes = stats.deltas([old_category], -1)
+    stat_changes.update(stats.deltas([(plain["gender"], plain["dob"])]))
+    stats.apply(db, stat_changes)
     
+    patient_cache.bump_version(db, current_user.id)
+
     # Audit Log
-    log = models.AuditLog(user_id=current_user.id, action="UPDATE_PATIENT", details=f"Updated Patient {patient.patient_id}")
-    db.add(log)
+    audit.record(current_user.id, "UPDATE_PATIENT", f"Updated Patient {patient.patient_id}", db=db)
         
     db.commit()
     db.refresh(patient)
     
-    # Decrypt for response
     return {
         "id": patient.id,
         "patient_id": patient.patient_id,
-        "first_name": security.decrypt(patient.first_name),
-        "last_name": security.decrypt(patient.last_name),
-        "dob": security.decrypt(patient.dob),
-        "gender": security.decrypt(patient.gender),
+        **plain,
         "manager_id": patient.manager_id
     }
 
+# Bulk deletes are set-based: one DELETE ... RETURNING per DELETE_CHUNK_SIZE rows,
+# never loading ORM objects. The returned ciphertext feeds the stats deltas; the
+# search tokens go with their rows (ON DELETE CASCADE).
+DELETE_CHUNK_SIZE = 5000
+AUDIT_SAMPLE_IDS = 5 # Patient IDs named in the audit summary
+
+def _delete_where(db: Session, manager_id: int, clause) -> list:
+    table = models.Patient.__table__
+    return db.execute(
+        delete(table)
+        .where(table.c.manager_id == manager_id, clause)
+        .returning(table.c.patient_id, table.c.first_name, table.c.last_name, table.c.dob, table.c.gender, table.c.record)
+    ).all()
+
+def _delete_patients(db: Session, manager_id: int, ids: List[int] = None, condition=None):
+    """
+    Delete a manager's patients by row id or matching `condition`, chunk by chunk,
+    and apply the stats deltas. Returns (rows deleted, sample of their patient IDs).
+    """
+    table = models.Patient.__table__
+    count, sample, changes = 0, [], Counter()
+
+    def account(rows):
+        nonlocal count
+        count += len(rows)
+        sample.extend(row.patient_id for row in rows[:AUDIT_SAMPLE_IDS - len(sample)])
+        changes.update(stats.deltas(((plain["gender"], plain["dob"]) for plain in security.decrypt_patients(rows)), -1))
+
+    if ids is not None:
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            account(_delete_where(db, manager_id, table.c.id.in_(ids[start:start + DELETE_CHUNK_SIZE])))
+    else:
+        while True:
+            batch = select(table.c.id).where(table.c.manager_id == manager_id, condition).limit(DELETE_CHUNK_SIZE)
+            rows = _delete_where(db, manager_id, table.c.id.in_(batch))
+            account(rows)
+            if len(rows) < DELETE_CHUNK_SIZE:
+                break
+
+    if count:
+        stats.apply(db, changes)
+        patient_cache.bump_version(db, manager_id)
+    return count, sample
+
+def _audit_summary(count: int, sample: list, scope: str) -> str:
+    more = ", ..." if count > len(sample) else ""
+    return f"Deleted {count} patients ({scope}; patient IDs: {', '.join(sample)}{more})"
+
 @router.post("/bulk-delete")
 def bulk_delete_patients(
     ids: List[int],
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(rbac.require_permission("patient.delete")),
     db: Session = Depends(database.get_db)
 ):
-    # REQ: Only Managers (with delete perm)
-    user_perms = [p.name for p in current_user.role.permissions]
-    if "patient.delete" not in user_perms:
-       raise HTTPException(status_code=403, detail="Not authorized. Missing 'patient.delete' permission.")
-
-    # Filter to ensure user owns these records
-    patients_to_delete = db.query(models.Patient).filter(
-        models.Patient.id.in_(ids),
-        models.Patient.manager_id == current_user.id
-    ).all()
-    
-    if not patients_to_delete:
+    # manager_id in every statement: only the user's own records are deleted
+    count, sample = _delete_patients(db, current_user.id, ids=ids)
+    if not count:
         return {"message": "No records deleted"}
 
-    count = len(patients_to_delete)
-    
-    # Audit Log
-    log = models.AuditLog(
-        user_id=current_user.id, 
-        action="BULK_DELETE", 
-        details=f"Deleted {count} patients (IDs: {ids})"
-    )
-    db.add(log)
-    
-    # Bulk Delete
-    for p in patients_to_delete:
-        db.delete(p)
-        
+    # Audit Log: a summary, not the full id list
+    audit.record(current_user.id, "BULK_DELETE", _audit_summary(count, sample, f"{len(ids)} ids requested"), db=db)
+    db.commit()
+    return {"message": f"Successfully deleted {count} records"}
+
+@router.post("/delete-by-filter")
+def delete_patients_by_filter(
+    delete_filter: schemas.PatientDeleteFilter,
+    current_user: models.User = Depends(rbac.require_permission("patient.delete")),
+    db: Session = Depends(database.get_db)
+):
+    condition = models.Patient.__table__.c.upload_job_id == delete_filter.upload_job_id
+    count, sample = _delete_patients(db, current_user.id, condition=condition)
+    if not count:
+        return {"message": "No records deleted"}
+
+    audit.record(current_user.id, "BULK_DELETE", _audit_summary(count, sample, f"upload job {delete_filter.upload_job_id}"), db=db)
     db.commit()
     return {"message": f"Successfully deleted {count} records"}
 
 @router.delete("/{patient_id}", status_code=204)
 def delete_patient(
     patient_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(rbac.require_permission("patient.delete")),
     db: Session = Depends(database.get_db)
 ):
-    # REQ: Only Managers should access patient data functionality
-    if not current_user.role or current_user.role.name != "Manager":
-       raise HTTPException(status_code=403, detail="Not authorized. Only Managers can delete patients.")
-
     # REQ: Data Isolation - ensure they own the record
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id, models.Patient.manager_id == current_user.id).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found or access denied")
     
     # Audit Log
-    log = models.AuditLog(user_id=current_user.id, action="DELETE_PATIENT", details=f"Deleted Patient {patient.patient_id}")
-    db.add(log)
+    audit.record(current_user.id, "DELETE_PATIENT", f"Deleted Patient {patient.patient_id}", db=db)
 
     db.delete(patient)
+    plain = security.decrypt_patients([patient])[0]
+    stats.apply(db, stats.deltas([(plain["gender"], plain["dob"])], -1))
+    patient_cache.bump_version(db, current_user.id)
     db.commit()
     return Response(status_code=204)
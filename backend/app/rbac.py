@@ -0,0 +1,62 @@
+from fastapi import Depends, HTTPException
+from sqlalchemy.orm import Session, selectinload
+from . import models, auth
+from .database import SessionLocal
+import threading
+import time
+
+# Permission registry. Each role's effective permissions (its own plus everything
+# inherited from its parent chain, see models.Role.parent_id) are resolved once
+# into a frozen set, so a check is one set lookup instead of walking
+# role.permissions. Rebuilt at startup and by the admin endpoints that change
+# roles; other processes reload within auth.PRINCIPAL_CACHE_TTL_SECONDS.
+_permissions = {} # role id -> frozenset of permission names
+_built_at = None
+_lock = threading.Lock()
+
+def resolve(roles) -> dict:
+    """Effective permission sets ({role id: frozenset}) for roles with `permissions` and `parent_id`."""
+    by_id = {role.id: role for role in roles}
+    resolved = {}
+    for role in roles:
+        names = set()
+        seen = set()
+        current = role
+        while current is not None and current.id not in seen: # A cycle ends the chain
+            seen.add(current.id)
+            names.update(p.name for p in current.permissions)
+            current = by_id.get(current.parent_id)
+        resolved[role.id] = frozenset(names)
+    return resolved
+
+def rebuild(db: Session = None):
+    """Reload every role's effective permissions. Call after committing a change to roles or permissions."""
+    global _permissions, _built_at
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        roles = db.query(models.Role).options(selectinload(models.Role.permissions)).all()
+        permissions = resolve(roles)
+    finally:
+        if own_session:
+            db.close()
+    with _lock:
+        _permissions = permissions
+        _built_at = time.monotonic()
+
+def permissions_for(role_id: int) -> frozenset:
+    if _built_at is None or time.monotonic() - _built_at > auth.PRINCIPAL_CACHE_TTL_SECONDS or role_id not in _permissions:
+        rebuild()
+    return _permissions.get(role_id, frozenset())
+
+def has_permission(user: models.User, name: str) -> bool:
+    return user.role_id is not None and name in permissions_for(user.role_id)
+
+def require_permission(name: str):
+    """Dependency: the current user, or 403 unless their role (or a parent role) grants `name`."""
+    def dependency(current_user: models.User = Depends(auth.get_current_user)) -> models.User:
+        if not has_permission(current_user, name):
+            raise HTTPException(status_code=403, detail=f"Not authorized. Missing '{name}' permission.")
+        return current_user
+    return dependency
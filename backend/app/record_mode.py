@@ -0,0 +1,56 @@
+from sqlalchemy.orm import Session
+from . import models, security, data_keys
+from .database import SessionLocal
+
+# Converts stored patients between per-field tokens and one row record
+# (see security.encrypt_patients). Reads understand both layouts, so this can
+# run while the API is up; set PATIENT_RECORD_MODE to the same mode so new
+# writes match.
+BATCH_SIZE = 5000
+
+def convert(db: Session, mode: str) -> int:
+    """Re-encrypt rows not yet in `mode`. Walks the table by primary key and commits per batch."""
+    if mode not in security.RECORD_MODES:
+        raise ValueError(f"mode must be one of {security.RECORD_MODES}")
+    pending = models.Patient.record.is_(None) if mode == "row" else models.Patient.record.isnot(None)
+
+    last_id = 0
+    count = 0
+    while True:
+        batch = db.query(
+            models.Patient.id,
+            models.Patient.manager_id,
+            models.Patient.first_name,
+            models.Patient.last_name,
+            models.Patient.dob,
+            models.Patient.gender,
+            models.Patient.record
+        ).filter(models.Patient.id > last_id, pending).order_by(models.Patient.id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+
+        # Rows that fail to decrypt are left as they are rather than overwritten
+        plain = security.decrypt_patients(batch, failed=None)
+        readable = [(p, values) for p, values in zip(batch, plain) if None not in values.values()]
+        encrypted = data_keys.encrypt_patients([p for p, _ in readable], [values for _, values in readable], mode=mode)
+        db.bulk_update_mappings(models.Patient, [
+            {"id": p.id, **columns} for (p, _), columns in zip(readable, encrypted)
+        ])
+        db.commit()
+        if len(readable) < len(batch):
+            print(f"[WARN] Skipped {len(batch) - len(readable)} patients that could not be decrypted")
+        last_id = batch[-1].id
+        count += len(readable)
+    return count
+
+if __name__ == "__main__":
+    # docker-compose exec backend python -m app.record_mode row   (or: field)
+    import sys
+    if len(sys.argv) != 2 or sys.argv[1] not in security.RECORD_MODES:
+        print(f"Usage: python -m app.record_mode {{{'|'.join(security.RECORD_MODES)}}}")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        print(f"Converted {convert(db, sys.argv[1])} patients to {sys.argv[1]} mode")
+    finally:
+        db.close()
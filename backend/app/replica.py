@@ -0,0 +1,81 @@
+from fastapi import Depends, Request, Response
+from . import models, auth, database
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+# Read routing. With DATABASE_READ_URL set, list/stats/admin reads and exports go
+# to the replica, except for a user who wrote within READ_YOUR_WRITES_SECONDS:
+# their reads stay on the primary until the replica has surely caught up, so
+# nobody sees their own upload or edit missing. Writes are noted per process, by
+# successful non-GET requests (main.track_writes) and by every patient write
+# (patient_cache.bump_version, which also covers background uploads).
+#
+# The window also travels with the client, so it holds on every worker: write
+# responses (and the poll of a just-finished upload job) carry a signed marker,
+# "<user id>.<window end, epoch ms>.<HMAC>", both as the X-Read-After header and
+# as an HttpOnly cookie. A request that sends it back reads from the primary
+# until the window ends, whichever process serves it.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+MARKER_HEADER = "X-Read-After"
+MARKER_COOKIE = "read_after"
+
+_recent_writes = {} # user id -> wall-clock time their window ends
+_lock = threading.Lock()
+
+def enabled() -> bool:
+    return database.SQLALCHEMY_READ_URL is not None
+
+def note_write(user_id: int) -> float:
+    """Start (or extend) the user's window in this process. Returns when it ends, 0 without a replica."""
+    if not enabled():
+        return 0.0
+    now = time.time()
+    until = now + READ_YOUR_WRITES_SECONDS
+    with _lock:
+        _recent_writes[user_id] = until
+        if len(_recent_writes) > 10000: # Drop expired windows now and then
+            for key in [k for k, end in _recent_writes.items() if end <= now]:
+                del _recent_writes[key]
+    return until
+
+def _sign(user_id: int, until_ms: int) -> str:
+    return hmac.new(auth.SECRET_KEY.encode(), f"read-after:{user_id}.{until_ms}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def issue_marker(response: Response, user_id: int, until: float):
+    """Hand the client its window (see above); later requests that echo it read from the primary."""
+    if not enabled() or until <= time.time():
+        return
+    until_ms = int(until * 1000)
+    marker = f"{user_id}.{until_ms}.{_sign(user_id, until_ms)}"
+    response.headers[MARKER_HEADER] = marker
+    response.set_cookie(MARKER_COOKIE, marker, max_age=int(READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite="lax")
+
+def read_after(request: Request, user_id: int) -> float:
+    """End of the window carried by the request's marker, or 0 if it has none (or one that is not this user's)."""
+    marker = request.headers.get(MARKER_HEADER) or request.cookies.get(MARKER_COOKIE)
+    try:
+        marker_user, until_ms, signature = marker.split(".")
+        if int(marker_user) != user_id or not hmac.compare_digest(signature, _sign(user_id, int(until_ms))):
+            return 0.0
+        return int(until_ms) / 1000
+    except (AttributeError, ValueError):
+        return 0.0
+
+def use_replica(user_id: int, read_after: float = 0.0) -> bool:
+    if not enabled():
+        return False
+    with _lock:
+        until = max(_recent_writes.get(user_id, 0.0), read_after)
+    return until <= time.time()
+
+def session_factory(user_id: int, read_after: float = 0.0):
+    """Sync session factory for reads on behalf of `user_id` (e.g. export jobs)."""
+    return database.ReadSessionLocal if use_replica(user_id, read_after) else database.SessionLocal
+
+async def get_read_session(request: Request, current_user: models.User = Depends(auth.get_current_user)):
+    """Session dependency for read-only `async def` endpoints that call database.run()."""
+    async with database.session_scope(replica=use_replica(current_user.id, read_after(request, current_user.id))) as db:
+        yield db
@@ -13,6 +13,7 @@ class Permission(PermissionBase):
 
 class RoleBase(BaseModel):
     name: str
+    parent_id: Optional[int] = None # Inherits the parent role's permissions
 
 class Role(RoleBase):
     id: int
@@ -114,9 +115,26 @@ class PatientUpdate(BaseModel):
     dob: Optional[str] = None
     gender: Optional[str] = None
 
+class PatientDeleteFilter(BaseModel):
+    upload_job_id: str # Every patient that upload inserted
+
 class Patient(PatientBase):
     id: int
     manager_id: int
     class Config:
         from_attributes = True
 
+
+class UploadJob(BaseModel):
+    id: str
+    filename: Optional[str] = None
+    status: str
+    rows_total: Optional[int] = None
+    rows_parsed: int
+    rows_encrypted: int
+    rows_inserted: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
@@ -0,0 +1,98 @@
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from . import models, security, bulk_load
+from .database import SessionLocal
+
+# Rows per bulk insert when (re)building tokens
+BATCH_SIZE = 5000
+
+def build_tokens(row_id: int, manager_id: int, plain: dict, key: bytes = None) -> list:
+    """Token mappings for one patient. `plain` maps field name -> decrypted value."""
+    tokens = set()
+    for field in security.SEARCH_FIELDS:
+        if plain.get(field):
+            tokens |= security.search_tokens(field, plain[field], key)
+    return [
+        {"patient_row_id": row_id, "manager_id": manager_id, "token": t}
+        for t in tokens
+    ]
+
+def index_rows(db: Session, rows, key: bytes = None):
+    """
+    Insert blind index tokens for freshly inserted patients.
+    `rows` is an iterable of (patient row id, manager id, {field: plaintext}).
+    Does not commit - runs inside the caller's transaction.
+    """
+    batch = []
+    for row_id, manager_id, plain in rows:
+        batch.extend(build_tokens(row_id, manager_id, plain, key))
+        if len(batch) >= BATCH_SIZE:
+            bulk_load.insert_rows(db, models.PatientSearchToken, batch)
+            batch = []
+    if batch:
+        bulk_load.insert_rows(db, models.PatientSearchToken, batch)
+
+def reindex_patient(db: Session, patient: models.Patient, plain: dict):
+    """Replace the tokens of a single (updated) patient."""
+    db.query(models.PatientSearchToken)\
+        .filter(models.PatientSearchToken.patient_row_id == patient.id)\
+        .delete(synchronize_session=False)
+    index_rows(db, [(patient.id, patient.manager_id, plain)])
+
+def search_clause(manager_id: int, term: str):
+    """
+    SQL filter for a free-text search over a manager's patients.
+    Patient ID is plaintext and keeps substring semantics; encrypted fields
+    match on prefixes (e.g. "jo" finds "John" and "Jonah") via the blind index.
+    """
+    clauses = [models.Patient.patient_id.icontains(term.strip(), autoescape=True)]
+    tokens = security.query_tokens(term)
+    if tokens:
+        matching_ids = select(models.PatientSearchToken.patient_row_id).where(
+            models.PatientSearchToken.manager_id == manager_id,
+            models.PatientSearchToken.token.in_(tokens)
+        )
+        clauses.append(models.Patient.id.in_(matching_ids))
+    return or_(*clauses)
+
+def rebuild_all(db: Session, key: bytes = None):
+    """
+    Recompute every token from the decrypted data (backfill for rows uploaded
+    before blind indexing existed, or a new token key). Walks the table by
+    primary key and replaces each batch's tokens in its own commit.
+    """
+    # Resolved up front: creating the token key on first use needs its own commit
+    key = key or security.index_key()
+    last_id = 0
+    count = 0
+    while True:
+        batch = db.query(
+            models.Patient.id,
+            models.Patient.manager_id,
+            models.Patient.first_name,
+            models.Patient.last_name,
+            models.Patient.dob,
+            models.Patient.gender,
+            models.Patient.record
+        ).filter(models.Patient.id > last_id).order_by(models.Patient.id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+
+        db.query(models.PatientSearchToken)\
+            .filter(models.PatientSearchToken.patient_row_id.in_([p.id for p in batch]))\
+            .delete(synchronize_session=False)
+        index_rows(db, [
+            (p.id, p.manager_id, plain)
+            for p, plain in zip(batch, security.decrypt_patients(batch))
+        ], key)
+        db.commit()
+        last_id = batch[-1].id
+        count += len(batch)
+    return count
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt blind index for {rebuild_all(db)} patients")
+    finally:
+        db.close()
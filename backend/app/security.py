@@ -1,5 +1,17 @@
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import accumulate
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import multiprocessing
 import os
+import threading
+import time
 
 # Generate one with: from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())
 # Example key for dev: 
@@ -9,23 +21,394 @@ if not ENCRYPTION_KEY:
 
 # Ensure key is valid (Fernet requires 32 url-safe base64-encoded bytes)
 try:
-    f = Fernet(ENCRYPTION_KEY)
+    Fernet(ENCRYPTION_KEY)
+    _active_key = ENCRYPTION_KEY
 except Exception as e:
     print(f"Invalid Encryption Key: {e}")
     # Fallback for dev only - DO NOT USE IN PRODUCTION
     key = Fernet.generate_key()
-    f = Fernet(key)
+    _active_key = key.decode()
     print(f"Generated temporary key: {key.decode()}")
 
+DECRYPTION_FAILED = "[Decryption Failed]"
+
+# --- Keyring ---
+# The master key used for new writes and the keys accepted for reads come from a
+# small JSON file ({"active": key, "previous": [keys]}) that every process re-reads
+# when it changes. Patient data itself is encrypted with per-manager data keys,
+# which the master key wraps (see data_keys.py). rotate_keys.py publishes a new
+# active key there and lists the old one as previous until everything is
+# re-wrapped, so the running API reads both throughout a rotation and needs no
+# restart. Without the file, ENCRYPTION_KEY is the only master key.
+KEYRING_FILE = os.getenv("ENCRYPTION_KEYRING_FILE", "keyring.json")
+KEYRING_RELOAD_SECONDS = 1.0
+
+class _Keyring:
+    def __init__(self):
+        self.active = _active_key
+        self.previous = []
+        self.readable = {} # key id -> key, active first
+        self._mtime = self._checked_at = None
+        self._lock = threading.Lock()
+        self._set(_active_key, [])
+
+    def _set(self, active: str, previous: list):
+        self.active = active
+        self.previous = [k for k in previous if k != active]
+        # The key this process started with stays readable (e.g. legacy tokens)
+        self.readable = {key_id(k): k for k in [active, *self.previous, _active_key]}
+
+    def refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < KEYRING_RELOAD_SECONDS:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(KEYRING_FILE).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            if mtime is None:
+                self._set(_active_key, [])
+            else:
+                with open(KEYRING_FILE) as fh:
+                    data = json.load(fh)
+                self._set(data["active"], data.get("previous", []))
+            self._mtime = mtime
+
+_keyring = None
+
+def _current() -> _Keyring:
+    global _keyring
+    if _keyring is None:
+        _keyring = _Keyring()
+    _keyring.refresh()
+    return _keyring
+
+def active_key() -> str:
+    return _current().active
+
+def readable_keys() -> dict:
+    """Keys accepted for decryption ({key id: key}), active key first."""
+    return _current().readable
+
+def save_keyring(active: str, previous: list = ()):
+    """Publish a keyring to every process (atomic replace; picked up within KEYRING_RELOAD_SECONDS)."""
+    tmp = f"{KEYRING_FILE}.tmp"
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as fh:
+        json.dump({"active": active, "previous": list(previous)}, fh)
+    os.replace(tmp, KEYRING_FILE)
+
+# --- Cipher Engines ---
+# Ciphertexts carry a header "<algorithm>:<key id>:<payload>", so decryption can
+# dispatch on it and several ciphers (and keys) can coexist in one table. Tokens
+# without a header are legacy Fernet tokens under the active key.
+# New data is written with ENCRYPTION_CIPHER: "fernet" (AES-128-CBC + HMAC) or
+# "aesgcm" (AES-256-GCM, faster, with the header bound as associated data).
+# Both engines derive their key material from the key they are given.
+
+class FernetCipher:
+    name = "fernet"
+
+    def __init__(self, key: str):
+        self._fernet = Fernet(key)
+
+    def encrypt(self, data: bytes, header: bytes) -> str:
+        return self._fernet.encrypt(data).decode()
+
+    def decrypt(self, payload: str, header: bytes) -> bytes:
+        return self._fernet.decrypt(payload.encode())
+
+class AesGcmCipher:
+    name = "aesgcm"
+    NONCE_BYTES = 12
+
+    def __init__(self, key: str):
+        self._aead = AESGCM(hmac.new(key.encode(), b"patient-aes-256-gcm", hashlib.sha256).digest())
+
+    def encrypt(self, data: bytes, header: bytes) -> str:
+        nonce = os.urandom(self.NONCE_BYTES)
+        return base64.urlsafe_b64encode(nonce + self._aead.encrypt(nonce, data, header)).decode().rstrip("=")
+
+    def decrypt(self, payload: str, header: bytes) -> bytes:
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        return self._aead.decrypt(raw[:self.NONCE_BYTES], raw[self.NONCE_BYTES:], header)
+
+CIPHERS = {engine.name: engine for engine in (FernetCipher, AesGcmCipher)}
+CIPHER = os.getenv("ENCRYPTION_CIPHER", "fernet")
+if CIPHER not in CIPHERS:
+    raise ValueError(f"ENCRYPTION_CIPHER must be one of {tuple(CIPHERS)}")
+
+@lru_cache(maxsize=256)
+def key_id(key: str) -> str:
+    """Short public identifier of a key (truncated SHA-256), stored in ciphertext headers."""
+    return hashlib.sha256(key.encode()).hexdigest()[:8]
+
+@lru_cache(maxsize=256)
+def _engine(name: str, key: str):
+    return CIPHERS[name](key)
+
+def seal(text: str, key: str = None, cipher: str = None) -> str:
+    """Encrypt one non-empty string under `key` (default: active key) with a self-describing header."""
+    key = key or active_key()
+    cipher = cipher or CIPHER
+    header = f"{cipher}:{key_id(key)}"
+    return f"{header}:{_engine(cipher, key).encrypt(text.encode(), header.encode())}"
+
+def _unseal(token: str, keys: dict) -> str:
+    if ":" not in token:
+        # Legacy Fernet token: no key id, so try each key
+        for key in keys.values():
+            try:
+                return _engine("fernet", key).decrypt(token, b"").decode()
+            except Exception:
+                pass
+        raise ValueError("Legacy token does not decrypt with any known key")
+    cipher, kid, payload = token.split(":", 2)
+    if kid not in keys:
+        raise ValueError(f"Token was encrypted with an unknown key ({kid})")
+    return _engine(cipher, keys[kid]).decrypt(payload, f"{cipher}:{kid}".encode()).decode()
+
+def _keys_for(tokens: list) -> dict:
+    """The keyring plus the data keys (see data_keys.py) named in the token headers."""
+    keys = readable_keys()
+    unknown = {token.split(":", 2)[1] for token in tokens if token and ":" in token} - keys.keys()
+    if unknown:
+        from . import data_keys # Needs the database; imported late to keep this module standalone
+        keys = {**keys, **data_keys.resolve(unknown)}
+    return keys
+
+def unseal(token: str, key: str = None) -> str:
+    """Decrypt one token written by seal() (or a legacy Fernet token) with `key` or any known key. Raises on failure."""
+    return _unseal(token, {key_id(key): key} if key else _keys_for([token]))
+
 def encrypt(text: str) -> str:
     if not text:
         return ""
-    return f.encrypt(text.encode()).decode()
+    return seal(text)
 
 def decrypt(token: str) -> str:
     if not token:
         return ""
     try:
-        return f.decrypt(token.encode()).decode()
+        return unseal(token)
     except Exception:
-        return "[Decryption Failed]"
+        return DECRYPTION_FAILED
+
+# --- Bulk Crypto Worker Pool ---
+# Fernet is CPU bound and holds the GIL, so one request thread can only use one
+# core. Bulk jobs (upload, list, stats rebuild, key rotation) are split into
+# chunks and run in a shared process pool. Small jobs stay inline, where the
+# pickling round trip would cost more than it saves.
+POOL_WORKERS = int(os.getenv("CRYPTO_POOL_WORKERS") or os.cpu_count() or 1)
+POOL_THRESHOLD = int(os.getenv("CRYPTO_POOL_THRESHOLD", "4000")) # values per job
+POOL_CHUNK_SIZE = 1000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process is multi-threaded and holds DB connections
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+# Keys are passed to the workers explicitly, so they never depend on their own keyring view
+def _encrypt_values(values: list, key: str, cipher: str) -> list:
+    return [seal(v, key, cipher) if v else "" for v in values]
+
+def _decrypt_values(tokens: list, keys: dict, failed) -> list:
+    result = []
+    for token in tokens:
+        if not token:
+            result.append("")
+            continue
+        try:
+            result.append(_unseal(token, keys))
+        except Exception:
+            result.append(failed)
+    return result
+
+def _run(func, values: list, *args) -> list:
+    if len(values) < POOL_THRESHOLD or POOL_WORKERS <= 1:
+        return func(values, *args)
+    chunks = [values[i:i + POOL_CHUNK_SIZE] for i in range(0, len(values), POOL_CHUNK_SIZE)]
+    futures = [_get_pool().submit(func, chunk, *args) for chunk in chunks]
+    return [value for future in futures for value in future.result()]
+
+def encrypt_many(values: list, key: str = None, cipher: str = None) -> list:
+    """Encrypt a list of strings (empty stays empty), in parallel when large."""
+    return _run(_encrypt_values, values, key or active_key(), cipher or CIPHER)
+
+def decrypt_many(tokens: list, key: str = None, failed=DECRYPTION_FAILED) -> list:
+    """Decrypt a list of tokens with `key` or any known key, in parallel when large. Undecryptable tokens become `failed`."""
+    return _run(_decrypt_values, tokens, {key_id(key): key} if key else _keys_for(tokens), failed)
+
+# --- Patient Records ---
+# PII is stored either as one token per column ("field" mode, the default) or,
+# opt-in via PATIENT_RECORD_MODE=row, packed into a single token per patient in
+# `patients.record` with the field columns left NULL. Row mode does one
+# HMAC/AES/base64 pass per patient instead of four and stores one IV, MAC and
+# header instead of four. Reads handle both layouts, so a table can be converted
+# gradually (python -m app.record_mode).
+PII_FIELDS = ("first_name", "last_name", "dob", "gender")
+RECORD_MODES = ("field", "row")
+RECORD_MODE = os.getenv("PATIENT_RECORD_MODE", "field")
+if RECORD_MODE not in RECORD_MODES:
+    raise ValueError(f"PATIENT_RECORD_MODE must be one of {RECORD_MODES}")
+
+def encrypt_patients(plain_rows: list, key: str, mode: str = None) -> list:
+    """
+    Encrypted column values ({column: value}) for plaintext PII dicts, as one
+    bulk job. `key` is the manager's data key (data_keys.for_manager).
+    """
+    if (mode or RECORD_MODE) == "row":
+        tokens = encrypt_many([
+            json.dumps([plain[field] for field in PII_FIELDS], separators=(",", ":")) for plain in plain_rows
+        ], key)
+        return [{"record": token, **dict.fromkeys(PII_FIELDS)} for token in tokens]
+
+    n = len(PII_FIELDS)
+    tokens = encrypt_many([plain[field] for plain in plain_rows for field in PII_FIELDS], key)
+    return [{"record": None, **dict(zip(PII_FIELDS, tokens[n * i:n * i + n]))} for i in range(len(plain_rows))]
+
+def decrypt_patients(rows: list, key: str = None, failed=DECRYPTION_FAILED) -> list:
+    """
+    Plaintext PII dicts for patient rows (anything with `record` and the PII
+    columns), in either layout, as one bulk job. Undecryptable values become `failed`.
+    """
+    tokens = []
+    for row in rows:
+        if row.record:
+            tokens.append(row.record)
+        else:
+            tokens.extend(getattr(row, field) for field in PII_FIELDS)
+    values = iter(decrypt_many(tokens, key, failed))
+
+    result = []
+    for row in rows:
+        if row.record:
+            packed = next(values)
+            result.append(dict.fromkeys(PII_FIELDS, failed) if packed == failed else dict(zip(PII_FIELDS, json.loads(packed))))
+        else:
+            result.append({field: next(values) for field in PII_FIELDS})
+    return result
+
+# --- Blind Index (searchable encryption) ---
+# Encrypted columns cannot be searched with SQL. Instead we store keyed HMACs of
+# normalized prefixes of each PII field. A search term is hashed the same way and
+# matched with a plain indexed equality lookup; the plaintext never reaches the DB.
+SEARCH_FIELDS = ("first_name", "last_name", "dob", "gender")
+MIN_PREFIX_LENGTH = 2   # 1-char prefixes would leak first-letter frequencies
+MAX_PREFIX_LENGTH = 32  # longer search terms are truncated to this length
+
+@lru_cache(maxsize=8)
+def derive_index_key(token_key: str) -> bytes:
+    """Blind index key is derived from the token key (data_keys.token_key), which survives master rotation."""
+    return hmac.new(token_key.encode(), b"patient-blind-index", hashlib.sha256).digest()
+
+def index_key() -> bytes:
+    from . import data_keys
+    return derive_index_key(data_keys.token_key())
+
+def normalize(field: str, value: str) -> str:
+    value = " ".join(str(value).lower().split())
+    if field == "dob":
+        # "1980-01-01 00:00:00" (pandas Timestamp) and "1980-01-01" must index the same
+        value = value.split(" ")[0]
+    return value[:MAX_PREFIX_LENGTH]
+
+def blind_index(field: str, value: str, key: bytes = None) -> str:
+    digest = hmac.new(key or index_key(), f"{field}:{value}".encode(), hashlib.sha256)
+    return digest.hexdigest()[:32]
+
+def search_tokens(field: str, value: str, key: bytes = None) -> set:
+    """All prefix tokens stored for one field value."""
+    value = normalize(field, value)
+    return {
+        blind_index(field, value[:i], key)
+        for i in range(MIN_PREFIX_LENGTH, len(value) + 1)
+    }
+
+def query_tokens(term: str, key: bytes = None) -> list:
+    """Tokens to look up for a search term (one per searchable field)."""
+    tokens = []
+    for field in SEARCH_FIELDS:
+        value = normalize(field, term)
+        if len(value) >= MIN_PREFIX_LENGTH:
+            tokens.append(blind_index(field, value, key))
+    return tokens
+
+# --- Order Tokens (sortable encryption) ---
+# Encrypted columns cannot be sorted with SQL either. Each sortable field gets a
+# coarse bucket (first 3 characters for text, birth month for DOB) which is mapped
+# through a keyed, strictly increasing table. The DB can ORDER BY the token but
+# only learns bucket order, not bucket values. Exact order within a bucket is
+# resolved after decryption (see sort_keys.py).
+ORDER_FIELDS = ("first_name", "last_name", "dob", "gender")
+ORDER_PREFIX_LENGTH = 3
+_ORDER_ALPHABET_SIZE = 40 # pad, <'0', '0'-'9', between '9' and 'a', 'a'-'z', >'z'
+_DOB_MIN_YEAR, _DOB_MAX_YEAR = 1900, 2099
+DOB_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%m/%d/%Y")
+
+@lru_cache(maxsize=8)
+def derive_order_key(token_key: str) -> bytes:
+    """Order token key is derived from the token key (data_keys.token_key), which survives master rotation."""
+    return hmac.new(token_key.encode(), b"patient-order-token", hashlib.sha256).digest()
+
+def order_key() -> bytes:
+    from . import data_keys
+    return derive_order_key(data_keys.token_key())
+
+def parse_dob(value: str):
+    """Best-effort DOB parsing for the formats accepted on upload. Returns None if unknown."""
+    if not value:
+        return None
+    for fmt in DOB_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.split(" ")[0], fmt)
+        except ValueError:
+            pass
+    return None
+
+def _symbol(ch: str) -> int:
+    # Monotone in code point order, so buckets agree with sorting on value.lower()
+    if ch < "0": return 1
+    if ch <= "9": return 2 + ord(ch) - ord("0")
+    if ch < "a": return 12
+    if ch <= "z": return 13 + ord(ch) - ord("a")
+    return 39
+
+def _order_bucket(field: str, value: str) -> int:
+    if field == "dob":
+        dob = parse_dob(value)
+        if not dob or not (_DOB_MIN_YEAR <= dob.year <= _DOB_MAX_YEAR):
+            return 0
+        return (dob.year - _DOB_MIN_YEAR) * 12 + dob.month
+    bucket = 0
+    prefix = str(value).lower()[:ORDER_PREFIX_LENGTH]
+    for i in range(ORDER_PREFIX_LENGTH):
+        bucket = bucket * _ORDER_ALPHABET_SIZE + (_symbol(prefix[i]) if i < len(prefix) else 0)
+    return bucket
+
+@lru_cache(maxsize=8)
+def _order_table(key: bytes, domain: str) -> list:
+    size = ((_DOB_MAX_YEAR - _DOB_MIN_YEAR + 1) * 12 + 1) if domain == "dob" else _ORDER_ALPHABET_SIZE ** ORDER_PREFIX_LENGTH
+    # Random gaps (1-4096) from a keyed XOF; the running sum is strictly increasing
+    stream = hashlib.shake_256(key + domain.encode()).digest(2 * size)
+    return list(accumulate(1 + int.from_bytes(stream[i:i + 2], "big") % 4096 for i in range(0, len(stream), 2)))
+
+def order_token(field: str, value: str, key: bytes = None) -> int:
+    domain = "dob" if field == "dob" else "text"
+    return _order_table(key or order_key(), domain)[_order_bucket(field, value)]
@@ -0,0 +1,97 @@
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, Query
+from . import models, security
+from .database import SessionLocal
+
+# Rows per backfill batch (one commit each)
+BATCH_SIZE = 5000
+# Fields with only a handful of distinct values, so one bucket can hold half a
+# manager's rows. Rows within a bucket are ordered by patient_id instead of by
+# plaintext, which lets SQL cut the exact page: no bucket is fetched whole. Values
+# sharing the first 3 letters (e.g. "Male", "male") sort as one group.
+SQL_ORDERED_FIELDS = ("gender",)
+
+def order_column(field: str):
+    return getattr(models.Patient, f"{field}_order")
+
+def order_columns(plain: dict, key: bytes = None) -> dict:
+    """Order token column values for the fields present in `plain` ({field: plaintext})."""
+    return {
+        f"{field}_order": security.order_token(field, plain[field], key)
+        for field in security.ORDER_FIELDS if field in plain
+    }
+
+def sort_key(field: str, patient: dict):
+    """Exact in-memory order of decrypted patients. Agrees with the order tokens, so buckets never interleave."""
+    value = patient[field]
+    if field in SQL_ORDERED_FIELDS:
+        return (security.order_token(field, value), patient["patient_id"])
+    return (security.order_token(field, value), value.lower(), patient["patient_id"])
+
+def is_backfilled(query: Query, field: str) -> bool:
+    """False while some rows in `query` still lack an order token for `field`."""
+    col = order_column(field)
+    return query.with_entities(models.Patient.id).filter(col.is_(None)).limit(1).first() is None
+
+def bucket_window(query: Query, field: str, skip: int, limit: int):
+    """
+    Fetch only the rows needed for one page sorted by an encrypted field.
+
+    Order tokens are coarse (many rows share a bucket), so the page is widened to
+    the complete buckets it touches. Returns (rows, offset): after decrypting and
+    sorting `rows` with sort_key(), the page is rows[offset:offset + limit].
+    Names and DOB therefore cost O(bucket) per page (a 3-letter prefix, a birth
+    month); SQL_ORDERED_FIELDS cost O(page).
+    """
+    col = order_column(field)
+    if field in SQL_ORDERED_FIELDS:
+        return query.order_by(col, models.Patient.patient_id, models.Patient.id).offset(skip).limit(limit).all(), 0
+    page_tokens = [t for (t,) in query.with_entities(col).order_by(col).offset(skip).limit(limit)]
+    if not page_tokens:
+        return [], 0
+
+    low, high = page_tokens[0], page_tokens[-1]
+    before = query.with_entities(models.Patient.id).filter(col < low).count()
+    rows = query.filter(col >= low, col <= high).all()
+    return rows, skip - before
+
+def backfill(db: Session, key: bytes = None, rebuild: bool = False):
+    """
+    Compute order tokens for rows that do not have them yet (or all rows if
+    `rebuild`). Walks the table by primary key and commits per batch.
+    """
+    key = key or security.order_key() # Before any write, see search_index.rebuild_all
+    missing = or_(*[order_column(field).is_(None) for field in security.ORDER_FIELDS])
+    last_id = 0
+    count = 0
+    while True:
+        query = db.query(
+            models.Patient.id,
+            models.Patient.first_name,
+            models.Patient.last_name,
+            models.Patient.dob,
+            models.Patient.gender,
+            models.Patient.record
+        ).filter(models.Patient.id > last_id)
+        if not rebuild:
+            query = query.filter(missing)
+        batch = query.order_by(models.Patient.id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+
+        db.bulk_update_mappings(models.Patient, [
+            {"id": p.id, **order_columns(plain, key)}
+            for p, plain in zip(batch, security.decrypt_patients(batch))
+        ])
+        db.commit()
+        last_id = batch[-1].id
+        count += len(batch)
+    return count
+
+if __name__ == "__main__":
+    import sys
+    db = SessionLocal()
+    try:
+        print(f"Computed order tokens for {backfill(db, rebuild='--all' in sys.argv)} patients")
+    finally:
+        db.close()
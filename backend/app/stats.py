@@ -0,0 +1,132 @@
+from collections import Counter
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import models, security
+from .database import SessionLocal
+import datetime
+import logging
+
+# Patient counts by (gender, birth year) in `patient_stats`, kept up to date as
+# deltas by every write. Age buckets are derived from birth years when the
+# report is read, so the rollup never goes stale at year rollover.
+AGE_GROUPS = (("0-18", 18), ("19-35", 35), ("36-50", 50), ("51-70", 70), ("70+", None))
+UNKNOWN_YEAR = 0
+REBUILD_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+def _category(gender: str, dob: str):
+    gender = gender if gender in ("Male", "Female") else "Other"
+    parsed = security.parse_dob(dob)
+    return gender, parsed.year if parsed else UNKNOWN_YEAR
+
+def deltas(plain_rows, sign: int = 1) -> Counter:
+    """
+    Count changes for patients added (sign=1) or removed (sign=-1). Rows are (gender, dob) plaintext.
+    Rows whose gender or DOB failed to decrypt are left out and logged: their bucket
+    is unknown, and guessing one would silently skew the rollup. `python -m app.stats`
+    recounts it.
+    """
+    counts = Counter()
+    unreadable = 0
+    for gender, dob in plain_rows:
+        if security.DECRYPTION_FAILED in (gender, dob):
+            unreadable += 1
+            continue
+        counts[_category(gender, dob)] += sign
+    if unreadable:
+        logger.warning("%d patients with undecryptable gender/DOB left out of the stats deltas; run python -m app.stats to recount", unreadable)
+    return counts
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(models.PatientStat)
+    return stmt.on_conflict_do_update(
+        index_elements=["gender", "birth_year"],
+        set_={"count": models.PatientStat.count + stmt.excluded.count}
+    )
+
+def apply(db: Session, counts: Counter):
+    """Apply deltas inside the caller's transaction (one upsert per changed bucket)."""
+    changed = [
+        {"gender": gender, "birth_year": year, "count": n}
+        for (gender, year), n in counts.items() if n
+    ]
+    if changed:
+        db.execute(_upsert(db), changed)
+
+def summary(db: Session) -> dict:
+    """Report payload for /patients/stats, computed from the rollup only."""
+    now_year = datetime.datetime.utcnow().year
+    total = 0
+    by_gender = Counter()
+    age_groups = {name: 0 for name, _ in AGE_GROUPS}
+
+    for stat in db.query(models.PatientStat).all():
+        total += stat.count
+        by_gender[stat.gender] += stat.count
+        if stat.birth_year == UNKNOWN_YEAR:
+            continue
+        age = now_year - stat.birth_year
+        for name, upper in AGE_GROUPS:
+            if upper is None or age <= upper:
+                age_groups[name] += stat.count
+                break
+
+    return {
+        "total_patients": total,
+        "gender_distribution": {
+            "male_percentage": round(by_gender["Male"] / total * 100) if total else 0,
+            "female_percentage": round(by_gender["Female"] / total * 100) if total else 0
+        },
+        "age_groups": age_groups
+    }
+
+def _decrypted_deltas(rows: list) -> Counter:
+    # Decrypted as one bulk job across the worker pool
+    return deltas((plain["gender"], plain["dob"]) for plain in security.decrypt_patients(rows))
+
+def rebuild(db: Session) -> int:
+    """
+    Recompute the rollup from the encrypted data (backfill / drift repair).
+    On Postgres the table is locked first, so concurrent uploads wait and apply
+    their deltas on top of the rebuilt counts instead of being lost.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE patient_stats IN EXCLUSIVE MODE"))
+    db.query(models.PatientStat).delete(synchronize_session=False)
+
+    counts = Counter()
+    batch = []
+    rows = db.query(
+        models.Patient.first_name,
+        models.Patient.last_name,
+        models.Patient.dob,
+        models.Patient.gender,
+        models.Patient.record
+    ).yield_per(REBUILD_BATCH_SIZE)
+    for p in rows:
+        batch.append(p)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            counts.update(_decrypted_deltas(batch))
+            batch = []
+    counts.update(_decrypted_deltas(batch))
+    apply(db, counts)
+    db.commit()
+    return sum(counts.values())
+
+def rebuild_if_empty(db: Session):
+    """Startup backfill for deployments that have patients but no rollup yet."""
+    if db.query(models.PatientStat).first() is None and db.query(models.Patient.id).first() is not None:
+        print(f"Rebuilt patient stats for {rebuild(db)} patients")
+
+if __name__ == "__main__":
+    # Run periodically (e.g. nightly cron) to repair any drift:
+    #   docker-compose exec backend python -m app.stats
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt patient stats for {rebuild(db)} patients")
+    finally:
+        db.close()
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from . import models, ingest
+from .database import SessionLocal
+import datetime
+import os
+import socket
+import time
+import uuid
+
+# Background processing of patient uploads. The request only spools the file and
+# queues a job; a small worker pool runs the ingest pipeline and records progress
+# in `upload_jobs`, which any API worker can serve to the polling client.
+# Jobs live in the process that accepted them. Each row records that process
+# ("host:pid") and its spooled file, so after a restart or reload `recover()`
+# fails the jobs it left unfinished and deletes their files. Jobs of other hosts
+# are only presumed dead after ORPHAN_AFTER_SECONDS.
+WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+PROGRESS_INTERVAL_SECONDS = 0.5
+FINISHED = ("completed", "failed")
+ORPHAN_AFTER_SECONDS = int(os.getenv("UPLOAD_JOB_ORPHAN_SECONDS", "86400"))
+INTERRUPTED = "Upload was interrupted by a server restart. Please upload the file again."
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="upload-job")
+_submitted = set() # Ids of the jobs this process queued
+
+def _update(job_id: str, **values):
+    # Own short-lived session: the ingest transaction stays uncommitted until the end
+    db = SessionLocal()
+    try:
+        db.query(models.UploadJob).filter(models.UploadJob.id == job_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+def _run(job_id: str, path: str, manager_id: int):
+    db = SessionLocal()
+    last_write = 0.0
+
+    def on_progress(parsed: int, encrypted: int, inserted: int):
+        nonlocal last_write
+        now = time.monotonic()
+        if now - last_write >= PROGRESS_INTERVAL_SECONDS:
+            last_write = now
+            try:
+                _update(job_id, rows_parsed=parsed, rows_encrypted=encrypted, rows_inserted=inserted)
+            except Exception:
+                pass # Progress is best-effort; never fail the upload over it
+
+    try:
+        _update(job_id, status="running")
+        count = ingest.ingest(db, path, manager_id, on_progress, upload_job_id=job_id)
+        _update(job_id, status="completed", rows_parsed=count, rows_encrypted=count, rows_inserted=count,
+                finished_at=datetime.datetime.utcnow())
+    except ingest.UploadError as e:
+        _update(job_id, status="failed", error=str(e), finished_at=datetime.datetime.utcnow())
+    except Exception as e:
+        _update(job_id, status="failed", error=f"Database error during bulk upload: {str(e)}",
+                finished_at=datetime.datetime.utcnow())
+    finally:
+        db.close()
+        os.unlink(path)
+        _submitted.discard(job_id)
+
+def submit(db: Session, manager_id: int, filename: str, path: str, rows_total: int = None) -> models.UploadJob:
+    """Record a queued job for a spooled file and hand it to the worker pool (which deletes the file)."""
+    job = models.UploadJob(id=uuid.uuid4().hex, manager_id=manager_id, filename=filename, rows_total=rows_total,
+                           worker=_worker(), spool_path=path)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _submitted.add(job.id)
+    _executor.submit(_run, job.id, path, manager_id)
+    return job
+
+def get(db: Session, job_id: str, manager_id: int):
+    """A manager can only see their own jobs."""
+    return db.query(models.UploadJob).filter(
+        models.UploadJob.id == job_id,
+        models.UploadJob.manager_id == manager_id
+    ).first()
+
+def snapshot(job_id: str, manager_id: int):
+    """Fresh read for the SSE stream (a long-lived session would keep serving cached state)."""
+    db = SessionLocal()
+    try:
+        return get(db, job_id, manager_id)
+    finally:
+        db.close()
+
+def _worker() -> str:
+    # Read at call time: forked workers (e.g. --reload, gunicorn) have their own pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Exists, owned by someone else
+    return True
+
+def is_orphan(job: models.UploadJob) -> bool:
+    """True if no live process will ever finish this unfinished job."""
+    host, _, pid = (job.worker or "").rpartition(":")
+    if host == socket.gethostname() and pid.isdigit():
+        # Our own pid can only be a predecessor's (e.g. pid 1 in a restarted container)
+        # unless we queued the job ourselves
+        return not _alive(int(pid)) or (int(pid) == os.getpid() and job.id not in _submitted)
+    return job.created_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=ORPHAN_AFTER_SECONDS)
+
+def recover(db: Session, job_id: str = None) -> int:
+    """Fail the unfinished jobs (or the one job) whose process is gone and delete their files. Returns the jobs failed."""
+    unfinished = db.query(models.UploadJob).filter(models.UploadJob.status.notin_(FINISHED))
+    if job_id is not None:
+        unfinished = unfinished.filter(models.UploadJob.id == job_id)
+    orphans = [job for job in unfinished if is_orphan(job)]
+    for job in orphans:
+        job.status = "failed"
+        job.error = INTERRUPTED
+        job.finished_at = datetime.datetime.utcnow()
+        if job.spool_path and os.path.exists(job.spool_path):
+            os.unlink(job.spool_path)
+    db.commit()
+    return len(orphans)
+
+def recover_one(job_id: str):
+    db = SessionLocal()
+    try:
+        recover(db, job_id)
+    finally:
+        db.close()
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -5,11 +5,18 @@ import re
 # Add the current directory to sys.path so we can import 'app'
 sys.path.append(os.getcwd())
 
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.fernet import Fernet
+from sqlalchemy import func, and_, or_
 from app.database import SessionLocal
 from app.models import Patient
+import argparse
+import json
+import time
 
 ENV_FILE_PATH = "/app/.env" # Path inside container
+CHECKPOINT_PATH = os.getenv("ROTATION_CHECKPOINT_FILE", "rotate_keys.checkpoint.json")
+DEFAULT_BATCH_SIZE = 2000
 
 def update_env_file(new_key):
     """Updates the ENCRYPTION_KEY in the .env file."""
@@ -47,13 +54,93 @@ def update_env_file(new_key):
         print(f"[ERROR] Could not update .env file: {e}")
         print(f"Please manually update .env to: ENCRYPTION_KEY={new_key}")
 
-def rotate_keys_auto():
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH) as f:
+        return json.load(f)
+
+def save_checkpoint(state):
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+def rotate_rows(db, query):
     """
-    Automated Key Rotation: 
-    1. Gets old key from Env.
-    2. Generates New Key.
-    3. Migrates DB.
-    4. Updates .env
+    Move one batch of patients (an id-ordered query) that are still encrypted
+    directly under a master key onto their managers' data keys, and commit.
+    Rows are locked (FOR UPDATE on Postgres) so concurrent edits are not overwritten.
+    Returns (moved, failed ids).
+    """
+    from app import data_keys, models, security
+
+    rows = query.with_entities(
+        Patient.id,
+        Patient.manager_id,
+        Patient.first_name,
+        Patient.last_name,
+        Patient.dob,
+        Patient.gender,
+        Patient.record
+    ).with_for_update().all()
+
+    # Any key in the keyring decrypts; rows that fail are left untouched
+    plain = security.decrypt_patients(rows, failed=None)
+    moved = [(p, values) for p, values in zip(rows, plain) if None not in values.values()]
+    failed = [p.id for p, values in zip(rows, plain) if None in values.values()]
+
+    mappings = []
+    # Each row keeps its storage layout (per-field tokens or one row record)
+    for mode in security.RECORD_MODES:
+        group = [(p, values) for p, values in moved if ("row" if p.record else "field") == mode]
+        encrypted = data_keys.encrypt_patients([p for p, _ in group], [values for _, values in group], mode=mode)
+        mappings.extend({"id": p.id, **columns} for (p, _), columns in zip(group, encrypted))
+    # Search and order tokens use the token key, which does not change
+    db.bulk_update_mappings(models.Patient, mappings)
+    db.commit()
+    return len(moved), failed
+
+def rotate_range(start, end):
+    """Worker: move master-key rows with ids in [start, end) in its own session."""
+    db = SessionLocal()
+    try:
+        query = db.query(Patient).filter(Patient.id >= start, Patient.id < end, master_key_filter())
+        return rotate_rows(db, query.order_by(Patient.id))
+    finally:
+        db.close()
+
+def master_key_filter():
+    """
+    Rows encrypted directly under a master key (written before data keys existed),
+    judged by the key id in the ciphertext header. Header-less tokens are legacy Fernet.
+    """
+    from app import security
+    first_token = func.coalesce(
+        Patient.record,
+        func.nullif(Patient.first_name, ""),
+        func.nullif(Patient.last_name, ""),
+        func.nullif(Patient.dob, ""),
+        func.nullif(Patient.gender, "")
+    )
+    return and_(first_token.isnot(None), or_(
+        ~first_token.like("%:%"),
+        *(first_token.like(f"%:{kid}:%") for kid in security.readable_keys())
+    ))
+
+def rotate_keys_auto(batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """
+    Online Master Key Rotation (envelope encryption, see app/data_keys.py):
+    1. Publishes a new active master key in the keyring (old key stays readable).
+    2. Re-wraps every data key under the new master key in one transaction.
+       Patient rows are not touched.
+    3. Moves rows still encrypted directly under a master key (written before
+       data keys existed) onto their managers' data keys, in primary-key batches
+       with a commit and checkpoint each. Once all rows use data keys this is a
+       single header check.
+    4. Retires the old key and updates .env.
+    The API keeps serving throughout and picks up keyring changes without a restart.
+    Re-running after an interruption resumes from the checkpoint.
     """
     print(f"--- Automated Key Rotation Tool ---")
     
@@ -75,69 +162,79 @@ def rotate_keys_auto():
         print("Cannot decrypt existing data. Aborting.")
         return
 
-    # 2. Generate New Key
-    print(f"-> Generating new secure key...")
-    new_key = Fernet.generate_key().decode()
-    
-    print(f"Old Key: {old_key[:10]}...")
-    print(f"New Key: {new_key[:10]}...")
-    
-    try:
-        f_old = Fernet(old_key)
-        f_new = Fernet(new_key)
-    except Exception as e:
-        print(f"[FATAL] Key Error: {e}")
-        return
+    # app.security refuses to import without a key; the .env value is good enough here
+    os.environ.setdefault("ENCRYPTION_KEY", old_key)
+    from app import data_keys, security
 
-    # 3. DB Migration
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        # Resume: the new key was already published as the active key
+        new_key = security.active_key()
+        if security.key_id(new_key) != checkpoint["key_id"]:
+            print(f"[FATAL] Checkpoint is for key {checkpoint['key_id']}, but the active key is {security.key_id(new_key)}. Aborting.")
+            return
+        print(f"-> Resuming rotation to key {checkpoint['key_id']}...")
+    else:
+        # The keyring's active key is current (it may differ from .env mid-deployment)
+        old_key = security.active_key()
+
+        # 2. Generate New Key
+        print(f"-> Generating new secure key...")
+        new_key = Fernet.generate_key().decode()
+        print(f"Old Key: {old_key[:10]}...")
+        print(f"New Key: {new_key[:10]}...")
+
+        # New writes switch to the new key; reads accept both until the end
+        security.save_keyring(new_key, list(security.readable_keys().values()))
+        checkpoint = {"key_id": security.key_id(new_key), "next_id": 0}
+        save_checkpoint(checkpoint)
+        print(f"-> Published new key in {security.KEYRING_FILE}; waiting for running processes to pick it up...")
+        time.sleep(2 * security.KEYRING_RELOAD_SECONDS)
+
+    # 3. Re-wrap data keys (idempotent, so a resumed run simply repeats it)
     db = SessionLocal()
     try:
-        patients = db.query(Patient).all()
-        print(f"-> Starting Database Migration for {len(patients)} records...")
-        
-        count = 0
-        errors = 0
-        
-        for p in patients:
-            try:
-                # Decrypt
-                p1 = f_old.decrypt(p.first_name.encode()).decode() if p.first_name else ""
-                p2 = f_old.decrypt(p.last_name.encode()).decode() if p.last_name else ""
-                p3 = f_old.decrypt(p.dob.encode()).decode() if p.dob else ""
-                p4 = f_old.decrypt(p.gender.encode()).decode() if p.gender else ""
-                
-                # Encrypt
-                p.first_name = f_new.encrypt(p1.encode()).decode() if p1 else ""
-                p.last_name = f_new.encrypt(p2.encode()).decode() if p2 else ""
-                p.dob = f_new.encrypt(p3.encode()).decode() if p3 else ""
-                p.gender = f_new.encrypt(p4.encode()).decode() if p4 else ""
-                
-                count += 1
-            except Exception as e:
-                # If decryption fails, it might already be encrypted with a different key or corrupted
-                # We skip to avoid data loss of other records, but log it.
-                print(f"[WARN] Failed to rotate Patient #{p.id}: {e}")
-                errors += 1
-                continue
-
-        db.commit()
-        print(f"-> Migration Complete: {count} success, {errors} errors.")
-        
-        # 4. Update .env
-        if count > 0 or len(patients) == 0:
-            update_env_file(new_key)
-            print(f"\n[SUCCESS] Key Rotation Completed successfully.")
-            print(f"IMPORTANT: You must RESTART the backend service for changes to take effect.")
-            print(f"Run: docker-compose restart backend")
-        else:
-            print(f"[ERROR] Too many errors during migration. .env was NOT updated to prevent data loss.")
-            db.rollback()
-        
-    except Exception as e:
-        print(f"[FATAL] Database Error: {e}")
-        db.rollback()
+        started = time.monotonic()
+        count = data_keys.rewrap(db, new_key)
+        print(f"-> Re-wrapped {count} data keys in {(time.monotonic() - started) * 1000:.0f} ms.")
+        pending = db.query(Patient.id).filter(master_key_filter()).first() is not None
+        max_id = db.query(func.max(Patient.id)).scalar() or 0
     finally:
         db.close()
 
+    moved = 0
+    failed = []
+    if pending:
+        ranges = [(start, start + batch_size) for start in range(checkpoint["next_id"], max_id + 1, batch_size)]
+        print(f"-> Moving patients still under a master key onto data keys: #{checkpoint['next_id']}..#{max_id} in {len(ranges)} batches ({workers} workers)...")
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() yields in order, so the checkpoint only ever advances past finished batches
+            for (start, end), (batch_moved, batch_failed) in zip(ranges, executor.map(lambda r: rotate_range(*r), ranges)):
+                moved += batch_moved
+                failed.extend(batch_failed)
+                checkpoint["next_id"] = end
+                save_checkpoint(checkpoint)
+                print(f"   batch #{start}-#{end - 1}: {batch_moved} moved ({moved} total, {time.monotonic() - started:.1f}s)")
+
+    for patient_id in failed:
+        # If decryption fails, it might be encrypted with an unknown key or corrupted.
+        # We skip to avoid data loss of other records, but log it.
+        print(f"[WARN] Failed to move Patient #{patient_id}: could not decrypt with any known key")
+    print(f"-> Migration Complete: {count} data keys re-wrapped, {moved} patients moved, {len(failed)} errors.")
+
+    # 4. Retire the old key and update .env
+    os.remove(CHECKPOINT_PATH)
+    if failed:
+        print(f"[WARN] Previous keys stay in the keyring so the failed rows are not lost.")
+    else:
+        security.save_keyring(new_key)
+    update_env_file(new_key)
+    print(f"\n[SUCCESS] Key Rotation Completed successfully. No restart is needed.")
+
 if __name__ == "__main__":
-    rotate_keys_auto()
+    parser = argparse.ArgumentParser(description="Rotate the master encryption key online.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="patients per batch/commit when moving pre-envelope rows")
+    parser.add_argument("--workers", type=int, default=1, help="batches processed in parallel")
+    args = parser.parse_args()
+    rotate_keys_auto(batch_size=args.batch_size, workers=args.workers)
@@ -0,0 +1,59 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from cryptography.fernet import Fernet
+
+# Environment for the verify_* scripts that need a database. Import this before
+# anything from app, since database.py and security.py read it at import time.
+# Scripts get a throwaway SQLite file unless VERIFY_DATABASE_URL points at a
+# scratch database (required for the Postgres-only checks). Never point it at
+# real data: the scripts create and delete rows freely.
+sys.path.append(os.getcwd())
+DATABASE_URL = os.getenv("VERIFY_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp(prefix='hms-verify-')}/verify.sqlite"
+PASSWORD = "verify-password"
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.pop("DATABASE_READ_URL", None)
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("SECRET_KEY", "verify-" + "x" * 32)
+os.environ["DEFAULT_USER_PASSWORD"] = PASSWORD
+os.environ["SEED_USERS"] = json.dumps([
+    {"email": "admin@verify.local", "role": "Admin"},
+    {"email": "manager@verify.local", "role": "Manager"},
+    {"email": "manager2@verify.local", "role": "Manager"},
+])
+
+def is_postgres() -> bool:
+    return DATABASE_URL.startswith("postgresql")
+
+def report(name: str, ok: bool) -> bool:
+    print(f"{name:<52} {'PASS' if ok else 'FAIL'}")
+    return ok
+
+def client():
+    """A TestClient on the app (use it as a context manager so startup seeds the users)."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+def login(c, email: str = "manager@verify.local") -> dict:
+    r = c.post("/login", data={"username": email, "password": PASSWORD})
+    r.raise_for_status()
+    return {"Authorization": "Bearer " + r.json()["access_token"]}
+
+def upload(c, headers: dict, patients: list) -> dict:
+    """Upload [(patient id, first, last, dob, gender)] and wait for the job to finish."""
+    import pandas as pd
+    frame = pd.DataFrame(patients, columns=["Patient ID", "First Name", "Last Name", "DOB", "Gender"])
+    buf = io.BytesIO()
+    frame.to_excel(buf, index=False)
+    r = c.post("/patients/upload", headers=headers, files={"file": ("patients.xlsx", buf.getvalue())})
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    job = r.json()
+    while job["status"] not in ("completed", "failed"):
+        time.sleep(0.05)
+        job = c.get(f"/patients/upload-jobs/{job_id}", headers=headers).json()
+    return job
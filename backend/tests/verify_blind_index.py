@@ -0,0 +1,45 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from app import security
+
+# Explicit key: no database (and no token key row) needed
+KEY = security.derive_index_key("verify-blind-index-token-key")
+
+def verify_blind_index():
+    print("--- Blind Index Verification Test ---")
+
+    stored = security.search_tokens("first_name", "Jonathan", KEY)
+    print(f"Tokens stored for 'Jonathan': {len(stored)}")
+
+    checks = [
+        ("jo", True),
+        ("JONA", True),
+        ("  jonathan ", True),
+        ("nathan", False), # Prefix match only
+        ("j", False),      # Below minimum prefix length
+    ]
+
+    failed = False
+    for term, expected in checks:
+        token = security.blind_index("first_name", security.normalize("first_name", term), KEY)
+        matched = token in stored and len(term.strip()) >= security.MIN_PREFIX_LENGTH
+        status = "PASS" if matched == expected else "FAIL"
+        failed = failed or matched != expected
+        print(f"{term!r:<14} -> match={matched} (expected {expected}) {status}")
+
+    # Same value in a different field must not collide
+    if security.blind_index("first_name", "jo", KEY) == security.blind_index("last_name", "jo", KEY):
+        print("FAIL: Tokens are not field-specific!")
+        failed = True
+
+    # Dates stored as pandas Timestamps index the same as plain dates
+    if security.search_tokens("dob", "1980-01-01 00:00:00", KEY) != security.search_tokens("dob", "1980-01-01", KEY):
+        print("FAIL: DOB normalization mismatch!")
+        failed = True
+
+    print("FAIL: Blind index checks failed." if failed else "SUCCESS: Blind index behaves as expected.")
+
+if __name__ == "__main__":
+    verify_blind_index()
@@ -0,0 +1,49 @@
+import scratch
+
+from app import audit, models, patients
+from app.database import SessionLocal
+
+def _patient(pid: str) -> tuple:
+    return (pid, "Dana", "Lane", "1970-02-02", "Female")
+
+def _rows(c, headers) -> dict:
+    return {p["patient_id"]: p["id"] for p in c.get("/patients/", headers=headers, params={"limit": 1000}).json()}
+
+def verify_bulk_delete():
+    print("--- Chunked Bulk Delete Verification Test ---")
+    patients.DELETE_CHUNK_SIZE = 7 # Every request below spans several chunks
+    ok = True
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        other = scratch.login(c, "manager2@verify.local")
+        admin = scratch.login(c, "admin@verify.local")
+        scratch.upload(c, headers, [_patient(f"B{i:03d}") for i in range(30)])
+        job = scratch.upload(c, headers, [_patient(f"D{i:03d}") for i in range(12)])
+        scratch.upload(c, other, [_patient(f"O{i:03d}") for i in range(5)])
+        rows, others = _rows(c, headers), _rows(c, other)
+
+        ids = [rows[f"B{i:03d}"] for i in range(20)]
+        r = c.post("/patients/bulk-delete", headers=headers, json=ids + ids[:3] + [others["O000"], 10 ** 9])
+        ok &= scratch.report("ids delete across chunks, once each", r.json()["message"] == "Successfully deleted 20 records")
+        r = c.post("/patients/delete-by-filter", headers=headers, json={"upload_job_id": job["id"]})
+        ok &= scratch.report("filter delete walks every chunk", r.json()["message"] == "Successfully deleted 12 records")
+        ok &= scratch.report("repeating it deletes nothing", c.post("/patients/delete-by-filter", headers=headers, json={"upload_job_id": job["id"]}).json()["message"] == "No records deleted")
+        ok &= scratch.report("only the requested rows are gone", sorted(_rows(c, headers)) == [f"B{i:03d}" for i in range(20, 30)])
+        ok &= scratch.report("another manager's rows are untouched", sorted(_rows(c, other)) == sorted(others))
+        ok &= scratch.report("search no longer finds deleted rows", c.get("/patients/", headers=headers, params={"search": "B00"}).json() == [])
+        ok &= scratch.report("stats follow the deletes", c.get("/patients/stats", headers=admin).json()["total_patients"] == 15)
+
+        audit.flush()
+        details = [l["details"] for l in c.get("/admin/audit-logs", headers=admin, params={"action": "BULK_DELETE"}).json()]
+        ok &= scratch.report("one audit summary per request", len(details) == 2 and details[-1].startswith("Deleted 20 patients (25 ids requested"))
+        ok &= scratch.report("summary names a sample, not every id", details[-1].count("B0") == patients.AUDIT_SAMPLE_IDS)
+        if scratch.is_postgres():
+            db = SessionLocal()
+            orphans = db.query(models.PatientSearchToken).filter(~models.PatientSearchToken.patient_row_id.in_(db.query(models.Patient.id))).count()
+            db.close()
+            ok &= scratch.report("search tokens cascade with their rows", orphans == 0)
+    print("SUCCESS: Bulk deletes are chunked and complete." if ok else "FAIL: Bulk delete checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_bulk_delete() else 1)
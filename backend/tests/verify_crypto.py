@@ -27,5 +27,18 @@ def verify_crypto():
     else:
         print("FAIL: Decryption failed.")
 
+    # Every engine must round-trip, and old rows must stay readable after switching
+    from cryptography.fernet import Fernet
+    legacy = Fernet(security.ENCRYPTION_KEY).encrypt(original_text.encode()).decode()
+    tokens = {"legacy": legacy}
+    tokens.update({name: security.seal(original_text, cipher=name) for name in security.CIPHERS})
+    for name, token in tokens.items():
+        result = security.decrypt(token)
+        print(f"{name:<7} {token[:28]}... -> {result} {'PASS' if result == original_text else 'FAIL'}")
+
+    # Tampering (including with the header) must be detected
+    tampered = tokens["aesgcm"].replace("aesgcm:", "fernet:", 1)
+    print(f"Tampered header rejected: {security.decrypt(tampered) == security.DECRYPTION_FAILED}")
+
 if __name__ == "__main__":
     verify_crypto()
@@ -0,0 +1,52 @@
+import scratch
+
+from app import pagination
+
+def _page(c, headers, cursor=None, limit=5):
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    r = c.get("/patients/", headers=headers, params=params)
+    r.raise_for_status()
+    return [p["patient_id"] for p in r.json()], r.headers.get(pagination.NEXT_CURSOR_HEADER)
+
+def _walk(c, headers, limit=5) -> list:
+    seen, cursor = [], None
+    while True:
+        ids, cursor = _page(c, headers, cursor, limit)
+        seen.extend(ids)
+        if not cursor:
+            return seen
+
+def verify_keyset_pagination():
+    print("--- Keyset Pagination Verification Test ---")
+    ok = True
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        scratch.upload(c, headers, [(f"K{i:03d}", "Kim", "Lee", "1980-01-01", "Female") for i in range(0, 46, 2)])
+        everything = [p["patient_id"] for p in c.get("/patients/", headers=headers, params={"limit": 1000}).json()]
+        ok &= scratch.report("cursor walk returns every row once, in order", _walk(c, headers) == everything)
+        ok &= scratch.report("exact multiple of the page size ends cleanly", _walk(c, headers, limit=23) == everything)
+
+        # Writes between pages: rows before the cursor change, the walk does not
+        first, cursor = _page(c, headers)
+        row_ids = {p["patient_id"]: p["id"] for p in c.get("/patients/", headers=headers, params={"limit": 1000}).json()}
+        c.delete(f"/patients/{row_ids[first[0]]}", headers=headers).raise_for_status()
+        scratch.upload(c, headers, [("K001", "Kim", "Lee", "1980-01-01", "Female"), ("K021", "Kim", "Lee", "1980-01-01", "Female")])
+        second, _ = _page(c, headers, cursor)
+        ok &= scratch.report("next page starts right after the cursor row", second == ["K010", "K012", "K014", "K016", "K018"])
+        rest = []
+        while cursor:
+            ids, cursor = _page(c, headers, cursor)
+            rest.extend(ids)
+        ok &= scratch.report("later inserts after the cursor are picked up", "K021" in rest and "K001" not in rest)
+        ok &= scratch.report("no row is repeated across pages", len(rest) == len(set(rest)) and not set(first) & set(rest))
+
+        ok &= scratch.report("malformed cursor is a 400", c.get("/patients/", headers=headers, params={"cursor": "nope"}).status_code == 400)
+        other_sort = c.get("/patients/", headers=headers, params={"cursor": pagination.encode_cursor("K000", 1), "sort_by": "first_name"})
+        ok &= scratch.report("cursor with another sort is a 400", other_sort.status_code == 400)
+    print("SUCCESS: Keyset cursors page without skips or repeats." if ok else "FAIL: Keyset pagination checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_keyset_pagination() else 1)
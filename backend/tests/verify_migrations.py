@@ -0,0 +1,97 @@
+import scratch
+import datetime
+import os
+from cryptography.fernet import Fernet
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, inspect, text
+
+from app import auth, init_db, migrations, search_index, sort_keys, stats
+from app.database import SessionLocal, engine
+
+# The schema as it was before any migration existed (the baseline release),
+# with its data written the way that release wrote it
+BASELINE = MetaData()
+Table("permissions", BASELINE, Column("id", Integer, primary_key=True, index=True), Column("name", String, unique=True, index=True), Column("description", String))
+Table("roles", BASELINE, Column("id", Integer, primary_key=True, index=True), Column("name", String, unique=True, index=True), Column("parent_id", Integer, ForeignKey("roles.id")))
+Table("role_permissions", BASELINE, Column("role_id", Integer, ForeignKey("roles.id")), Column("permission_id", Integer, ForeignKey("permissions.id")))
+Table("locations", BASELINE, Column("id", Integer, primary_key=True, index=True), Column("name", String, unique=True, index=True))
+Table("teams", BASELINE, Column("id", Integer, primary_key=True, index=True), Column("name", String, unique=True, index=True))
+Table("users", BASELINE,
+    Column("id", Integer, primary_key=True, index=True), Column("email", String, unique=True, index=True),
+    Column("password_hash", String), Column("is_active", Boolean, default=True),
+    Column("role_id", Integer, ForeignKey("roles.id"), nullable=False), Column("location_id", Integer, ForeignKey("locations.id"), nullable=False),
+    Column("team_id", Integer, ForeignKey("teams.id"), nullable=False), Column("full_name", String), Column("phone_number", String),
+    Column("failed_login_attempts", Integer, default=0), Column("locked_until", DateTime))
+Table("audit_logs", BASELINE,
+    Column("id", Integer, primary_key=True, index=True), Column("user_id", Integer, ForeignKey("users.id")),
+    Column("action", String), Column("details", String), Column("timestamp", DateTime))
+Table("patients", BASELINE,
+    Column("id", Integer, primary_key=True, index=True), Column("patient_id", String, index=True),
+    Column("first_name", String), Column("last_name", String), Column("dob", String), Column("gender", String),
+    Column("manager_id", Integer, ForeignKey("users.id")))
+
+PATIENTS = [("M001", "John", "Doe", "1980-01-01", "Male"), ("M002", "Jane", "Roe", "1990-05-15", "Female"), ("M003", "Joan", "Poe", "1985-07-20", "Female")]
+
+def _create_baseline():
+    BASELINE.create_all(bind=engine)
+    legacy = Fernet(os.environ["ENCRYPTION_KEY"])
+    t = BASELINE.tables
+    with engine.begin() as conn:
+        def insert(table, **values):
+            return conn.execute(t[table].insert().values(**values)).inserted_primary_key[0]
+        manager_id = insert("users", email="manager@verify.local", password_hash=auth.get_password_hash(scratch.PASSWORD),
+                            role_id=insert("roles", name="Manager"), location_id=insert("locations", name="US"), team_id=insert("teams", name="AR"))
+        conn.execute(t["patients"].insert(), [
+            {"patient_id": pid, "manager_id": manager_id, **{field: legacy.encrypt(value.encode()).decode() for field, value in zip(("first_name", "last_name", "dob", "gender"), values)}}
+            for pid, *values in PATIENTS + PATIENTS[-1:] # The baseline allowed a duplicate patient ID
+        ])
+        insert("audit_logs", user_id=manager_id, action="LOGIN", timestamp=datetime.datetime(2024, 1, 1))
+
+def verify_migrations():
+    print("--- Schema Migration Upgrade Verification Test ---")
+    ok = True
+    _create_baseline()
+    # What every start does, even with MIGRATE_ON_STARTUP=0
+    columns = sorted(f"{table}.{column}" for listed in migrations.FEATURE_COLUMNS.values() for table, column, _ in listed)
+    ok &= scratch.report("feature columns are added without the runner", sorted(migrations.add_feature_columns(engine)) == columns)
+    ok &= scratch.report("and only once", migrations.add_feature_columns(engine) == [])
+    init_db.init_db() # create_all + every pending migration, as at API startup
+
+    versions = sorted(v for v, *_ in migrations.MIGRATIONS)
+    ok &= scratch.report("duplicates leave only step 003 pending", sorted(migrations.applied(engine)) == [v for v in versions if v != 3])
+    with engine.begin() as conn:
+        duplicate = conn.execute(text("SELECT MAX(id) FROM patients WHERE patient_id = 'M003'")).scalar()
+        conn.execute(text("DELETE FROM patients WHERE id = :id"), {"id": duplicate})
+    ok &= scratch.report("step 003 applies once they are resolved", migrations.migrate(engine) == ["unique_patient_id"])
+    ok &= scratch.report("every migration is recorded", sorted(migrations.applied(engine)) == versions)
+    inspector = inspect(engine)
+    patient_columns = {c["name"] for c in inspector.get_columns("patients")}
+    ok &= scratch.report("new patient columns were added", {"record", "first_name_order", "dob_order", "gender_order", "upload_job_id"} <= patient_columns)
+    ok &= scratch.report("users gained patient_data_version", "patient_data_version" in {c["name"] for c in inspector.get_columns("users")})
+    indexes = {ix["name"]: ix for table in ("patients", "audit_logs", "users") for ix in inspector.get_indexes(table)}
+    wanted = ["ix_patients_manager_patient_id", "ix_patients_manager_gender_order", "ix_patients_manager_upload_job",
+              "ix_audit_logs_timestamp", "ix_audit_logs_user_timestamp", "ix_audit_logs_action_timestamp", "ix_users_role_id"]
+    ok &= scratch.report("hot-path indexes were built", all(name in indexes for name in wanted))
+    ok &= scratch.report("patient_id became unique", bool(indexes["ix_patients_patient_id"]["unique"]))
+    ok &= scratch.report("a second run has nothing to do", migrations.migrate(engine) == [])
+
+    # The documented backfills make the old rows searchable, sortable and counted
+    db = SessionLocal()
+    search_index.rebuild_all(db)
+    sort_keys.backfill(db)
+    stats.rebuild(db)
+    db.close()
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        listed = c.get("/patients/", headers=headers).json()
+        ok &= scratch.report("baseline rows still decrypt", [(p["patient_id"], p["first_name"]) for p in listed] == [(p[0], p[1]) for p in PATIENTS])
+        found = c.get("/patients/", headers=headers, params={"search": "jo"}).json()
+        ok &= scratch.report("backfilled rows are searchable", sorted(p["patient_id"] for p in found) == ["M001", "M003"])
+        by_name = c.get("/patients/", headers=headers, params={"sort_by": "first_name"}).json()
+        ok &= scratch.report("backfilled rows sort by name", [p["first_name"] for p in by_name] == ["Jane", "Joan", "John"])
+        report = c.get("/patients/stats", headers=scratch.login(c, "admin@verify.local")).json()
+        ok &= scratch.report("backfilled rows are counted", report["total_patients"] == 3)
+    print("SUCCESS: A baseline database upgrades in place." if ok else "FAIL: Migration checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_migrations() else 1)
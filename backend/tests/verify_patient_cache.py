@@ -0,0 +1,50 @@
+import scratch
+
+from app import models, patient_cache
+from app.database import SessionLocal
+
+def _first_names(c, headers) -> dict:
+    r = c.get("/patients/", headers=headers, params={"limit": 10})
+    return {p["patient_id"]: p["first_name"] for p in r.json()}
+
+def verify_patient_cache():
+    print("--- Patient Cache Verification Test ---")
+    ok = True
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        scratch.upload(c, headers, [("C001", "John", "Doe", "1980-01-01", "Male"), ("C002", "Jane", "Roe", "1990-05-15", "Female")])
+        db = SessionLocal()
+        manager_id = db.query(models.User.id).filter(models.User.email == "manager@verify.local").scalar()
+        version = patient_cache.data_version(db, manager_id)
+        db.close()
+        ok &= scratch.report("upload bumps the data version", version > 0)
+        ok &= scratch.report("list decrypts the page", _first_names(c, headers) == {"C001": "John", "C002": "Jane"})
+
+        # Mark the cached copy: if the list shows the marker, it was served from cache
+        rows = patient_cache.cache.get(manager_id, version, list(range(1, 100)))
+        ok &= scratch.report("page rows are cached under the version", len(rows) == 2)
+        for row in rows.values():
+            row["first_name"] = "Cached"
+        ok &= scratch.report("same version is served from the cache", set(_first_names(c, headers).values()) == {"Cached"})
+
+        # Another worker's write only bumps the version in the database
+        db = SessionLocal()
+        db.query(models.User).filter(models.User.id == manager_id).update({models.User.patient_data_version: version + 1})
+        db.commit()
+        db.close()
+        ok &= scratch.report("a version bump elsewhere invalidates the entry", _first_names(c, headers) == {"C001": "John", "C002": "Jane"})
+
+        patient_id = next(p["id"] for p in c.get("/patients/", headers=headers).json() if p["patient_id"] == "C001")
+        c.patch(f"/patients/{patient_id}", headers=headers, json={"first_name": "Johnny"}).raise_for_status()
+        ok &= scratch.report("an update is visible on the next read", _first_names(c, headers)["C001"] == "Johnny")
+        c.delete(f"/patients/{patient_id}", headers=headers).raise_for_status()
+        ok &= scratch.report("a delete is visible on the next read", _first_names(c, headers) == {"C002": "Jane"})
+
+        # Another manager never sees this manager's cached rows
+        other = scratch.login(c, "manager2@verify.local")
+        ok &= scratch.report("cache is per manager", _first_names(c, other) == {})
+    print("SUCCESS: Cache invalidation follows the data version." if ok else "FAIL: Patient cache checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_patient_cache() else 1)
@@ -0,0 +1,71 @@
+import scratch
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from app import init_db, models, patient_partitions
+from app.database import SessionLocal
+
+def _patients(prefix: str, n: int) -> list:
+    return [(f"{prefix}{i:03d}", "Pat", "Hash", "1960-06-06", "Male") for i in range(n)]
+
+def _orphan_tokens(db) -> int:
+    return db.query(models.PatientSearchToken).filter(~models.PatientSearchToken.patient_row_id.in_(db.query(models.Patient.id))).count()
+
+def verify_patient_partitions():
+    print("--- Patient Hash Partitioning Verification Test ---")
+    ok = True
+    if not scratch.is_postgres():
+        init_db.init_db()
+        db = SessionLocal()
+        try:
+            patient_partitions.partition(db)
+            refused = False
+        except RuntimeError:
+            refused = True
+        db.close()
+        ok &= scratch.report("SQLite is refused (set VERIFY_DATABASE_URL)", refused)
+        print("SUCCESS: Partitioning needs PostgreSQL." if ok else "FAIL: Patient partition checks failed.")
+        return ok
+
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        other = scratch.login(c, "manager2@verify.local")
+        scratch.upload(c, headers, _patients("A", 20))
+        scratch.upload(c, other, _patients("Z", 5))
+        before = c.get("/patients/", headers=headers, params={"search": "A01"}).json()
+
+        db = SessionLocal()
+        ok &= scratch.report("conversion runs once", patient_partitions.partition(db, 4) and not patient_partitions.partition(db, 4))
+        ok &= scratch.report("rows land in the partitions", sum(rows for _, rows, _ in patient_partitions.partition_sizes(db)) == 25)
+        ids = db.execute(text(f"SELECT COUNT(*) FROM {patient_partitions.ID_TABLE}")).scalar()
+        ok &= scratch.report("every patient ID is in patient_ids", ids == 25)
+        ok &= scratch.report("search still finds the same rows", c.get("/patients/", headers=headers, params={"search": "A01"}).json() == before)
+
+        job = scratch.upload(c, other, [("A001", "Dup", "Other", "1961-01-01", "Female")])
+        ok &= scratch.report("upload check still rejects another's ID", job["status"] == "failed")
+        try:
+            # Past the upload check, e.g. two uploads racing: the side table refuses it
+            db.execute(text("INSERT INTO patients (patient_id, manager_id) SELECT 'Z000', id FROM users WHERE email = 'manager@verify.local'"))
+            db.commit()
+            duplicate = True
+        except IntegrityError:
+            db.rollback()
+            duplicate = False
+        ok &= scratch.report("a duplicate insert fails across partitions", not duplicate)
+
+        rows = {p["patient_id"]: p["id"] for p in c.get("/patients/", headers=headers, params={"limit": 100}).json()}
+        c.delete(f"/patients/{rows['A000']}", headers=headers).raise_for_status()
+        c.post("/patients/bulk-delete", headers=headers, json=[rows[f"A{i:03d}"] for i in range(1, 10)]).raise_for_status()
+        ok &= scratch.report("deletes cascade to the search tokens", _orphan_tokens(db) == 0)
+        ok &= scratch.report("deleted IDs leave patient_ids", db.execute(text(f"SELECT COUNT(*) FROM {patient_partitions.ID_TABLE}")).scalar() == 15)
+        ok &= scratch.report("and can be uploaded again", scratch.upload(c, other, [("A000", "New", "Owner", "1962-02-02", "Male")])["status"] == "completed")
+        fk = db.execute(text(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conname = :name"
+        ), {"name": patient_partitions.TOKEN_FK}).scalar()
+        ok &= scratch.report("token FK references (id, manager_id)", fk is not None and "(patient_row_id, manager_id)" in fk and "ON DELETE CASCADE" in fk)
+        db.close()
+    print("SUCCESS: Partitioned patients keep IDs unique and tokens cascading." if ok else "FAIL: Patient partition checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_patient_partitions() else 1)
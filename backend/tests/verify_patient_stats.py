@@ -0,0 +1,70 @@
+import scratch
+
+from app import models, stats
+from app.database import SessionLocal
+
+def _rollup() -> dict:
+    db = SessionLocal()
+    try:
+        return {(s.gender, s.birth_year): s.count for s in db.query(models.PatientStat).all() if s.count}
+    finally:
+        db.close()
+
+def _recounted() -> dict:
+    db = SessionLocal()
+    try:
+        stats.rebuild(db)
+    finally:
+        db.close()
+    return _rollup()
+
+def _row_ids(c, headers) -> dict:
+    return {p["patient_id"]: p["id"] for p in c.get("/patients/", headers=headers, params={"limit": 100}).json()}
+
+def verify_patient_stats():
+    print("--- Patient Stats Rollup Verification Test ---")
+    ok = True
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        admin = scratch.login(c, "admin@verify.local")
+        scratch.upload(c, headers, [
+            ("S001", "John", "Doe", "1980-01-01", "Male"),
+            ("S002", "Jane", "Roe", "1980-06-15", "Female"),
+            ("S003", "Alex", "Poe", "2001-02-03", "Other"),
+            ("S004", "Bob", "Moe", "not a date", "Male"),
+            ("S005", "Ann", "Loe", "1955-09-09", "Female"),
+        ])
+        expected = {("Male", 1980): 1, ("Female", 1980): 1, ("Other", 2001): 1, ("Male", stats.UNKNOWN_YEAR): 1, ("Female", 1955): 1}
+        ok &= scratch.report("upload adds one per (gender, birth year)", _rollup() == expected)
+        report = c.get("/patients/stats", headers=admin).json()
+        ok &= scratch.report("report totals come from the rollup", report["total_patients"] == 5 and report["gender_distribution"]["male_percentage"] == 40)
+
+        ids = _row_ids(c, headers)
+        c.patch(f"/patients/{ids['S001']}", headers=headers, json={"gender": "Female", "dob": "1990-01-01"}).raise_for_status()
+        expected.pop(("Male", 1980))
+        expected[("Female", 1990)] = 1
+        ok &= scratch.report("update moves the patient between buckets", _rollup() == expected)
+
+        c.delete(f"/patients/{ids['S002']}", headers=headers).raise_for_status()
+        expected.pop(("Female", 1980))
+        ok &= scratch.report("delete decrements its bucket", _rollup() == expected)
+        c.post("/patients/bulk-delete", headers=headers, json=[ids["S003"], ids["S004"]]).raise_for_status()
+        expected.pop(("Other", 2001))
+        expected.pop(("Male", stats.UNKNOWN_YEAR))
+        ok &= scratch.report("bulk delete decrements every bucket", _rollup() == expected)
+        ok &= scratch.report("deltas match a full recount", _recounted() == expected)
+
+        # A row that no longer decrypts must not decrement a guessed bucket
+        db = SessionLocal()
+        db.query(models.Patient).filter(models.Patient.patient_id == "S005").update({models.Patient.gender: "garbage", models.Patient.record: None})
+        db.commit()
+        db.close()
+        c.delete(f"/patients/{ids['S005']}", headers=headers).raise_for_status()
+        ok &= scratch.report("undecryptable delete leaves other buckets alone", _rollup() == expected)
+        expected.pop(("Female", 1955))
+        ok &= scratch.report("recount repairs the skipped row", _recounted() == expected)
+    print("SUCCESS: The stats rollup follows every write." if ok else "FAIL: Patient stats checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_patient_stats() else 1)
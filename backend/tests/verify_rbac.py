@@ -0,0 +1,52 @@
+import scratch
+import time
+
+from app import auth, models, rbac
+from app.database import SessionLocal
+
+class _Role:
+    def __init__(self, id, parent_id, names):
+        self.id, self.parent_id = id, parent_id
+        self.permissions = [type("Permission", (), {"name": name}) for name in names]
+
+def verify_rbac():
+    print("--- RBAC Inheritance Verification Test ---")
+    ok = True
+    with scratch.client() as c:
+        admin = scratch.login(c, "admin@verify.local")
+        manager = scratch.login(c)
+        roles = {r["name"]: r for r in c.get("/admin/roles", headers=admin).json()}
+        perms = {p["name"]: p["id"] for p in c.get("/admin/permissions", headers=admin).json()}
+        ok &= scratch.report("Manager extends User", roles["Manager"]["parent_id"] == roles["User"]["id"])
+        ok &= scratch.report("Admin has no patient access", "patient.read" not in rbac.permissions_for(roles["Admin"]["id"]))
+
+        # A grant on the parent reaches the child at once in this process
+        ok &= scratch.report("Manager starts without report.view", c.get("/patients/stats", headers=manager).status_code == 403)
+        c.put(f"/admin/roles/{roles['User']['id']}/permissions", headers=admin, json={"permission_ids": [perms["patient.read"], perms["report.view"]]}).raise_for_status()
+        ok &= scratch.report("parent grant is inherited immediately", c.get("/patients/stats", headers=manager).status_code == 200)
+        c.put(f"/admin/roles/{roles['User']['id']}/permissions", headers=admin, json={"permission_ids": [perms["patient.read"]]}).raise_for_status()
+        ok &= scratch.report("parent revoke is inherited immediately", c.get("/patients/stats", headers=manager).status_code == 403)
+
+        # New roles under a parent pick up the parent's later grants
+        auditor = c.post("/admin/roles", headers=admin, json={"name": "Auditor", "parent_id": roles["Finance"]["id"]}).json()
+        ok &= scratch.report("unknown parent is a 400", c.post("/admin/roles", headers=admin, json={"name": "X", "parent_id": 9999}).status_code == 400)
+        c.put(f"/admin/roles/{roles['Finance']['id']}/permissions", headers=admin, json={"permission_ids": [perms["audit.view"]]}).raise_for_status()
+        ok &= scratch.report("new child role inherits later grants", "audit.view" in rbac.permissions_for(auditor["id"]))
+
+        # A change committed by another process shows up once the compiled sets expire
+        db = SessionLocal()
+        finance = db.query(models.Role).filter(models.Role.name == "Finance").one()
+        finance.permissions = []
+        db.commit()
+        db.close()
+        ok &= scratch.report("other process's change waits for the TTL", "audit.view" in rbac.permissions_for(auditor["id"]))
+        rbac._built_at = time.monotonic() - auth.PRINCIPAL_CACHE_TTL_SECONDS - 1
+        ok &= scratch.report("and is picked up after it", "audit.view" not in rbac.permissions_for(auditor["id"]))
+
+    resolved = rbac.resolve([_Role(1, 2, ["a"]), _Role(2, 1, ["b"]), _Role(3, 1, ["c"])])
+    ok &= scratch.report("a parent cycle ends the chain", resolved == {1: {"a", "b"}, 2: {"a", "b"}, 3: {"a", "b", "c"}})
+    print("SUCCESS: Compiled permission sets follow the role hierarchy." if ok else "FAIL: RBAC checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_rbac() else 1)
@@ -0,0 +1,54 @@
+import scratch
+import os
+import tempfile
+
+# A "replica" that never catches up: a second, empty database. A read that
+# finds the user's rows went to the primary; one that finds none, to the replica.
+os.environ["DATABASE_READ_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='hms-verify-replica-')}/replica.sqlite"
+from app import models, replica
+from app.database import read_engine
+
+def _other_worker():
+    # The next request is served by a process that did not see the write
+    replica._recent_writes.clear()
+
+def _listed(c, headers: dict) -> list:
+    _other_worker()
+    return [p["patient_id"] for p in c.get("/patients/", headers=headers).json()]
+
+def verify_read_replica():
+    print("--- Read Replica Routing Verification Test ---")
+    models.Base.metadata.create_all(bind=read_engine)
+    ok = True
+    with scratch.client() as c:
+        headers = scratch.login(c)
+        other = scratch.login(c, "manager2@verify.local")
+        r = c.post("/patients/upload", headers=headers, files={"file": ("empty.csv", b"")})
+        ok &= scratch.report("a failed write issues no marker", replica.MARKER_HEADER not in r.headers)
+
+        job = scratch.upload(c, headers, [("R001", "Ray", "Ng", "1975-03-03", "Male"), ("R002", "Ria", "Ng", "1977-04-04", "Female")])
+        marker = c.get(f"/patients/upload-jobs/{job['id']}", headers=headers).headers.get(replica.MARKER_HEADER)
+        ok &= scratch.report("a finished job's poll carries the marker", bool(marker))
+        ok &= scratch.report("cookie keeps reads on the primary", _listed(c, headers) == ["R001", "R002"])
+        c.cookies.clear()
+        ok &= scratch.report("without the marker reads use the replica", _listed(c, headers) == [])
+        ok &= scratch.report("header keeps reads on the primary", _listed(c, {**headers, replica.MARKER_HEADER: marker}) == ["R001", "R002"])
+        _other_worker()
+        exported = c.get("/patients/export", headers={**headers, replica.MARKER_HEADER: marker}).text
+        ok &= scratch.report("exports honour the marker", "R002" in exported)
+
+        user_id, until_ms, signature = marker.split(".")
+        forged = f"{user_id}.{int(until_ms) + 60000}.{signature}"
+        ok &= scratch.report("a forged window is ignored", _listed(c, {**headers, replica.MARKER_HEADER: forged}) == [])
+        ok &= scratch.report("another user's marker is ignored", _listed(c, {**other, replica.MARKER_HEADER: marker}) == [])
+
+        row_id = c.get("/patients/", headers={**headers, replica.MARKER_HEADER: marker}).json()[0]["id"]
+        c.cookies.clear()
+        r = c.delete(f"/patients/{row_id}", headers=headers)
+        ok &= scratch.report("write responses set header and cookie", bool(r.headers.get(replica.MARKER_HEADER)) and replica.MARKER_COOKIE in c.cookies)
+        ok &= scratch.report("and the next read sees the write", _listed(c, headers) == ["R002"])
+    print("SUCCESS: Read-your-writes follows the client across workers." if ok else "FAIL: Read replica checks failed.")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if verify_read_replica() else 1)
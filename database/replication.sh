@@ -0,0 +1,4 @@
+#!/bin/sh
+# Runs once, when the primary's data volume is initialised: lets the db-replica
+# service (docker compose --profile replica) stream WAL with the database user.
+echo "host replication ${POSTGRES_USER} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
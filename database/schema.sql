@@ -26,25 +26,94 @@ CREATE TABLE users (
     is_active BOOLEAN DEFAULT TRUE,
     failed_login_attempts INTEGER DEFAULT 0,
     locked_until TIMESTAMP,
+    patient_data_version INTEGER NOT NULL DEFAULT 0, -- Invalidates decrypted patient caches
     role_id INTEGER REFERENCES roles(id),
     location_id INTEGER REFERENCES locations(id),
     team_id INTEGER REFERENCES teams(id)
 );
+CREATE INDEX ix_users_role_id ON users (role_id);
 
 -- 5. Patients (Encryption Target)
 CREATE TABLE patients (
     id SERIAL PRIMARY KEY,
-    patient_id VARCHAR NOT NULL,  -- Unencrypted for indexing
-    first_name VARCHAR NOT NULL,  -- Encrypted (Fernet AES-128)
-    last_name VARCHAR NOT NULL,   -- Encrypted (Fernet AES-128)
-    dob VARCHAR NOT NULL,         -- Encrypted (Fernet AES-128)
-    gender VARCHAR NOT NULL,      -- Encrypted (Fernet AES-128)
-    manager_id INTEGER REFERENCES users(id)
+    patient_id VARCHAR NOT NULL,  -- Unencrypted for indexing, unique across managers
+    first_name VARCHAR,           -- Encrypted (Fernet or AES-256-GCM), NULL in row mode
+    last_name VARCHAR,            -- Encrypted (Fernet or AES-256-GCM), NULL in row mode
+    dob VARCHAR,                  -- Encrypted (Fernet or AES-256-GCM), NULL in row mode
+    gender VARCHAR,               -- Encrypted (Fernet or AES-256-GCM), NULL in row mode
+    record VARCHAR,               -- Row mode: all four fields in one encrypted record
+                                  -- Values are '<algorithm>:<key id>:<payload>'
+    first_name_order INTEGER,     -- Keyed order token (coarse bucket)
+    last_name_order INTEGER,      -- Keyed order token (coarse bucket)
+    dob_order INTEGER,            -- Keyed order token (birth month)
+    gender_order INTEGER,         -- Keyed order token
+    manager_id INTEGER REFERENCES users(id),
+    upload_job_id VARCHAR         -- Upload that inserted the row (for delete-by-filter)
 );
 
 -- Indexes for Patients
-CREATE INDEX ix_patients_patient_id ON patients (patient_id);
--- Note: Encrypted fields are NOT indexed to prevent frequency analysis attacks
+CREATE UNIQUE INDEX ix_patients_patient_id ON patients (patient_id);
+CREATE INDEX ix_patients_manager_patient_id ON patients (manager_id, patient_id, id);
+CREATE INDEX ix_patients_manager_first_name_order ON patients (manager_id, first_name_order);
+CREATE INDEX ix_patients_manager_last_name_order ON patients (manager_id, last_name_order);
+CREATE INDEX ix_patients_manager_dob_order ON patients (manager_id, dob_order);
+CREATE INDEX ix_patients_manager_gender_order ON patients (manager_id, gender_order);
+CREATE INDEX ix_patients_manager_upload_job ON patients (manager_id, upload_job_id);
+-- Note: the *_order columns are keyed order tokens and they are indexed. Anyone
+-- with DB access sees the relative order and equality of each bucket: the first
+-- 3 characters of a name, and the birth month for DOB. gender_order takes only a
+-- few distinct values, so it reveals each patient's gender group directly (the
+-- group sizes identify which one is which). See ADR 013.
+-- python -m app.patient_partitions partition (opt-in) rebuilds this table hash-
+-- partitioned on manager_id: PRIMARY KEY (id, manager_id), manager_id NOT NULL,
+-- ix_patients_patient_id no longer unique, and the search token foreign key
+-- becomes (patient_row_id, manager_id).
+
+-- 5a. Patient Stats (aggregate counts for /patients/stats, maintained as deltas)
+CREATE TABLE patient_stats (
+    gender VARCHAR NOT NULL,       -- Male / Female / Other
+    birth_year INTEGER NOT NULL,   -- 0 = unknown DOB
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (gender, birth_year)
+);
+
+-- 5b. Patient Search Tokens (Blind Index: HMAC of normalized prefixes)
+CREATE TABLE patient_search_tokens (
+    id SERIAL PRIMARY KEY,
+    patient_row_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    manager_id INTEGER NOT NULL,
+    token VARCHAR(32) NOT NULL
+);
+CREATE INDEX ix_patient_search_tokens_patient_row_id ON patient_search_tokens (patient_row_id);
+CREATE INDEX ix_patient_search_tokens_manager_token ON patient_search_tokens (manager_id, token);
+
+-- 5c. Upload Jobs (background patient uploads, polled for progress)
+CREATE TABLE upload_jobs (
+    id VARCHAR(32) PRIMARY KEY,    -- uuid4 hex
+    manager_id INTEGER NOT NULL REFERENCES users(id),
+    filename VARCHAR,
+    status VARCHAR NOT NULL DEFAULT 'queued', -- queued / running / completed / failed
+    rows_total INTEGER,
+    rows_parsed INTEGER NOT NULL DEFAULT 0,
+    rows_encrypted INTEGER NOT NULL DEFAULT 0,
+    rows_inserted INTEGER NOT NULL DEFAULT 0,
+    error VARCHAR,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    worker VARCHAR,                -- host:pid running the job (restart recovery)
+    spool_path VARCHAR             -- Spooled upload, deleted when the job ends
+);
+CREATE INDEX ix_upload_jobs_manager_id ON upload_jobs (manager_id);
+
+-- Envelope data keys: one per manager encrypts that manager's patient PII.
+-- Stored only wrapped (encrypted) by the master key; see app/data_keys.py.
+CREATE TABLE data_keys (
+    id SERIAL PRIMARY KEY,
+    key_id VARCHAR(8) NOT NULL UNIQUE, -- Key id of the unwrapped key, as in ciphertext headers
+    manager_id INTEGER UNIQUE REFERENCES users(id), -- NULL: shared search/sort token key
+    wrapped_key VARCHAR NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
 -- 6. Audit Logs
 CREATE TABLE audit_logs (
@@ -54,3 +123,16 @@ CREATE TABLE audit_logs (
     details VARCHAR,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX ix_audit_logs_timestamp ON audit_logs (timestamp, id);
+CREATE INDEX ix_audit_logs_user_timestamp ON audit_logs (user_id, timestamp, id);
+CREATE INDEX ix_audit_logs_action_timestamp ON audit_logs (action, timestamp, id);
+-- python -m app.audit_archive partition converts this table in place into monthly
+-- range partitions on timestamp (PRIMARY KEY (id, timestamp)); the rows above
+-- become its DEFAULT partition.
+
+-- 7. Schema Migrations (versions applied by python -m app.migrations)
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
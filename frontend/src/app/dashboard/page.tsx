@@ -33,6 +33,13 @@ interface Patient {
     gender: string;
 }
 
+// Upload job polling gives up after this long without any progress
+const UPLOAD_STALL_MS = 5 * 60 * 1000;
+
+// API calls send cookies, so the read-your-writes marker set by write responses
+// comes back with the following reads (see backend/app/replica.py)
+const apiFetch = (url: string, init: RequestInit = {}) => fetch(url, { credentials: "include", ...init });
+
 // --- ICONS ---
 const Icons = {
     Home: () => <svg className="w-5 h-5" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M3 12l2-2m0 0l7-7 7 7M5 10v10a1 1 0 001 1h3m10-11l2 2m-2-2v10a1 1 0 01-1 1h-3m-6 0a1 1 0 001-1v-4a1 1 0 011-1h2a1 1 0 011 1v4a1 1 0 001 1m-6 0h6" /></svg>,
@@ -63,7 +70,7 @@ export default function Dashboard() {
 
   const fetchUser = async (token: string) => {
     try {
-        const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/users/me`, {
+        const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/users/me`, {
             headers: { Authorization: `Bearer ${token}` },
         });
         if (!res.ok) throw new Error("Failed");
@@ -272,7 +279,7 @@ function ProfileView({ user, onUpdate }: { user: User, onUpdate: () => void }) {
     const handleSubmit = async (e: React.FormEvent) => {
         e.preventDefault();
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/users/me/profile`, {
+            const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/users/me/profile`, {
                 method: "PUT",
                 headers: { "Content-Type": "application/json", Authorization: `Bearer ${localStorage.getItem("token")}` },
                 body: JSON.stringify({ full_name: formData.full_name, phone_number: formData.phone })
@@ -359,7 +366,7 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
 
     const handleDownloadTemplate = async () => {
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/template`, {
+            const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/template`, {
                 headers: {
                     Authorization: `Bearer ${localStorage.getItem("token")}`
                 }
@@ -393,7 +400,7 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
 
     const loadPatients = async () => {
         const query = `?search=${search}&skip=${page*pageSize}&limit=${pageSize}&sort_by=${sortBy}`;
-        const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${query}`, {
+        const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${query}`, {
             headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
         });
         if(res.ok) {
@@ -423,30 +430,48 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
         const fd = new FormData();
         fd.append("file", selectedFile);
         
-        const timer = setInterval(() => setUploadProgress(p => p < 90 ? p + 5 : p), 200);
+        const api = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
+        const headers = { Authorization: `Bearer ${localStorage.getItem("token")}` };
         
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/upload`, {
-                method: "POST",
-                headers: { Authorization: `Bearer ${localStorage.getItem("token")}` },
-                body: fd
-            });
+            const res = await apiFetch(`${api}/patients/upload`, { method: "POST", headers, body: fd });
             
-            clearInterval(timer);
-            setUploadProgress(100);
-            
-            if(res.ok) {
-                setNotification({msg: "Spreadsheet processed successfully", type: 'success'});
-                loadPatients();
-                setTimeout(() => { setSelectedFile(null); setNotification(null); }, 1000); 
-            } else if (res.status === 403) {
-                 setNotification({msg: "Access Denied: Ask permission from admin", type: 'error'});
-            } else {
+            if (res.status === 403) {
+                setNotification({msg: "Access Denied: Ask permission from admin", type: 'error'});
+            } else if (!res.ok) {
                 const d = await res.json();
                 setNotification({msg: d.detail || "Upload Failed", type: 'error'});
+            } else {
+                // The file is processed in the background; poll the job for real progress
+                // Stop waiting if the job makes no progress for UPLOAD_STALL_MS (e.g. the server restarted)
+                const { job_id } = await res.json();
+                let job: any = null;
+                let lastState = "";
+                let lastChange = Date.now();
+                while (!job || (job.status !== "completed" && job.status !== "failed")) {
+                    if (Date.now() - lastChange > UPLOAD_STALL_MS) break;
+                    await new Promise(r => setTimeout(r, 500));
+                    const jr = await apiFetch(`${api}/patients/upload-jobs/${job_id}`, { headers });
+                    if (!jr.ok) throw new Error("poll failed");
+                    job = await jr.json();
+                    const state = `${job.status}:${job.rows_parsed}:${job.rows_inserted}`;
+                    if (state !== lastState) { lastState = state; lastChange = Date.now(); }
+                    const done = job.rows_total ? job.rows_inserted / job.rows_total : 0;
+                    setUploadProgress(p => Math.max(p, Math.min(95, 5 + done * 90)));
+                }
+                setUploadProgress(100);
+                
+                if (job.status !== "completed" && job.status !== "failed") {
+                    setNotification({msg: "Upload is taking too long. Check back later or upload the file again.", type: 'error'});
+                } else if (job.status === "completed") {
+                    setNotification({msg: `Spreadsheet processed successfully (${job.rows_inserted} patients)`, type: 'success'});
+                    loadPatients();
+                    setTimeout(() => { setSelectedFile(null); setNotification(null); }, 1000); 
+                } else {
+                    setNotification({msg: job.error || "Upload Failed", type: 'error'});
+                }
             }
         } catch { 
-            clearInterval(timer);
             setNotification({msg: "Network Error", type: 'error'}); 
         }
         setTimeout(() => setUploading(false), 1000);
@@ -476,7 +501,7 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
     const saveEdit = async () => {
         if(!editingId) return;
         try {
-             const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${editingId}`, {
+             const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${editingId}`, {
                 method: "PATCH",
                 headers: { "Content-Type": "application/json", Authorization: `Bearer ${localStorage.getItem("token")}` },
                 body: JSON.stringify(editForm)
@@ -496,7 +521,7 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
     const handleDelete = async (id: number) => {
         if(!window.confirm("Confirm deletion of this encrypted record?")) return;
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${id}`, {
+            const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/${id}`, {
                 method: "DELETE",
                 headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
             });
@@ -532,7 +557,7 @@ function PatientManager({ canCreate, canUpdate, canDelete }: any) {
         if(!window.confirm(`Permanently delete ${selectedIds.size} records?`)) return;
         
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/bulk-delete`, {
+            const res = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/bulk-delete`, {
                 method: "POST",
                 headers: { 
                     "Content-Type": "application/json",
@@ -851,21 +876,21 @@ function UserManager() {
     }, [msg]);
 
     const loadRefData = () => {
-        fetch(`${api}/admin/roles`, { headers: authHeaders }).then(r => r.json()).then(setRoles);
-        fetch(`${api}/admin/locations`, { headers: authHeaders }).then(r => r.json()).then(setLocations);
-        fetch(`${api}/admin/teams`, { headers: authHeaders }).then(r => r.json()).then(setTeams);
-        fetch(`${api}/admin/permissions`, { headers: authHeaders }).then(r => r.json()).then(setPermissions);
+        apiFetch(`${api}/admin/roles`, { headers: authHeaders }).then(r => r.json()).then(setRoles);
+        apiFetch(`${api}/admin/locations`, { headers: authHeaders }).then(r => r.json()).then(setLocations);
+        apiFetch(`${api}/admin/teams`, { headers: authHeaders }).then(r => r.json()).then(setTeams);
+        apiFetch(`${api}/admin/permissions`, { headers: authHeaders }).then(r => r.json()).then(setPermissions);
     };
 
     const loadUsers = () => {
-        fetch(`${api}/admin/users`, { headers: authHeaders }).then(r => r.json()).then(d => { if(Array.isArray(d)) setUsers(d); });
+        apiFetch(`${api}/admin/users`, { headers: authHeaders }).then(r => r.json()).then(d => { if(Array.isArray(d)) setUsers(d); });
     };
     
     useEffect(() => { loadUsers(); loadRefData(); }, []);
 
     const createUser = async () => {
         try {
-            const res = await fetch(`${api}/admin/users`, {
+            const res = await apiFetch(`${api}/admin/users`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json", ...authHeaders },
                 body: JSON.stringify({
@@ -904,7 +929,7 @@ function UserManager() {
     const updateUser = async () => {
         if (!editingUser) return;
         try {
-            const res = await fetch(`${api}/admin/users/${editingUser.id}`, {
+            const res = await apiFetch(`${api}/admin/users/${editingUser.id}`, {
                 method: "PUT",
                 headers: { "Content-Type": "application/json", ...authHeaders },
                 body: JSON.stringify({
@@ -927,7 +952,7 @@ function UserManager() {
 
     const addLocation = async () => {
         if(!newLoc) return;
-        const res = await fetch(`${api}/admin/locations`, {
+        const res = await apiFetch(`${api}/admin/locations`, {
             method: "POST",
             headers: { "Content-Type": "application/json", ...authHeaders },
             body: JSON.stringify({ name: newLoc })
@@ -937,7 +962,7 @@ function UserManager() {
 
     const addTeam = async () => {
         if(!newTeam) return;
-        const res = await fetch(`${api}/admin/teams`, {
+        const res = await apiFetch(`${api}/admin/teams`, {
             method: "POST",
             headers: { "Content-Type": "application/json", ...authHeaders },
             body: JSON.stringify({ name: newTeam })
@@ -946,13 +971,13 @@ function UserManager() {
     };
 
     const handleUnlock = async (id: number) => {
-        const res = await fetch(`${api}/admin/users/${id}/unlock`, { method: "POST", headers: authHeaders });
+        const res = await apiFetch(`${api}/admin/users/${id}/unlock`, { method: "POST", headers: authHeaders });
         if(res.ok) { setMsg({text: "User Unblocked", type: "success"}); loadUsers(); }
     };
 
     const confirmReset = async () => {
         if(!resetId || !newPass) return;
-        const res = await fetch(`${api}/admin/users/${resetId}/reset-password`, {
+        const res = await apiFetch(`${api}/admin/users/${resetId}/reset-password`, {
             method: "POST",
             headers: { "Content-Type": "application/json", ...authHeaders },
             body: JSON.stringify({ new_password: newPass })
@@ -963,7 +988,7 @@ function UserManager() {
 
     const addRole = async () => {
         if(!newRole) return;
-        const res = await fetch(`${api}/admin/roles`, {
+        const res = await apiFetch(`${api}/admin/roles`, {
             method: "POST",
             headers: { "Content-Type": "application/json", ...authHeaders },
             body: JSON.stringify({ name: newRole })
@@ -973,7 +998,7 @@ function UserManager() {
 
     const updateRolePerms = async () => {
         if(!selectedRole) return;
-        const res = await fetch(`${api}/admin/roles/${selectedRole.id}/permissions`, {
+        const res = await apiFetch(`${api}/admin/roles/${selectedRole.id}/permissions`, {
             method: "PUT",
             headers: { "Content-Type": "application/json", ...authHeaders },
             body: JSON.stringify({ permission_ids: rolePerms })
@@ -1263,7 +1288,7 @@ function AuditViewer() {
     const [filter, setFilter] = useState("");
 
      useEffect(() => {
-        fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/admin/audit-logs`, {
+        apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/admin/audit-logs`, {
             headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
         }).then(r => r.json()).then(d => { if(Array.isArray(d)) setLogs(d); });
     }, []);
@@ -1336,7 +1361,7 @@ function ReportsView() {
              try {
                  // Fetch aggregated stats from the secure backend endpoint
                  // This endpoint performs calculations server-side and does not expose PII
-                 const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/stats`, { 
+                 const response = await apiFetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/patients/stats`, { 
                      headers: { Authorization: `Bearer ${token}` } 
                  });
 